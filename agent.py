@@ -1,15 +1,79 @@
-import os
+import sys
 import json
-from dotenv import load_dotenv
-from openai import OpenAI
-from utils import get_devices, control_device, set_ceiling_light_brightness, set_ceiling_light_color_temp
-from scheduler import add_schedule, get_schedules, remove_schedule
+import math
+import time
+import hashlib
+import argparse
+import contextlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import settings, get_env
+from utils import control_device, get_device_status, set_ceiling_light_brightness, set_ceiling_light_color_temp
+from device_registry import get_device_list
+from intent_parser import parse_intent, DEFAULT_MIN_CONFIDENCE
+from history import compact_history
+from device_resolver import resolve_device
+import metrics
+from metrics import span
+from log import get_logger, bind, new_request_id
+from worker_pool import KeyedWorkerPool
+from scheduler import add_schedule, get_schedules, get_schedule, remove_schedule, set_schedule_enabled
+from scenes import (get_scenes, get_scene, save_scene, delete_scene, make_step, run_scene,
+                    find_scene_in_text, format_step, format_scene_result)
 
-# 環境変数を読み込む
-load_dotenv()
+logger = get_logger("agent")
 
-# OpenAIクライアントを初期化
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OpenAIクライアント（最初にOpenAIを呼ぶときに作成）
+client = None
+_client_lock = threading.Lock()
+
+def get_openai_client():
+    """OpenAIクライアントを取得（初回はOPENAI_API_KEYを確認して作成）
+
+    openaiパッケージの読み込みは重いため、OpenAIを使わない処理（ローカル意図解析・シーン）では読み込まない。
+
+    Raises:
+        ValueError: OPENAI_API_KEYが設定されていない
+    """
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from openai import OpenAI
+                client = OpenAI(api_key=settings.require("openai_api_key"))
+    return client
+
+def preload_openai_client():
+    """バックグラウンドでOpenAIクライアントを作成しておく（最初のリクエストで読み込みを待たない）"""
+    def run():
+        try:
+            get_openai_client()
+        except ValueError as e:
+            logger.warning("OpenAIクライアントを準備できません", error=str(e))
+
+    threading.Thread(target=run, name="openai-preload", daemon=True).start()
+
+# 使用するモデル（コスト効率の良いモデル）
+OPENAI_MODEL = "gpt-4o-mini"
+
+# ツール実行結果をモデルに渡して応答文をまとめるか（追加のAPI呼び出しが1回発生）
+TOOL_RESULT_FOLLOWUP = get_env("TOOL_RESULT_FOLLOWUP", "0") == "1"
+
+# 並列実行できるデバイス操作ツールと最大同時実行数
+PARALLEL_TOOLS = {"control_switchbot_device", "set_light_brightness", "set_light_color_temperature", "run_scene",
+                  "get_device_status"}
+MAX_PARALLEL_TOOL_CALLS = 5
+
+# 会話履歴に使う最大トークン数と、そのまま残す直近のメッセージ数
+HISTORY_TOKEN_BUDGET = get_env("HISTORY_TOKEN_BUDGET", 1500, int)
+HISTORY_KEEP_LAST = get_env("HISTORY_KEEP_LAST", 6, int)
+
+# バッチモードで同時に処理する指示の数（--parallelで変更可能）
+AGENT_BATCH_PARALLEL = get_env("AGENT_BATCH_PARALLEL", 4, int)
+
+# ローカル意図解析の最低確信度（これ未満はOpenAIで処理、1より大きくすると無効化）
+LOCAL_INTENT_MIN_CONFIDENCE = get_env("LOCAL_INTENT_MIN_CONFIDENCE", DEFAULT_MIN_CONFIDENCE, float)
 
 # デバイスタイプごとの操作コマンドマッピング
 DEVICE_COMMANDS = {
@@ -47,29 +111,16 @@ DEVICE_COMMANDS = {
 }
 
 def get_device_info():
-    """デバイス情報を取得して整形"""
-    devices_data = get_devices()
-    device_list = []
-
-    if devices_data.get("statusCode") == 100:
-        for device in devices_data["body"]["deviceList"]:
-            device_list.append({
-                "id": device["deviceId"],
-                "name": device["deviceName"],
-                "type": device["deviceType"]
-            })
-
-    return device_list
+    """デバイス情報を取得（共有キャッシュから）"""
+    return get_device_list()
 
 def find_device_by_name(device_name, devices):
-    """デバイス名からデバイスを検索（部分一致）"""
-    for device in devices:
-        if device_name.lower() in device["name"].lower() or device["name"].lower() in device_name.lower():
-            return device
-    return None
+    """デバイス名からデバイスを検索（あいまい検索で最もスコアの高いもの）"""
+    candidates = resolve_device(device_name, devices, limit=1)
+    return candidates[0][0] if candidates else None
 
-def execute_device_command(device_id, device_type, action):
-    """デバイスコマンドを実行"""
+def resolve_command(device_type, action):
+    """操作の表記（「消す」「lock」など）をAPIのコマンドに変換"""
     command_map = DEVICE_COMMANDS.get(device_type, {})
     command = command_map.get(action)
 
@@ -82,9 +133,91 @@ def execute_device_command(device_id, device_type, action):
         else:
             command = action
 
-    result = control_device(device_id, command)
+    return command
+
+def execute_device_command(device_id, device_type, action):
+    """デバイスコマンドを実行"""
+    result = control_device(device_id, resolve_command(device_type, action))
     return result
 
+def apply_device_action(device, action):
+    """デバイスを操作して結果メッセージを返す"""
+    result = execute_device_command(device["id"], device["type"], action)
+
+    if result.get("skipped"):
+        return f"OK: {device['name']}は既にその状態です（{action}を省略しました）"
+    if result.get("statusCode") == 100:
+        return f"OK: {device['name']}を{action}しました！"
+    return f"エラー: {device['name']}の操作に失敗しました。\n詳細: {result}"
+
+def apply_brightness(device, brightness):
+    """シーリングライトの明るさを設定して結果メッセージを返す"""
+    result = set_ceiling_light_brightness(device["id"], brightness)
+
+    if result.get("statusCode") == 100:
+        sent = result.get("coalesced_into")
+        if sent:
+            # 続けて指示された値にまとめて送信した
+            return f"OK: {device['name']}の明るさを{sent['parameter']}%に設定しました（後の指示の値にまとめました）！"
+        return f"OK: {device['name']}の明るさを{brightness}%に設定しました！"
+    return f"エラー: {device['name']}の明るさ設定に失敗しました。\n詳細: {result}"
+
+def apply_color_temp(device, color_temp):
+    """シーリングライトの色温度を設定して結果メッセージを返す"""
+    result = set_ceiling_light_color_temp(device["id"], color_temp)
+
+    if result.get("statusCode") == 100:
+        sent = result.get("coalesced_into")
+        if sent:
+            return f"OK: {device['name']}の色温度を{sent['parameter']}Kに設定しました（後の指示の値にまとめました）！"
+        return f"OK: {device['name']}の色温度を{color_temp}に設定しました！"
+    return f"エラー: {device['name']}の色温度設定に失敗しました。\n詳細: {result}"
+
+# ステータスの項目の表示名
+STATUS_LABELS = {
+    "power": "電源",
+    "brightness": "明るさ",
+    "colorTemperature": "色温度",
+    "slidePosition": "開閉位置",
+    "moving": "動作中",
+    "lockState": "施錠状態",
+    "doorState": "ドア",
+    "battery": "バッテリー",
+    "voltage": "電圧",
+    "weight": "消費電力",
+    "electricCurrent": "電流",
+}
+
+def describe_status(device):
+    """デバイスのステータスを取得して説明文を返す"""
+    result = get_device_status(device["id"])
+
+    if result.get("statusCode") != 100:
+        return f"エラー: {device['name']}のステータス取得に失敗しました。\n詳細: {result}"
+
+    lines = [f"{device['name']}のステータス:"]
+    for key, value in result.get("body", {}).items():
+        if key in STATUS_LABELS:
+            lines.append(f"- {STATUS_LABELS[key]}: {value}")
+    return "\n".join(lines)
+
+def execute_local_intent(intent, device_info_text):
+    """ローカル意図解析の結果を実行
+
+    Args:
+        intent: parse_intentの戻り値
+        device_info_text: デバイス一覧のテキスト
+    """
+    kind = intent["kind"]
+
+    if kind == "list_devices":
+        return f"利用可能なデバイス:\n{device_info_text}"
+    if kind == "brightness":
+        return apply_brightness(intent["device"], intent["value"])
+    if kind == "color_temp":
+        return apply_color_temp(intent["device"], intent["value"])
+    return apply_device_action(intent["device"], intent["action"])
+
 # Function calling用の関数定義
 tools = [
     {
@@ -164,7 +297,12 @@ tools = [
                     },
                     "time": {
                         "type": "string",
-                        "description": "実行時刻（HH:MM形式、例：07:00、19:30）"
+                        "description": "実行時刻。HH:MM形式（例：07:00、19:30）、日の出/日の入りからの分（例：sunrise+30、sunset-15）、またはcron形式（例：cron:0 7 * * 1-5）"
+                    },
+                    "weekdays": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "実行する曜日（例：[\"mon\", \"tue\", \"wed\", \"thu\", \"fri\"]）。省略すると毎日"
                     },
                     "action": {
                         "type": "string",
@@ -195,6 +333,165 @@ tools = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "remove_device_schedule",
+            "description": "登録されているスケジュールを削除します。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "schedule_id": {
+                        "type": "string",
+                        "description": "スケジュールID、またはスケジュール一覧の番号（例：a1b2c3d4、2）"
+                    }
+                },
+                "required": ["schedule_id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "set_device_schedule_enabled",
+            "description": "スケジュールを削除せずに有効/無効を切り替えます。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "schedule_id": {
+                        "type": "string",
+                        "description": "スケジュールID、またはスケジュール一覧の番号（例：a1b2c3d4、2）"
+                    },
+                    "enabled": {
+                        "type": "boolean",
+                        "description": "trueで有効、falseで無効"
+                    }
+                },
+                "required": ["schedule_id", "enabled"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "run_scene",
+            "description": "登録されているシーン（複数デバイスの操作のまとまり、例：おやすみモード）を実行します。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "scene_name": {
+                        "type": "string",
+                        "description": "シーン名（例：おやすみモード）"
+                    }
+                },
+                "required": ["scene_name"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "save_scene",
+            "description": "複数デバイスの操作をシーンとして保存します（同じ名前のシーンは置き換え）。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "scene_name": {
+                        "type": "string",
+                        "description": "シーン名（例：おやすみモード）"
+                    },
+                    "steps": {
+                        "type": "array",
+                        "description": "実行する操作のリスト",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "device_name": {"type": "string", "description": "デバイス名"},
+                                "action": {"type": "string", "description": "実行する操作（例：turnOn、turnOff、lock、setBrightness）"},
+                                "brightness": {"type": "integer", "description": "明るさ（setBrightnessの場合のみ、1-100）"},
+                                "color_temp": {"type": "string", "description": "色温度（setColorTemperatureの場合のみ）"},
+                                "stage": {"type": "integer", "description": "実行順（小さい順に実行、同じ値は同時に実行。例：施錠を最後にするなら1）"}
+                            },
+                            "required": ["device_name", "action"]
+                        }
+                    }
+                },
+                "required": ["scene_name", "steps"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_scenes",
+            "description": "登録されているシーンの一覧を取得します。",
+            "parameters": {
+                "type": "object",
+                "properties": {},
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "delete_scene",
+            "description": "登録されているシーンを削除します。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "scene_name": {
+                        "type": "string",
+                        "description": "シーン名"
+                    }
+                },
+                "required": ["scene_name"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "add_scene_schedule",
+            "description": "シーンを指定時刻に自動実行するスケジュールを追加します。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "scene_name": {
+                        "type": "string",
+                        "description": "シーン名（例：おやすみモード）"
+                    },
+                    "time": {
+                        "type": "string",
+                        "description": "実行時刻。HH:MM形式（例：23:00）、日の出/日の入りからの分（例：sunset+30）、またはcron形式（例：cron:0 23 * * 0-4）"
+                    },
+                    "weekdays": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "実行する曜日（例：[\"mon\", \"fri\"]）。省略すると毎日"
+                    }
+                },
+                "required": ["scene_name", "time"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_device_status",
+            "description": "デバイスの現在の状態（電源、明るさ、施錠状態、開閉位置など）を取得します。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "device_name": {
+                        "type": "string",
+                        "description": "デバイス名（例：玄関ロック、シーリングライト）"
+                    }
+                },
+                "required": ["device_name"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -209,24 +506,15 @@ tools = [
     }
 ]
 
-def process_user_request(user_input, conversation_history=None):
-    """ユーザーのリクエストを処理
+# ツール定義のバージョン（ログ用のハッシュ、起動時に1回だけ計算）
+# ツール定義自体はリクエストごとにOpenAI SDKがシリアライズする
+TOOLS_VERSION = hashlib.sha1(json.dumps(tools, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:8]
 
-    Args:
-        user_input: ユーザーの入力
-        conversation_history: 会話履歴のリスト（[{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]）
-    """
-    # デバイス情報を取得
-    devices = get_device_info()
-    device_info_text = "\n".join([f"- {d['name']} ({d['type']})" for d in devices])
-
-    # システムプロンプト
-    system_prompt = f"""あなたはSwitchbotデバイスを操作するアシスタントです。
-以下のデバイスが利用可能です：
+# 固定のシステムプロンプト（リクエストごとに変わる内容を含めない）
+SYSTEM_PROMPT = """あなたはSwitchbotデバイスを操作するアシスタントです。
+利用可能なデバイスは、この後の「利用可能なデバイス」で渡されます。
 
-{device_info_text}
-
-重要: 関数を呼び出す際は、上記のデバイスリストから実際のデバイス名を使用してください。
+重要: 関数を呼び出す際は、デバイスリストにある実際のデバイス名を使用してください。
 デバイス名は部分一致で検索されますが、できるだけ正確な名前を使ってください。
 例：
 - ユーザー: 「カーテン」→ device_name: 「カーテン1」または「カーテン」
@@ -237,154 +525,539 @@ def process_user_request(user_input, conversation_history=None):
 - 明るさ調整: 1-100%で指定（例：「明るさを50%に」「半分の明るさに」）
 - 色温度調整: 暖色/warm（暖かい色）、昼白色/neutral（中間色）、寒色/cool/白（白い色）
 
+「鍵は閉まってる？」のような状態の質問には、get_device_statusで現在の状態を確認して答えてください。
+
+複数のデバイスをまとめて操作する「シーン」（例：おやすみモード）を保存・実行できます。
+登録済みのシーン名が指定された場合は、個別のデバイス操作ではなくrun_sceneを使ってください。
+
 会話履歴を参照して文脈を理解してください。
 例：前のメッセージで「シーリングライト」について話していた場合、「暗くして」という指示は「シーリングライトを暗くする」という意味です。
 """
 
+# デバイス一覧ブロック（デバイスが変わった時だけ作り直す、複数のワーカーから使うためロックで保護）
+_device_block = {"key": None, "version": None, "text": ""}
+_device_block_lock = threading.Lock()
+
+# プロンプトキャッシュの利用状況（_prompt_cache_lockで保護）
+prompt_cache_stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "cache_hits": 0}
+_prompt_cache_lock = threading.Lock()
+
+# OpenAIのトークン数（prompt / cached / completion）と、OpenAIを使わずに処理した件数
+LLM_TOKENS = metrics.counter("llm_tokens_total", "OpenAIのトークン数", ["kind"])
+LOCAL_REQUESTS = metrics.counter("local_requests_total", "OpenAIを使わずに処理したリクエスト数", ["kind"])
+
+def prompt_cache_hit_ratio():
+    """プロンプトキャッシュのヒット率"""
+    with _prompt_cache_lock:
+        return prompt_cache_stats["cache_hits"] / max(1, prompt_cache_stats["requests"])
+
+metrics.gauge("prompt_cache_hit_ratio", "プロンプトキャッシュのヒット率", prompt_cache_hit_ratio)
+
+def build_device_block(devices):
+    """デバイス一覧のプロンプトを作成
+
+    Returns:
+        (バージョン, テキスト) バージョンはデバイス一覧の内容から決まるハッシュ
+    """
+    key = tuple((d["id"], d["name"], d["type"]) for d in devices)
+    with _device_block_lock:
+        if key != _device_block["key"]:
+            device_info_text = "\n".join([f"- {d['name']} ({d['type']})" for d in devices])
+            text = f"利用可能なデバイス：\n\n{device_info_text}"
+            _device_block.update(
+                key=key,
+                version=hashlib.sha1(text.encode("utf-8")).hexdigest()[:8],
+                text=text
+            )
+        return _device_block["version"], _device_block["text"]
+
+def record_prompt_usage(response, device_block_version):
+    """プロンプトのトークン数とキャッシュヒット状況を記録してログに出力"""
+    usage = getattr(response, "usage", None)
+    if not usage:
+        return
+
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+
+    with _prompt_cache_lock:
+        prompt_cache_stats["requests"] += 1
+        prompt_cache_stats["prompt_tokens"] += usage.prompt_tokens
+        prompt_cache_stats["cached_tokens"] += cached_tokens
+        prompt_cache_stats["cache_hits"] += 1 if cached_tokens else 0
+        hit_rate = prompt_cache_stats["cache_hits"] / prompt_cache_stats["requests"]
+    LLM_TOKENS.inc(usage.prompt_tokens, kind="prompt")
+    LLM_TOKENS.inc(cached_tokens, kind="cached")
+    LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+
+    logger.info("プロンプト", prompt_tokens=usage.prompt_tokens, cached_tokens=cached_tokens,
+                hit_rate=round(hit_rate, 3), device_block=device_block_version, tools=TOOLS_VERSION)
+
+def process_user_request(user_input, conversation_history=None):
+    """ユーザーのリクエストを処理
+
+    Args:
+        user_input: ユーザーの入力
+        conversation_history: 会話履歴のリスト（[{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]）
+    """
+    # デバイス情報を取得
+    with span("device_list"):
+        devices = get_device_info()
+    device_info_text = "\n".join([f"- {d['name']} ({d['type']})" for d in devices])
+
+    # シーン名での実行指示はOpenAIを呼ばずにそのまま実行
+    scene = find_scene_in_text(user_input)
+    if scene:
+        LOCAL_REQUESTS.inc(kind="scene")
+        return format_scene_result(run_scene(scene))
+
+    # 単純なコマンドはOpenAIを呼ばずにローカルで処理
+    intent = parse_intent(user_input, devices)
+    if intent and intent["confidence"] >= LOCAL_INTENT_MIN_CONFIDENCE:
+        LOCAL_REQUESTS.inc(kind=intent["kind"])
+        return execute_local_intent(intent, device_info_text)
+
     # OpenAI APIを呼び出し
+    # 固定のシステムプロンプト → デバイス一覧（変更時のみ変わる）→ 会話履歴 → 入力 の順に並べ、
+    # 先頭部分をプロバイダー側のプロンプトキャッシュに乗せる
+    device_block_version, device_block = build_device_block(devices)
     messages = [
-        {"role": "system", "content": system_prompt}
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": device_block}
     ]
 
-    # 会話履歴を追加
+    # 会話履歴を追加（トークン予算内に圧縮）
     if conversation_history:
-        messages.extend(conversation_history)
+        history, history_stats = compact_history(conversation_history, HISTORY_TOKEN_BUDGET, HISTORY_KEEP_LAST)
+        if history_stats["saved_tokens"]:
+            logger.info("会話履歴を圧縮", **history_stats)
+        messages.extend(history)
 
     # 現在のユーザー入力を追加
     messages.append({"role": "user", "content": user_input})
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",  # コスト効率の良いモデル
-        messages=messages,
-        tools=tools,
-        tool_choice="auto"
-    )
+    with span("llm"):
+        response = get_openai_client().chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=messages,
+            tools=tools,
+            tool_choice="auto"
+        )
+
+    record_prompt_usage(response, device_block_version)
 
     response_message = response.choices[0].message
     tool_calls = response_message.tool_calls
 
-    # Function callingが呼び出された場合
+    # Function callingが呼び出された場合（全ての呼び出しを実行）
     if tool_calls:
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            function_args = json.loads(tool_call.function.arguments)
+        with span("tool_dispatch"):
+            results = execute_tool_calls(tool_calls, devices, device_info_text)
 
-            if function_name == "get_device_list":
-                return f"利用可能なデバイス:\n{device_info_text}"
+        # 実行結果をモデルに渡して1回で応答文をまとめる（任意）
+        if TOOL_RESULT_FOLLOWUP:
+            messages.append(response_message.model_dump(exclude_none=True))
+            for tool_call, result in zip(tool_calls, results):
+                messages.append({"role": "tool", "tool_call_id": tool_call.id, "content": result})
 
-            elif function_name == "control_switchbot_device":
-                device_name = function_args["device_name"]
-                action = function_args["action"]
+            with span("llm"):
+                followup = get_openai_client().chat.completions.create(model=OPENAI_MODEL, messages=messages)
+            record_prompt_usage(followup, device_block_version)
+            return followup.choices[0].message.content or "\n".join(results)
 
-                # デバイスを検索
-                device = find_device_by_name(device_name, devices)
+        return "\n".join(results)
 
-                if not device:
-                    return f"エラー: '{device_name}'というデバイスが見つかりません。\n利用可能なデバイス:\n{device_info_text}"
+    # Function callingが呼び出されなかった場合
+    return response_message.content
 
-                # デバイスを操作
-                result = execute_device_command(device["id"], device["type"], action)
+def execute_tool_call(function_name, function_args, devices, device_info_text):
+    """1つのFunction callingを実行して結果メッセージを返す
 
-                if result.get("statusCode") == 100:
-                    return f"OK: {device['name']}を{action}しました！"
-                else:
-                    return f"エラー: {device['name']}の操作に失敗しました。\n詳細: {result}"
+    Args:
+        function_name: 関数名
+        function_args: 関数の引数（辞書）
+        devices: デバイスリスト
+        device_info_text: デバイス一覧のテキスト
+    """
+    if function_name == "get_device_list":
+        return f"利用可能なデバイス:\n{device_info_text}"
 
-            elif function_name == "set_light_brightness":
-                device_name = function_args["device_name"]
-                brightness = function_args["brightness"]
+    elif function_name == "get_device_status":
+        device_name = function_args["device_name"]
 
-                # デバイスを検索
-                device = find_device_by_name(device_name, devices)
+        # デバイスを検索
+        device = find_device_by_name(device_name, devices)
 
-                if not device:
-                    return f"エラー: '{device_name}'というデバイスが見つかりません。\n利用可能なデバイス:\n{device_info_text}"
+        if not device:
+            return f"エラー: '{device_name}'というデバイスが見つかりません。\n利用可能なデバイス:\n{device_info_text}"
 
-                # 明るさを設定
-                result = set_ceiling_light_brightness(device["id"], brightness)
+        return describe_status(device)
 
-                if result.get("statusCode") == 100:
-                    return f"OK: {device['name']}の明るさを{brightness}%に設定しました！"
-                else:
-                    return f"エラー: {device['name']}の明るさ設定に失敗しました。\n詳細: {result}"
+    elif function_name == "control_switchbot_device":
+        device_name = function_args["device_name"]
 
-            elif function_name == "set_light_color_temperature":
-                device_name = function_args["device_name"]
-                color_temp = function_args["color_temp"]
+        # デバイスを検索
+        device = find_device_by_name(device_name, devices)
 
-                # デバイスを検索
-                device = find_device_by_name(device_name, devices)
+        if not device:
+            return f"エラー: '{device_name}'というデバイスが見つかりません。\n利用可能なデバイス:\n{device_info_text}"
 
-                if not device:
-                    return f"エラー: '{device_name}'というデバイスが見つかりません。\n利用可能なデバイス:\n{device_info_text}"
+        # デバイスを操作
+        return apply_device_action(device, function_args["action"])
 
-                # 色温度を設定
-                result = set_ceiling_light_color_temp(device["id"], color_temp)
+    elif function_name == "set_light_brightness":
+        device_name = function_args["device_name"]
 
-                if result.get("statusCode") == 100:
-                    return f"OK: {device['name']}の色温度を{color_temp}に設定しました！"
-                else:
-                    return f"エラー: {device['name']}の色温度設定に失敗しました。\n詳細: {result}"
+        # デバイスを検索
+        device = find_device_by_name(device_name, devices)
 
-            elif function_name == "add_device_schedule":
-                device_name = function_args["device_name"]
-                time_str = function_args["time"]
-                action = function_args["action"]
+        if not device:
+            return f"エラー: '{device_name}'というデバイスが見つかりません。\n利用可能なデバイス:\n{device_info_text}"
 
-                # デバイスを検索
-                device = find_device_by_name(device_name, devices)
+        # 明るさを設定
+        return apply_brightness(device, function_args["brightness"])
 
-                if not device:
-                    return f"エラー: '{device_name}'というデバイスが見つかりません。\n利用可能なデバイス:\n{device_info_text}"
+    elif function_name == "set_light_color_temperature":
+        device_name = function_args["device_name"]
 
-                # パラメータを取得
-                params = {}
-                if "brightness" in function_args:
-                    params["brightness"] = function_args["brightness"]
-                if "color_temp" in function_args:
-                    params["color_temp"] = function_args["color_temp"]
+        # デバイスを検索
+        device = find_device_by_name(device_name, devices)
 
-                # スケジュールを追加
-                schedule_item = add_schedule(
-                    time_str,
-                    device["id"],
-                    device["name"],
-                    action,
-                    **params
-                )
+        if not device:
+            return f"エラー: '{device_name}'というデバイスが見つかりません。\n利用可能なデバイス:\n{device_info_text}"
 
-                param_text = ""
-                if params:
-                    param_text = f"（{', '.join([f'{k}={v}' for k, v in params.items()])}）"
+        # 色温度を設定
+        return apply_color_temp(device, function_args["color_temp"])
 
-                return f"OK: {device['name']}を{time_str}に{action}{param_text}するスケジュールを追加しました！"
+    elif function_name == "add_device_schedule":
+        device_name = function_args["device_name"]
+        time_str = function_args["time"]
+        action = function_args["action"]
 
-            elif function_name == "get_schedules":
-                schedule_list = get_schedules()
+        # デバイスを検索
+        device = find_device_by_name(device_name, devices)
 
-                if not schedule_list:
-                    return "登録されているスケジュールはありません。"
+        if not device:
+            return f"エラー: '{device_name}'というデバイスが見つかりません。\n利用可能なデバイス:\n{device_info_text}"
 
-                result_text = "登録済みスケジュール:\n"
-                for i, item in enumerate(schedule_list):
-                    params_text = ""
-                    if item.get("params"):
-                        params_text = f" ({', '.join([f'{k}={v}' for k, v in item['params'].items()])})"
+        # パラメータを取得
+        params = {}
+        if "brightness" in function_args:
+            params["brightness"] = function_args["brightness"]
+        if "color_temp" in function_args:
+            params["color_temp"] = function_args["color_temp"]
 
-                    result_text += f"{i+1}. {item['time']} - {item['device_name']} - {item['action']}{params_text}\n"
+        # スケジュールを追加
+        add_schedule(
+            time_str,
+            device["id"],
+            device["name"],
+            action,
+            weekdays=function_args.get("weekdays"),
+            **params
+        )
 
-                return result_text
+        param_text = ""
+        if params:
+            param_text = f"（{', '.join([f'{k}={v}' for k, v in params.items()])}）"
 
-    # Function callingが呼び出されなかった場合
-    return response_message.content
+        return f"OK: {device['name']}を{time_str}に{action}{param_text}するスケジュールを追加しました！"
+
+    elif function_name == "get_schedules":
+        schedule_list = get_schedules()
+
+        if not schedule_list:
+            return "登録されているスケジュールはありません。"
+
+        result_text = "登録済みスケジュール:\n"
+        for i, item in enumerate(schedule_list):
+            params_text = ""
+            if item.get("params"):
+                params_text = f" ({', '.join([f'{k}={v}' for k, v in item['params'].items()])})"
+
+            status_text = "" if item.get("enabled", True) else " [無効]"
+            result_text += f"{i+1}. {item['time']} - {item['device_name']} - {item['action']}{params_text}{status_text} (ID: {item['id']})\n"
+
+        return result_text
+
+    elif function_name == "remove_device_schedule":
+        schedule_ref = schedule_ref_from_arg(function_args["schedule_id"])
+        removed = remove_schedule(schedule_ref)
+
+        if not removed:
+            return f"エラー: スケジュール'{function_args['schedule_id']}'が見つかりません。"
+        return f"OK: {removed['time']} - {removed['device_name']} - {removed['action']}のスケジュールを削除しました！"
+
+    elif function_name == "set_device_schedule_enabled":
+        schedule_ref = schedule_ref_from_arg(function_args["schedule_id"])
+        enabled = bool(function_args["enabled"])
+        updated = set_schedule_enabled(schedule_ref, enabled)
+
+        if not updated:
+            return f"エラー: スケジュール'{function_args['schedule_id']}'が見つかりません。"
+        state_text = "有効" if enabled else "無効"
+        return f"OK: {updated['time']} - {updated['device_name']} - {updated['action']}のスケジュールを{state_text}にしました！"
+
+    elif function_name == "run_scene":
+        scene = get_scene(function_args["scene_name"])
+
+        if not scene:
+            return f"エラー: シーン'{function_args['scene_name']}'が見つかりません。"
+        return format_scene_result(run_scene(scene))
+
+    elif function_name == "save_scene":
+        steps = []
+        for step_args in function_args["steps"]:
+            device_name = step_args["device_name"]
+            device = find_device_by_name(device_name, devices)
+
+            if not device:
+                return f"エラー: '{device_name}'というデバイスが見つかりません。\n利用可能なデバイス:\n{device_info_text}"
+
+            params = {}
+            if "brightness" in step_args:
+                params["brightness"] = step_args["brightness"]
+            if "color_temp" in step_args:
+                params["color_temp"] = step_args["color_temp"]
+
+            action = resolve_command(device["type"], step_args["action"])
+            steps.append(make_step(device, action, params, step_args.get("stage", 0)))
+
+        scene = save_scene(function_args["scene_name"], steps)
+        steps_text = "\n".join(f"- [{step['stage']}] {format_step(step)}" for step in scene["steps"])
+        return f"OK: シーン「{scene['name']}」を保存しました！\n{steps_text}"
+
+    elif function_name == "get_scenes":
+        scene_list = get_scenes()
+
+        if not scene_list:
+            return "登録されているシーンはありません。"
+
+        result_text = "登録済みシーン:\n"
+        for scene in scene_list:
+            steps_text = "、".join(format_step(step) for step in scene["steps"])
+            result_text += f"- {scene['name']}: {steps_text}\n"
+
+        return result_text
+
+    elif function_name == "delete_scene":
+        removed = delete_scene(function_args["scene_name"])
+
+        if not removed:
+            return f"エラー: シーン'{function_args['scene_name']}'が見つかりません。"
+        return f"OK: シーン「{removed['name']}」を削除しました！"
+
+    elif function_name == "add_scene_schedule":
+        scene = get_scene(function_args["scene_name"])
+
+        if not scene:
+            return f"エラー: シーン'{function_args['scene_name']}'が見つかりません。"
+
+        time_str = function_args["time"]
+        add_schedule(
+            time_str,
+            None,
+            scene["name"],
+            "runScene",
+            weekdays=function_args.get("weekdays"),
+            scene=scene["name"]
+        )
+
+        return f"OK: シーン「{scene['name']}」を{time_str}に実行するスケジュールを追加しました！"
+
+    return f"エラー: 不明な関数です: {function_name}"
+
+def schedule_ref_from_arg(value):
+    """ツール引数のスケジュール指定（IDまたは一覧の番号）を変換"""
+    value = str(value).strip()
+    if get_schedule(value) is None and value.isdigit():
+        # 一覧の番号は1始まり
+        return int(value) - 1
+    return value
+
+def tool_call_group(tool_call, devices):
+    """同じデバイスを操作するFunction callingをまとめるキー（デバイスを指定しない呼び出しは単独）"""
+    try:
+        device_name = json.loads(tool_call.function.arguments).get("device_name")
+    except (ValueError, AttributeError):
+        device_name = None
+    if not device_name:
+        return ("call", tool_call.id)
+    device = find_device_by_name(device_name, devices)
+    return ("device", device["id"] if device else device_name)
+
+def execute_tool_calls(tool_calls, devices, device_info_text):
+    """1回の応答に含まれる全てのFunction callingを実行
+
+    デバイス操作はデバイスごとにまとめ、同じデバイスへの操作は呼び出しの順に、
+    異なるデバイスへの操作は並列に実行する（例: turnOn → setBrightness の順番を保つ）。
+    それ以外（スケジュール追加など）は順番に実行する。結果はtool_callsと同じ順番で返す。
+    """
+    def run(tool_call):
+        try:
+            function_args = json.loads(tool_call.function.arguments)
+            return execute_tool_call(tool_call.function.name, function_args, devices, device_info_text)
+        except Exception as e:
+            return f"エラー: {tool_call.function.name}の実行に失敗しました: {str(e)}"
+
+    def run_group(indices):
+        return [(i, run(tool_calls[i])) for i in indices]
+
+    results = [None] * len(tool_calls)
+    groups = {}
+    for i, tool_call in enumerate(tool_calls):
+        if tool_call.function.name in PARALLEL_TOOLS:
+            groups.setdefault(tool_call_group(tool_call, devices), []).append(i)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(groups), MAX_PARALLEL_TOOL_CALLS))) as executor:
+        # ログのコンテキスト（request_idなど）を引き継いで実行
+        futures = [executor.submit(contextvars.copy_context().run, run_group, indices) for indices in groups.values()]
+        grouped = {i for indices in groups.values() for i in indices}
+
+        for i, tool_call in enumerate(tool_calls):
+            if i not in grouped:
+                results[i] = run(tool_call)
+
+        for future in futures:
+            for i, result in future.result():
+                results[i] = result
+
+    return results
+
+def iter_batch_commands(stream):
+    """バッチの入力から指示を1行ずつ読み込む（ファイル全体を読み込まずに順に返す）
+
+    1行1つの指示文、またはJSON（{"text": "...", "id": ...}、バッチの出力の"input"も可）。
+    空行と#で始まる行は読み飛ばす。
+
+    Yields:
+        (指示文, ID) IDはJSONで指定した場合のみ、それ以外はNone
+    """
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict):
+                text = record.get("text") or record.get("input")
+                if text:
+                    yield str(text), record.get("id")
+                continue
+        yield line, None
+
+def _percentile(values, p):
+    """p（0〜100）パーセンタイル（最近傍順位法）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def run_batch(stream, output, parallel=AGENT_BATCH_PARALLEL):
+    """指示をまとめて処理し、結果を1行1つのJSONで出力（処理が終わった順）
+
+    デバイス一覧は最初に1回取得し、SwitchbotのHTTPセッションも全ての指示で共用する。
+    同じデバイス名を含む指示は入力の順に1つずつ、それ以外は最大parallel件を並行して処理する。
+
+    Args:
+        stream: 指示を読み込むファイル（1行1つ）
+        output: 結果を書き込むファイル
+        parallel: 同時に処理する指示の数
+
+    Returns:
+        集計（count, errors, elapsed, p50_ms, p99_ms）
+    """
+    preload_openai_client()
+    devices = get_device_info()
+    # 長い名前を先に照合（「照明10」を「照明1」と間違えない）
+    names = sorted({d["name"] for d in devices}, key=len, reverse=True)
+
+    pool = KeyedWorkerPool(workers=parallel, max_queue=parallel * 2, name="batch")
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def run(seq, text, record_id, queued_at):
+        started = time.perf_counter()
+        with bind(request_id=new_request_id(), seq=seq):
+            try:
+                response, error = process_user_request(text), None
+            except Exception as e:
+                response, error = None, str(e)
+                logger.exception("バッチの指示の処理に失敗", input=text)
+        finished = time.perf_counter()
+
+        record = {"seq": seq}
+        if record_id is not None:
+            record["id"] = record_id
+        record.update({
+            "input": text,
+            "ok": error is None,
+            "output": response,
+            "error": error,
+            "queued_ms": round((started - queued_at) * 1000, 2),
+            "elapsed_ms": round((finished - started) * 1000, 2),
+        })
+        with lock:
+            latencies.append(finished - started)
+            errors[0] += error is not None
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+
+    start = time.perf_counter()
+    for seq, (text, record_id) in enumerate(iter_batch_commands(stream), 1):
+        key = next((name for name in names if name in text), f"#{seq}")
+        # 処理待ちが上限に達すると空くまで読み込みを止める
+        pool.submit(key, run, seq, text, record_id, time.perf_counter())
+    pool.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "count": len(latencies),
+        "errors": errors[0],
+        "elapsed": round(elapsed, 3),
+        "p50_ms": None if not latencies else round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": None if not latencies else round(_percentile(latencies, 99) * 1000, 2),
+    }
+
+def run_batch_mode(path, output_path=None, parallel=AGENT_BATCH_PARALLEL):
+    """バッチモード（path が "-" なら標準入力から読み込む）"""
+    with contextlib.ExitStack() as stack:
+        stream = sys.stdin if path == "-" else stack.enter_context(open(path, encoding="utf-8"))
+        output = stack.enter_context(open(output_path, "w", encoding="utf-8")) if output_path else sys.stdout
+        # 標準出力は結果のJSONLだけにする（処理中のログ・printは標準エラー出力へ）
+        stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        summary = run_batch(stream, output, parallel)
+
+    print(f"バッチ完了: {summary['count']}件（失敗 {summary['errors']}件）, {summary['elapsed']}秒, "
+          f"p50 {summary['p50_ms']}ms / p99 {summary['p99_ms']}ms", file=sys.stderr)
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Switchbot AIエージェント")
+    parser.add_argument("--batch", metavar="FILE", help="指示をファイル（-なら標準入力）から読み込んでまとめて処理")
+    parser.add_argument("--parallel", type=int, default=AGENT_BATCH_PARALLEL, help="バッチ: 同時に処理する数")
+    parser.add_argument("--output", metavar="FILE", help="バッチ: 結果のJSONLの保存先（省略時は標準出力）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """メインループ（--batchを指定するとバッチモード）"""
+    args = parse_args(argv)
+    if args.batch:
+        summary = run_batch_mode(args.batch, args.output, max(1, args.parallel))
+        return 1 if summary["errors"] else 0
 
-def main():
-    """メインループ"""
     print("=== Switchbot AIエージェント ===")
     print("自然言語でSwitchbotデバイスを操作できます")
     print("例: 'カーテンを開けて', 'プラグをオンにして', 'デバイス一覧を見せて'")
     print("終了するには 'exit' または 'quit' と入力してください\n")
 
+    # 入力を待つ間にOpenAIクライアントを準備
+    preload_openai_client()
+
     while True:
         user_input = input("あなた: ").strip()
 
@@ -402,4 +1075,4 @@ def main():
             print(f"エラーが発生しました: {str(e)}\n")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
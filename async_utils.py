@@ -0,0 +1,194 @@
+"""Switchbot API 非同期クライアント（asyncio / httpx）
+
+ボット・スケジューラー・シーンはutils.pyのコマンドキュー経由で操作するため、このモジュールは使わない。
+asyncioのコードから直接使う単独のクライアント（リトライ・レート制限・メトリクスはutils.pyと共通）。
+コマンドキューを通らないため、重複の除去・設定値のまとめは行わない（成功したコマンドはステータスキャッシュに反映する）。
+"""
+import asyncio
+import random
+import httpx
+import utils
+import metrics
+from utils import (get_headers, API_BASE_URL, RETRY_STATUS_CODES, POST_RETRY_STATUS_CODES, MAX_RETRY_AFTER,
+                   API_RESPONSES, brightness_parameter, color_temp_parameter)
+from rate_limiter import limiter as default_limiter
+from log import get_logger
+
+logger = get_logger("async_utils")
+
+class AsyncSwitchBotClient:
+    """Switchbot APIの非同期クライアント（複数デバイスへの同時操作用）"""
+
+    def __init__(self, headers=None, base_url=API_BASE_URL, timeout=10.0,
+                 max_retries=3, backoff_factor=0.5, max_connections=10, transport=None, limiter=default_limiter):
+        """
+        Args:
+            headers: APIヘッダー（省略時はSWITCH_BOT_TOKENから作成）
+            base_url: APIのベースURL
+            timeout: タイムアウト（秒）
+            max_retries: 5xx/429時の最大リトライ回数（POSTは接続できなかった場合と429のみ）
+            backoff_factor: リトライ間隔の基準（秒）
+            max_connections: コネクションプールの最大接続数
+            transport: 差し替え用のhttpxトランスポート（テスト用）
+            limiter: レート制限（同期クライアントと共用、Noneなら制限しない）
+        """
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers or get_headers(),
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """接続を閉じる"""
+        await self.http.aclose()
+
+    def _backoff(self, attempt, response=None):
+        """リトライまでの待機時間（ジッター付き指数バックオフ）"""
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(float(response.headers["Retry-After"]), MAX_RETRY_AFTER)
+        return self.backoff_factor * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def request(self, method, path, priority="interactive", **kwargs):
+        """APIリクエストを送信してJSONを返す
+
+        Args:
+            method: HTTPメソッド
+            path: ベースURLからのパス (例: "/devices")
+            priority: レート制限の優先度 ("scheduled" / "interactive" / "background")
+        """
+        # POSTは送信されていないことが確実な失敗（接続できない・429）だけリトライする
+        # （httpxのConnectError・ConnectTimeoutは接続前の失敗で、送信後の切断・ReadTimeoutを含まない）
+        post = method.upper() == "POST"
+        retry_errors = (httpx.ConnectError, httpx.ConnectTimeout) if post else (httpx.TransportError,)
+        retry_statuses = POST_RETRY_STATUS_CODES if post else RETRY_STATUS_CODES
+
+        for attempt in range(self.max_retries + 1):
+            # バケットが空の場合は待機するため、イベントループを止めないよう別スレッドで待つ
+            if self.limiter:
+                await asyncio.to_thread(self.limiter.acquire, priority)
+            try:
+                with metrics.span("switchbot_request"):
+                    res = await self.http.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                API_RESPONSES.inc(method=method, code="connection_error")
+                if attempt >= self.max_retries or not isinstance(e, retry_errors):
+                    raise
+                logger.warning("APIリクエストをリトライ", method=method, path=path, attempt=attempt + 1, error=str(e))
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+
+            if res.status_code != 200:
+                API_RESPONSES.inc(method=method, code=res.status_code)
+
+            if res.status_code in retry_statuses and attempt < self.max_retries:
+                logger.warning("APIリクエストをリトライ", method=method, path=path, attempt=attempt + 1,
+                               status=res.status_code)
+                await asyncio.sleep(self._backoff(attempt, res))
+                continue
+
+            try:
+                data = res.json()
+            except ValueError:
+                # JSONでないエラー応答（ゲートウェイの5xxなど）
+                data = {"statusCode": res.status_code, "message": res.text[:200]}
+            if res.status_code == 200:
+                API_RESPONSES.inc(method=method, code=data.get("statusCode", "unknown"))
+            if attempt:
+                data["retries"] = attempt
+            return data
+
+    async def get_devices(self, priority="interactive"):
+        """Switchbotデバイスの一覧を取得"""
+        return await self.request("GET", "/devices", priority=priority)
+
+    async def get_device_status(self, device_id, priority="interactive"):
+        """デバイスのステータスを取得
+
+        Args:
+            device_id: デバイスID
+        """
+        return await self.request("GET", f"/devices/{device_id}/status", priority=priority)
+
+    async def control_device(self, device_id, command, parameter="default", priority="interactive"):
+        """Switchbotデバイスを操作
+
+        Args:
+            device_id: デバイスID
+            command: コマンド (例: "turnOn", "turnOff", "press")
+            parameter: パラメータ (デフォルト: "default")
+        """
+        data = {
+            "command": command,
+            "parameter": parameter
+        }
+        result = await self.request("POST", f"/devices/{device_id}/commands", priority=priority, json=data)
+        # コマンドキューを通らない操作もステータスキャッシュに反映し、キューの直近の送信記録は破棄する
+        utils.status_cache.record_command(device_id, command, parameter, result)
+        utils.command_queue.forget(device_id)
+        return result
+
+    async def set_ceiling_light_brightness(self, device_id, brightness):
+        """シーリングライトの明るさを設定
+
+        Args:
+            device_id: デバイスID
+            brightness: 明るさ (1-100)
+        """
+        return await self.control_device(device_id, "setBrightness", brightness_parameter(brightness))
+
+    async def set_ceiling_light_color_temp(self, device_id, color_temp):
+        """シーリングライトの色温度を設定
+
+        Args:
+            device_id: デバイスID
+            color_temp: 色温度 (2700-6500K) または "warm"/"cool"などの文字列
+        """
+        return await self.control_device(device_id, "setColorTemperature", color_temp_parameter(color_temp))
+
+    async def control_many(self, commands, concurrency=5):
+        """複数デバイスに同時にコマンドを送信
+
+        Args:
+            commands: (device_id, command, parameter) のタプルのリスト
+                      parameterは省略可能
+            concurrency: 同時に送信する最大数
+
+        Returns:
+            device_idごとの結果 {"device_id": {"ok": bool, "result": ..., "error": ...}}
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(device_id, command, parameter="default"):
+            async with semaphore:
+                try:
+                    result = await self.control_device(device_id, command, parameter)
+                    return device_id, {"ok": result.get("statusCode") == 100, "result": result, "error": None}
+                except Exception as e:
+                    return device_id, {"ok": False, "result": None, "error": str(e)}
+
+        results = await asyncio.gather(*(run(*cmd) for cmd in commands))
+        return dict(results)
+
+def control_many(commands, concurrency=5):
+    """同期コードから複数デバイスを同時に操作
+
+    Args:
+        commands: (device_id, command, parameter) のタプルのリスト
+        concurrency: 同時に送信する最大数
+    """
+    async def run():
+        async with AsyncSwitchBotClient() as client:
+            return await client.control_many(commands, concurrency)
+
+    return asyncio.run(run())
@@ -0,0 +1,507 @@
+"""オフラインのベンチマーク（フェイクのSwitchbot・OpenAI・Slackサーバーで計測）
+
+実際のサービスには接続せず、プロセス内のフェイクサーバーに対して
+AIエージェント・Slackボット（ポーリング）・スケジューラーを動かし、
+レイテンシ（p50/p99）・スループット・外部APIの呼び出し回数・メモリを出力する。
+
+使い方:
+    python benchmark.py                                   # 全シナリオ
+    python benchmark.py agent --devices 50 --requests 1000 --concurrency 8
+    python benchmark.py slack --threads 20 --replies 3
+    python benchmark.py scheduler --schedules 200 --minutes 3
+    python benchmark.py all --switchbot-latency 0.05 --openai-latency 0.3 --error-rate 0.01 --json result.json
+    python benchmark.py imports --runs 7                  # 各モジュールのimport時間（認証情報なし）
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import statistics
+import subprocess
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from fake_switchbot import FakeSwitchBot
+from fake_openai import FakeOpenAI
+from fake_slack import FakeSlack
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCENARIOS = ("agent", "slack", "scheduler")
+
+# import時間を計測するモジュール（CLI・Procfileのworkerの入口）
+IMPORT_MODULES = ("utils", "scheduler", "agent", "slack_bot")
+
+# import時間の計測では認証情報を空にする（.envの値も読み込まれない）
+CREDENTIAL_ENV = ("SWITCH_BOT_TOKEN", "SWITCH_BOT_CLIENT_SECRET", "OPENAI_API_KEY",
+                  "SLACK_BOT_TOKEN", "SLACK_APP_TOKEN")
+
+# デバイスタイプごとの指示文（ローカル意図解析で処理されるもの / OpenAIに送られるもの）
+LOCAL_PHRASES = {
+    "Ceiling Light": ["{name}をつけて", "{name}を消して"],
+    "Plug Mini (JP)": ["{name}をオンにして", "{name}をオフにして"],
+    "Curtain3": ["{name}を開けて", "{name}を閉めて"],
+    "Smart Lock Ultra": ["{name}を施錠して", "{name}を解錠して"],
+}
+LLM_PHRASES = ["{name}をつけてもらえますか？", "{name}を消してもらえますか？"]
+
+# スケジュールの操作（分ごとにON/OFFを交互に）
+SCHEDULE_ACTIONS = {
+    "Smart Lock Ultra": ("lock", "unlock"),
+}
+
+def percentile(values, p):
+    """p（0〜100）パーセンタイル（最近傍順位法）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+def summarize(latencies, elapsed, errors=0):
+    """レイテンシ（秒）のリストから集計"""
+    count = len(latencies)
+    return {
+        "count": count,
+        "errors": errors,
+        "elapsed": round(elapsed, 3),
+        "rps": round(count / elapsed, 2) if elapsed > 0 else None,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p90_ms": _ms(percentile(latencies, 90)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(max(latencies) if latencies else None),
+        "mean_ms": _ms(sum(latencies) / count if count else None),
+    }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+def max_rss_mb():
+    """プロセスの最大RSS（MB、取得できなければNone）"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+def _parse_importtime(stderr, module):
+    """python -X importtimeの出力から、moduleの累計時間（秒）と時間のかかった直接の依存を取り出す"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # 見出しの行
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1e6))
+
+    # 子のモジュールは親より先に出力される
+    for i, (depth, name, cumulative) in enumerate(entries):
+        if depth == 0 and name == module:
+            start = max((j for j in range(i) if entries[j][0] == 0), default=-1) + 1
+            children = [(n, c) for d, n, c in entries[start:i] if d == 1]
+            return cumulative, sorted(children, key=lambda child: child[1], reverse=True)
+    return None, []
+
+def measure_imports(modules=IMPORT_MODULES, runs=5):
+    """モジュールごとに新しいプロセスでimportし、import時間・プロセスの所要時間の中央値を計測
+
+    認証情報は空にして実行するため、importできること自体の確認にもなる。
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, **{name: "" for name in CREDENTIAL_ENV})
+    results = {}
+    for module in modules:
+        imports, walls, children = [], [], {}
+        error = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                  cwd=root, env=env, capture_output=True, text=True)
+            walls.append(time.perf_counter() - start)
+            if proc.returncode != 0:
+                error = proc.stderr.strip().splitlines()[-1]
+                break
+            cumulative, direct = _parse_importtime(proc.stderr, module)
+            imports.append(cumulative)
+            for name, seconds in direct:
+                children.setdefault(name, []).append(seconds)
+
+        if error:
+            results[module] = {"error": error}
+            continue
+        top = sorted(((name, statistics.median(values)) for name, values in children.items()),
+                     key=lambda child: child[1], reverse=True)[:3]
+        results[module] = {
+            "import_ms": _ms(statistics.median(imports)),
+            "process_ms": _ms(statistics.median(walls)),
+            "top": {name: _ms(seconds) for name, seconds in top},
+        }
+    return results
+
+def format_imports(results, runs):
+    """import時間の結果を表示用のテキストに"""
+    lines = [f"== imports（認証情報なし、{runs}回の中央値） =="]
+    for module, result in results.items():
+        if "error" in result:
+            lines.append(f"  {module}: importに失敗 ({result['error']})")
+            continue
+        top = ", ".join(f"{name} {ms}ms" for name, ms in result["top"].items())
+        lines.append(f"  {module}: import {result['import_ms']}ms / プロセス全体 {result['process_ms']}ms"
+                     + (f"（内訳: {top}）" if top else ""))
+    return "\n".join(lines)
+
+def make_command(device, rng, llm_ratio):
+    """デバイスへの指示文を作成（llm_ratioの割合でOpenAIに送られる言い回し）"""
+    if rng.random() < llm_ratio:
+        phrases = LLM_PHRASES
+    else:
+        phrases = LOCAL_PHRASES.get(device["type"], LLM_PHRASES)
+    return rng.choice(phrases).format(name=device["name"])
+
+class BenchSlack(FakeSlack):
+    """ボットの投稿を待てるフェイクSlack"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.posted_cond = threading.Condition()
+
+    def chat_postMessage(self, params):
+        result = super().chat_postMessage(params)
+        with self.posted_cond:
+            self.posted_cond.notify_all()
+        return result
+
+    def wait_reply(self, thread_ts, after_ts, timeout):
+        """スレッドにafter_tsより後のボットの投稿が届くまで待つ（届いた投稿のts、タイムアウトならNone）"""
+        deadline = time.monotonic() + timeout
+        with self.posted_cond:
+            while True:
+                for message in reversed(self.posted):
+                    if float(message["ts"]) <= float(after_ts):
+                        break
+                    if message.get("thread_ts") == thread_ts:
+                        return message["ts"]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.posted_cond.wait(remaining)
+
+class TickTrigger:
+    """決められた時刻に実行するトリガー（1分を数秒に縮めて計測するため）"""
+
+    def __init__(self, times):
+        self.times = sorted(times)
+
+    def next_fire(self, after):
+        return next((t for t in self.times if t > after), None)
+
+class Benchmark:
+    """フェイクサーバーを起動し、環境変数を差し替えてから各モジュールを読み込む"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.workdir = tempfile.mkdtemp(prefix="switchbot-bench-")
+
+        self.switchbot = FakeSwitchBot(args.devices, latency=args.switchbot_latency,
+                                       error_rate=args.error_rate, port=0).start()
+        self.openai = FakeOpenAI(latency=args.openai_latency, error_rate=args.error_rate, port=0).start()
+        self.slack = BenchSlack(latency=args.slack_latency, port=0).start()
+        self._configure_env()
+
+    def _configure_env(self):
+        # 各モジュールは読み込み時に環境変数を参照するため、import前に設定する
+        # （load_dotenv()は既存の環境変数を上書きしないため.envの値より優先される）
+        env = {
+            "SWITCH_BOT_TOKEN": "bench-token",
+            "SWITCH_BOT_CLIENT_SECRET": "bench-secret",
+            "SWITCH_BOT_API_URL": self.switchbot.url,
+            "OPENAI_API_KEY": "bench-key",
+            "OPENAI_BASE_URL": self.openai.url,
+            "SLACK_BOT_TOKEN": "xoxb-bench",
+            "SLACK_API_URL": self.slack.url,
+            "SLACK_CHANNEL_ID": self.slack.channel,
+            "SLACK_MODE": "polling",
+            "SLACK_THREAD_DB": "",
+            "DEVICE_CACHE_FILE": os.path.join(self.workdir, "devices_cache.json"),
+            "SCHEDULE_DB": os.path.join(self.workdir, "schedules.db"),
+            "SWITCHBOT_QUOTA_FILE": "",
+            "WEBHOOK_PORT": "",
+            "METRICS_PORT": "",
+            # 計測中のログは警告以上だけ（--verboseなら全て）
+            "LOG_LEVEL": "DEBUG" if self.args.verbose else "WARNING",
+        }
+        if not self.args.rate_limit:
+            # レート制限の待ち時間を計測に含めない
+            env.update({"SWITCHBOT_RATE_LIMIT": "100000", "SWITCHBOT_BURST": "100000",
+                        "SWITCHBOT_DAILY_LIMIT": "1000000000"})
+        os.environ.update(env)
+
+    def stop(self):
+        self.switchbot.stop()
+        self.openai.stop()
+        self.slack.stop()
+
+    def call_counts(self):
+        """外部APIの呼び出し回数（サービス → エンドポイント → 回数）"""
+        return {
+            "switchbot": dict(self.switchbot.call_counts),
+            "openai": dict(self.openai.call_counts),
+            "slack": dict(self.slack.call_counts),
+        }
+
+    def run(self, name):
+        """シナリオを実行して結果を返す"""
+        before = self.call_counts()
+        if self.args.tracemalloc:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        with contextlib.ExitStack() as stack:
+            # ボットのログ（print）は計測中は捨てる
+            if not self.args.verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            result = getattr(self, f"run_{name}")()
+
+        after = self.call_counts()
+        result["api_calls"] = {
+            service: {key: count - before[service].get(key, 0)
+                      for key, count in counts.items() if count - before[service].get(key, 0)}
+            for service, counts in after.items()
+        }
+        result["max_rss_mb"] = max_rss_mb()
+        if self.args.tracemalloc:
+            result["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+            tracemalloc.stop()
+        return result
+
+    def _devices(self):
+        import device_registry
+        return device_registry.get_device_list()
+
+    def run_agent(self):
+        """AIエージェントに指示文を並行して送る"""
+        import agent
+
+        # 実際の起動時と同じく、OpenAIクライアントは計測の前に準備しておく
+        agent.get_openai_client()
+        devices = self._devices()
+        commands = [make_command(self.rng.choice(devices), self.rng, self.args.llm_ratio)
+                    for _ in range(self.args.requests)]
+
+        def run(text):
+            started = time.perf_counter()
+            try:
+                response = agent.process_user_request(text)
+                ok = bool(response) and not str(response).startswith("エラー")
+            except Exception:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            results = list(executor.map(run, commands))
+        elapsed = time.perf_counter() - started
+
+        return summarize([r[0] for r in results], elapsed, errors=sum(1 for r in results if not r[1]))
+
+    def run_slack(self):
+        """M人のユーザーがそれぞれスレッドで会話し、投稿から返信までの時間を計測"""
+        import slack_bot
+
+        slack_bot.agent.get_openai_client()
+        devices = self._devices()
+        slack_bot.bot_user_id = slack_bot.get_bot_user_id()
+        latest = self.slack.conversations_history({"limit": 1})["messages"]
+        slack_bot.last_processed_ts = latest[0]["ts"] if latest else None
+
+        latencies = []
+        timeouts = [0]
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def poller():
+            while not stop.is_set():
+                slack_bot.poll_once()
+                stop.wait(self.args.poll_interval)
+
+        def user(i, rng):
+            # 開始をずらす（同時に投稿すると1回のポーリングの取得件数を超えるため）
+            time.sleep(i / self.args.arrival_rate)
+            parent_ts = None
+            for _ in range(1 + self.args.replies):
+                text = make_command(rng.choice(devices), rng, self.args.llm_ratio)
+                message = self.slack.post_user_message(text, thread_ts=parent_ts)
+                parent_ts = parent_ts or message["ts"]
+                reply_ts = self.slack.wait_reply(parent_ts, message["ts"], self.args.timeout)
+                with lock:
+                    if reply_ts is None:
+                        timeouts[0] += 1
+                        return
+                    latencies.append(float(reply_ts) - float(message["ts"]))
+
+        poll_thread = threading.Thread(target=poller, name="bench-poller", daemon=True)
+        poll_thread.start()
+        started = time.perf_counter()
+        users = [threading.Thread(target=user, args=(i, random.Random(self.rng.random())), daemon=True)
+                 for i in range(self.args.threads)]
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        poll_thread.join()
+
+        result = summarize(latencies, elapsed, errors=timeouts[0])
+        result["threads"] = self.args.threads
+        return result
+
+    def run_scheduler(self):
+        """1分ごとにK件のスケジュールが同時に実行される負荷（1分をtick秒に縮める）"""
+        import scheduler
+        from scheduler_engine import SchedulerEngine
+
+        devices = self._devices()
+        engine = SchedulerEngine(max_workers=int(os.getenv("SCHEDULER_WORKERS", "8")))
+        first = datetime.now() + timedelta(seconds=0.5)
+        ticks = [first + timedelta(seconds=self.args.tick * m) for m in range(self.args.minutes)]
+
+        lags = []
+        latencies = []
+        failures = [0]
+        lock = threading.Lock()
+        done = threading.Semaphore(0)
+
+        def wrap(job):
+            def run():
+                started = datetime.now()
+                try:
+                    ok = job() is not False
+                except Exception:
+                    ok = False
+                finished = datetime.now()
+                tick = max((t for t in ticks if t <= started), default=ticks[0])
+                with lock:
+                    lags.append((started - tick).total_seconds())
+                    latencies.append((finished - started).total_seconds())
+                    failures[0] += 0 if ok else 1
+                done.release()
+                return ok
+            return run
+
+        for k in range(self.args.schedules):
+            device = devices[k % len(devices)]
+            on, off = SCHEDULE_ACTIONS.get(device["type"], ("turnOn", "turnOff"))
+            # 同じデバイスのスケジュールは分ごとにON/OFFが交互になるように
+            for m, tick in enumerate(ticks):
+                item = {"id": f"bench-{k}-{m}", "time": tick.strftime("%H:%M:%S"), "device_id": device["id"],
+                        "device_name": device["name"], "action": on if (k + m) % 2 == 0 else off}
+                engine.add(item["id"], TickTrigger([tick]), wrap(scheduler.make_job(item)))
+
+        total = self.args.schedules * len(ticks)
+        started = time.perf_counter()
+        engine.start()
+        deadline = time.monotonic() + self.args.tick * len(ticks) + self.args.timeout
+        completed = 0
+        while completed < total and done.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            completed += 1
+        elapsed = time.perf_counter() - started
+        engine.stop()
+
+        result = summarize(latencies, elapsed, errors=failures[0] + total - completed)
+        result["fire_lag_p50_ms"] = _ms(percentile(lags, 50))
+        result["fire_lag_p99_ms"] = _ms(percentile(lags, 99))
+        result["fire_lag_max_ms"] = _ms(max(lags) if lags else None)
+        return result
+
+def format_result(name, result):
+    """結果を表示用のテキストに"""
+    lines = [f"== {name} ==",
+             f"  件数: {result['count']}件（失敗 {result['errors']}件）, {result['elapsed']}秒, {result['rps']}件/秒",
+             f"  レイテンシ: p50 {result['p50_ms']}ms / p90 {result['p90_ms']}ms / "
+             f"p99 {result['p99_ms']}ms / 最大 {result['max_ms']}ms"]
+    if "fire_lag_p50_ms" in result:
+        lines.append(f"  実行遅延: p50 {result['fire_lag_p50_ms']}ms / p99 {result['fire_lag_p99_ms']}ms / "
+                     f"最大 {result['fire_lag_max_ms']}ms")
+    for service, counts in result["api_calls"].items():
+        if counts:
+            lines.append(f"  {service}: " + ", ".join(f"{key}={count}" for key, count in sorted(counts.items())))
+    memory = f"  メモリ: 最大RSS {result['max_rss_mb']}MB"
+    if "tracemalloc_peak_mb" in result:
+        memory += f"（tracemallocのピーク {result['tracemalloc_peak_mb']}MB）"
+    lines.append(memory)
+    return "\n".join(lines)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="フェイクサーバーを使ったオフラインのベンチマーク")
+    parser.add_argument("scenario", nargs="?", default="all", choices=SCENARIOS + ("all", "imports"))
+    parser.add_argument("--devices", type=int, default=20, help="デバイス数 N")
+    parser.add_argument("--requests", type=int, default=200, help="agent: 指示文の数")
+    parser.add_argument("--concurrency", type=int, default=4, help="agent: 同時に処理する数")
+    parser.add_argument("--llm-ratio", type=float, default=0.3, help="OpenAIに送られる言い回しの割合")
+    parser.add_argument("--threads", type=int, default=10, help="slack: 会話するスレッド数 M")
+    parser.add_argument("--replies", type=int, default=2, help="slack: 1スレッドあたりの返信数")
+    parser.add_argument("--arrival-rate", type=float, default=20.0, help="slack: 1秒あたりの新しいスレッド数")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="slack: ポーリング間隔（秒）")
+    parser.add_argument("--schedules", type=int, default=50, help="scheduler: 1分あたりのスケジュール数 K")
+    parser.add_argument("--minutes", type=int, default=3, help="scheduler: 計測する分数")
+    parser.add_argument("--tick", type=float, default=2.0, help="scheduler: 1分を何秒に縮めるか")
+    parser.add_argument("--switchbot-latency", type=float, default=0.02, help="フェイクSwitchbot APIの遅延（秒）")
+    parser.add_argument("--openai-latency", type=float, default=0.2, help="フェイクOpenAI APIの遅延（秒）")
+    parser.add_argument("--slack-latency", type=float, default=0.01, help="フェイクSlack APIの遅延（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="SwitchbotとOpenAIがHTTP 500を返す割合")
+    parser.add_argument("--rate-limit", action="store_true", help="Switchbot APIのレート制限を有効にする")
+    parser.add_argument("--timeout", type=float, default=30.0, help="1件の応答を待つ最大秒数")
+    parser.add_argument("--runs", type=int, default=5, help="imports: 1モジュールあたりの計測回数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--tracemalloc", action="store_true", help="tracemallocでメモリのピークを計測（遅くなる）")
+    parser.add_argument("--json", metavar="FILE", help="結果をJSONで保存")
+    parser.add_argument("--verbose", action="store_true", help="ボットのログを表示")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # import時間はフェイクサーバーを使わず、別のプロセスで計測する
+    if args.scenario == "imports":
+        results = measure_imports(runs=args.runs)
+        print(format_imports(results, args.runs))
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "results": {"imports": results}}, f, ensure_ascii=False, indent=2)
+            print(f"結果を保存しました: {args.json}")
+        return
+
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+
+    bench = Benchmark(args)
+    print(f"=== ベンチマーク（デバイス{args.devices}台、"
+          f"遅延 Switchbot {args.switchbot_latency}s / OpenAI {args.openai_latency}s / Slack {args.slack_latency}s、"
+          f"エラー率 {args.error_rate}） ===")
+    results = {}
+    try:
+        for name in scenarios:
+            results[name] = bench.run(name)
+            print(format_result(name, results[name]))
+    finally:
+        bench.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.json}")
+
+if __name__ == "__main__":
+    main()
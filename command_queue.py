@@ -0,0 +1,150 @@
+"""デバイスごとのコマンドキュー（重複の除去・設定値コマンドのまとめ）"""
+import time
+import threading
+from concurrent.futures import Future
+from config import get_env
+from worker_pool import KeyedWorkerPool
+
+# 同じコマンドを重複とみなす期間（秒）
+COMMAND_DEDUP_WINDOW = get_env("COMMAND_DEDUP_WINDOW", 2.0, float)
+
+# コマンドを送信するワーカー数（異なるデバイスへの同時送信数）
+COMMAND_WORKERS = get_env("COMMAND_WORKERS", 8, int)
+
+# 待機中のコマンドが新しい値で置き換えられる設定値コマンド
+COALESCE_COMMANDS = {"setBrightness", "setColorTemperature", "setPosition"}
+
+# 繰り返すと結果が変わるため重複として除去しないコマンド
+NON_IDEMPOTENT_COMMANDS = {"press", "toggle", "pause"}
+
+# 優先度（前ほど高い、まとめた場合は高い方を使う）
+PRIORITY_ORDER = ("scheduled", "interactive", "background")
+
+class CommandQueue:
+    """デバイスごとにコマンドを順番に送信するキュー
+
+    - 同じデバイスへのコマンドは投入順に1つずつ送信し、異なるデバイスへは並行して送信する
+    - 同じコマンド・パラメータは、待機中・送信中または直近に成功していれば送信しない
+    - 待機中の設定値コマンド（明るさなど）に同じコマンドが続いた場合は、最新の値だけを送信する
+    """
+
+    def __init__(self, send, workers=COMMAND_WORKERS, dedup_window=COMMAND_DEDUP_WINDOW, max_queue=100):
+        """
+        Args:
+            send: コマンドを送信する関数 send(device_id, command, parameter, priority) → APIレスポンス
+            workers: 送信するワーカー数
+            dedup_window: 同じコマンドを重複とみなす期間（秒）
+            max_queue: 待機できるコマンドの最大数
+        """
+        self.send = send
+        self.dedup_window = dedup_window
+        self.pool = KeyedWorkerPool(workers, max_queue, name="command")
+        self._tails = {}     # device_id → 最後に投入された未送信のコマンド
+        self._running = {}   # device_id → 送信中のコマンド
+        self._recent = {}    # device_id → (送信時刻, command, parameter, 結果) 最後に成功したコマンド
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "sent": 0, "deduplicated": 0, "coalesced": 0}
+
+    def submit(self, device_id, command, parameter="default", priority="interactive"):
+        """コマンドを投入
+
+        Returns:
+            APIレスポンスを返すFuture（まとめられたコマンドは最新の値の結果で、
+            実際に送信したコマンド・パラメータを"coalesced_into"に含む）
+        """
+        future = Future()
+        idempotent = command not in NON_IDEMPOTENT_COMMANDS
+
+        with self._lock:
+            self._stats["submitted"] += 1
+            tail = self._tails.get(device_id)
+
+            if idempotent and tail is None:
+                # 待機中のコマンドがなく、送信中のコマンドと同じならその結果を使う
+                running = self._running.get(device_id)
+                if running and (running["command"], running["parameter"]) == (command, parameter):
+                    self._stats["deduplicated"] += 1
+                    return self._attach(running, future, priority, parameter)
+
+                # 最後に成功したコマンドと同じなら送信しない
+                recent = self._recent.get(device_id)
+                if (running is None and recent and recent[1:3] == (command, str(parameter))
+                        and time.monotonic() - recent[0] < self.dedup_window):
+                    self._stats["deduplicated"] += 1
+                    future.set_result(dict(recent[3], deduplicated=True))
+                    return future
+
+            # 未送信の最後のコマンドと同じなら、そのコマンドにまとめる
+            # （途中に別のコマンドがある場合は順番が変わるためまとめない）
+            if tail and tail["command"] == command:
+                if idempotent and tail["parameter"] == parameter:
+                    self._stats["deduplicated"] += 1
+                    return self._attach(tail, future, priority, parameter)
+                if command in COALESCE_COMMANDS:
+                    self._stats["coalesced"] += 1
+                    tail["parameter"] = parameter
+                    return self._attach(tail, future, priority, parameter)
+
+            # futuresは (Future, 投入時のパラメータ)
+            slot = {"command": command, "parameter": parameter, "priority": priority, "futures": [(future, parameter)]}
+            self._tails[device_id] = slot
+
+        self.pool.submit(device_id, self._run, device_id, slot)
+        return future
+
+    @staticmethod
+    def _attach(slot, future, priority, parameter):
+        slot["futures"].append((future, parameter))
+        if PRIORITY_ORDER.index(priority) < PRIORITY_ORDER.index(slot["priority"]):
+            slot["priority"] = priority
+        return future
+
+    def _run(self, device_id, slot):
+        with self._lock:
+            # 送信を始めたコマンドには後からまとめない
+            if self._tails.get(device_id) is slot:
+                del self._tails[device_id]
+            self._running[device_id] = slot
+            command, parameter, priority = slot["command"], slot["parameter"], slot["priority"]
+
+        try:
+            result = self.send(device_id, command, parameter, priority)
+        except Exception as e:
+            with self._lock:
+                self._running.pop(device_id, None)
+                futures = list(slot["futures"])
+            for future, _ in futures:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            self._running.pop(device_id, None)
+            futures = list(slot["futures"])
+            self._stats["sent"] += 1
+            if result.get("statusCode") == 100 and command not in NON_IDEMPOTENT_COMMANDS:
+                self._recent[device_id] = (time.monotonic(), command, str(parameter), result)
+            else:
+                self._recent.pop(device_id, None)
+
+        for future, requested in futures:
+            if requested != parameter:
+                # 新しい値にまとめられたコマンド（送信したのは別の値）
+                future.set_result(dict(result, coalesced_into={"command": command, "parameter": parameter}))
+            else:
+                future.set_result(result)
+
+    def execute(self, device_id, command, parameter="default", priority="interactive"):
+        """コマンドを投入して結果を待つ"""
+        return self.submit(device_id, command, parameter, priority).result()
+
+    def forget(self, device_id):
+        """デバイスの直近の送信記録を破棄（状態が外部で変わった場合など）"""
+        with self._lock:
+            self._recent.pop(device_id, None)
+
+    def stats(self):
+        """利用状況（submitted, sent, deduplicated, coalesced と送信キューの状態）"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pool"] = self.pool.stats()
+        return stats
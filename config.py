@@ -0,0 +1,72 @@
+"""設定（.envファイルの読み込み・認証情報・その他の設定値の取得）
+
+.envファイルはこのモジュールを最初にimportしたときに1回だけ読み込む。
+認証情報以外の設定値は get_env() で取得する（このモジュールのimport時に.envは読み込み済み）。
+
+認証情報はimport時には検証せず、クライアントを初めて使うときに settings.require() で確認する
+（認証情報がなくてもモジュールをimportできる）。
+
+使い方:
+    from config import settings, get_env
+
+    token = settings.require("switchbot_token")  # 未設定ならValueError
+    channel = settings.slack_channel_id          # 未設定ならNone
+    ttl = get_env("DEVICE_CACHE_TTL", 600, int)  # 認証情報以外の設定
+"""
+import os
+from dotenv import load_dotenv
+
+# .envファイルから環境変数を読み込む（既に設定されている環境変数は上書きしない）
+load_dotenv()
+
+def get_env(name, default=None, cast=str):
+    """設定値を環境変数（.envを含む）から取得
+
+    Args:
+        name: 環境変数名
+        default: 未設定の場合の値
+        cast: 変換する型（int・floatなど。str以外は空文字も未設定として扱う）
+
+    Raises:
+        ValueError: castで変換できない値が設定されている
+    """
+    value = os.getenv(name)
+    if value is None or (value == "" and cast is not str):
+        return default
+    return cast(value)
+
+class Settings:
+    """認証情報・接続先の設定（属性名 → 環境変数名）"""
+
+    ENV_NAMES = {
+        "switchbot_token": "SWITCH_BOT_TOKEN",
+        "switchbot_secret": "SWITCH_BOT_CLIENT_SECRET",
+        "switchbot_api_url": "SWITCH_BOT_API_URL",
+        "openai_api_key": "OPENAI_API_KEY",
+        "slack_bot_token": "SLACK_BOT_TOKEN",
+        "slack_app_token": "SLACK_APP_TOKEN",
+        "slack_api_url": "SLACK_API_URL",
+        "slack_channel_id": "SLACK_CHANNEL_ID",
+    }
+
+    DEFAULTS = {
+        # APIのベースURL（SWITCH_BOT_API_URLでローカルのフェイクサーバーに差し替え可能）
+        "switchbot_api_url": "https://api.switch-bot.com/v1.1",
+    }
+
+    def __init__(self):
+        for attr, env_name in self.ENV_NAMES.items():
+            setattr(self, attr, os.getenv(env_name) or self.DEFAULTS.get(attr))
+
+    def require(self, attr):
+        """必須の設定値を取得
+
+        Raises:
+            ValueError: 環境変数が設定されていない
+        """
+        value = getattr(self, attr)
+        if not value:
+            raise ValueError(f"{self.ENV_NAMES[attr]}が.envファイルに設定されていません")
+        return value
+
+settings = Settings()
@@ -0,0 +1,141 @@
+"""Switchbotデバイス一覧の共有キャッシュ（TTL付き）"""
+import os
+import json
+import time
+import threading
+from config import get_env
+from utils import get_devices
+import metrics
+from log import get_logger
+
+logger = get_logger("device_registry")
+
+# キャッシュを保存するファイル
+DEVICE_CACHE_FILE = get_env("DEVICE_CACHE_FILE", "devices_cache.json")
+
+# キャッシュの有効期間（秒）
+DEVICE_CACHE_TTL = get_env("DEVICE_CACHE_TTL", 600, int)
+
+# キャッシュ状態
+_devices = None
+_fetched_at = 0.0
+_lock = threading.Lock()
+_refreshing = False
+_invalidated = False   # invalidate()後、次回のアクセスで同期的に再取得する
+
+def _format_devices(devices_data):
+    """APIレスポンスをデバイスリストに整形"""
+    device_list = []
+
+    if devices_data.get("statusCode") == 100:
+        for device in devices_data["body"]["deviceList"]:
+            device_list.append({
+                "id": device["deviceId"],
+                "name": device["deviceName"],
+                "type": device["deviceType"]
+            })
+
+    return device_list
+
+def _load_from_disk():
+    """ディスクのキャッシュを読み込み（起動直後のみ）"""
+    global _devices, _fetched_at
+    try:
+        if os.path.exists(DEVICE_CACHE_FILE):
+            with open(DEVICE_CACHE_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            _devices = data.get("devices", [])
+            _fetched_at = data.get("fetched_at", 0.0)
+            metrics.set_device_types(_devices)
+            logger.info("デバイスキャッシュを読み込みました", devices=len(_devices))
+    except Exception:
+        logger.exception("デバイスキャッシュ読み込みエラー")
+
+def _save_to_disk():
+    """キャッシュをディスクに保存"""
+    try:
+        tmp_path = f"{DEVICE_CACHE_FILE}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"devices": _devices, "fetched_at": _fetched_at}, f, ensure_ascii=False)
+        os.replace(tmp_path, DEVICE_CACHE_FILE)
+    except Exception:
+        logger.exception("デバイスキャッシュ保存エラー")
+
+def refresh(priority="interactive"):
+    """APIからデバイス一覧を再取得してキャッシュを更新
+
+    取得に失敗した場合は既存のキャッシュを維持する
+
+    Args:
+        priority: レート制限の優先度（バックグラウンド更新は"background"）
+    """
+    global _devices, _fetched_at, _invalidated
+    devices_data = get_devices(priority)
+    if devices_data.get("statusCode") != 100:
+        logger.warning("デバイス一覧の取得に失敗", status_code=devices_data.get("statusCode"),
+                       message=devices_data.get("message"))
+        return _devices or []
+
+    with _lock:
+        _devices = _format_devices(devices_data)
+        _fetched_at = time.time()
+        _invalidated = False
+        metrics.set_device_types(_devices)
+        _save_to_disk()
+
+    return _devices
+
+def _refresh_in_background():
+    """バックグラウンドでキャッシュを更新（多重起動しない）"""
+    global _refreshing
+    with _lock:
+        if _refreshing:
+            return
+        _refreshing = True
+
+    def worker():
+        global _refreshing
+        try:
+            refresh("background")
+        except Exception:
+            logger.exception("デバイス一覧のバックグラウンド更新エラー")
+        finally:
+            with _lock:
+                _refreshing = False
+
+    threading.Thread(target=worker, daemon=True).start()
+
+def get_device_list(force_refresh=False):
+    """キャッシュ済みのデバイス一覧を取得
+
+    TTL切れの場合は古いキャッシュを返しつつバックグラウンドで更新する。
+    キャッシュが無い場合・invalidate()の後はAPIを同期的に呼び出す。
+
+    Args:
+        force_refresh: Trueの場合は必ずAPIから再取得
+    """
+    if _devices is None:
+        with _lock:
+            if _devices is None:
+                _load_from_disk()
+
+    if force_refresh or _devices is None or _invalidated:
+        return refresh()
+
+    if time.time() - _fetched_at > DEVICE_CACHE_TTL:
+        _refresh_in_background()
+
+    return _devices
+
+def invalidate():
+    """キャッシュを無効化（次回アクセス時に同期的に再取得）"""
+    global _fetched_at, _invalidated
+    with _lock:
+        _fetched_at = 0.0
+        _invalidated = True
+
+def warm_up():
+    """起動時にキャッシュを準備（ディスクのキャッシュがあれば即座に利用可能）"""
+    devices = get_device_list()
+    logger.info("デバイスキャッシュ準備完了", devices=len(devices))
+    return devices
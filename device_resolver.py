@@ -0,0 +1,204 @@
+"""デバイス名の検索インデックス（正規化・n-gram・エイリアスによるあいまい検索）"""
+import os
+import json
+import re
+import heapq
+import unicodedata
+from collections import Counter
+from itertools import chain
+from config import get_env
+from log import get_logger
+
+logger = get_logger("device_resolver")
+
+# エイリアスを定義するファイル（{"エイリアス": "デバイス名" または ["デバイス名", ...]}）
+DEVICE_ALIAS_FILE = get_env("DEVICE_ALIAS_FILE", "device_aliases.json")
+
+# デバイスタイプごとの一般名称（デバイス名に含まれなくても候補にする）
+TYPE_ALIASES = {
+    "Ceiling Light": ["シーリングライト", "ライト", "照明", "電気", "light"],
+    "Curtain3": ["カーテン", "curtain"],
+    "Plug Mini (JP)": ["プラグ", "コンセント", "plug"],
+    "Smart Lock Ultra": ["スマートロック", "ロック", "鍵", "ドア", "玄関", "lock", "door"],
+}
+
+# ひらがな → ローマ字（ヘボン式、拗音を先に判定）
+_ROMAJI_YOUON = {
+    "きゃ": "kya", "きゅ": "kyu", "きょ": "kyo", "しゃ": "sha", "しゅ": "shu", "しょ": "sho",
+    "ちゃ": "cha", "ちゅ": "chu", "ちょ": "cho", "にゃ": "nya", "にゅ": "nyu", "にょ": "nyo",
+    "ひゃ": "hya", "ひゅ": "hyu", "ひょ": "hyo", "みゃ": "mya", "みゅ": "myu", "みょ": "myo",
+    "りゃ": "rya", "りゅ": "ryu", "りょ": "ryo", "ぎゃ": "gya", "ぎゅ": "gyu", "ぎょ": "gyo",
+    "じゃ": "ja", "じゅ": "ju", "じょ": "jo", "びゃ": "bya", "びゅ": "byu", "びょ": "byo",
+    "ぴゃ": "pya", "ぴゅ": "pyu", "ぴょ": "pyo", "てぃ": "ti", "でぃ": "di", "ふぁ": "fa",
+    "ふぃ": "fi", "ふぇ": "fe", "ふぉ": "fo", "うぃ": "wi", "うぇ": "we", "うぉ": "wo",
+    "しぇ": "she", "じぇ": "je", "ちぇ": "che", "ゔぁ": "va",
+}
+_ROMAJI = dict(zip(
+    "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+    "がぎぐげござじずぜぞだぢづでどばびぶべぼぱぴぷぺぽぁぃぅぇぉゃゅょゔ",
+    ["a", "i", "u", "e", "o", "ka", "ki", "ku", "ke", "ko", "sa", "shi", "su", "se", "so",
+     "ta", "chi", "tsu", "te", "to", "na", "ni", "nu", "ne", "no", "ha", "hi", "fu", "he", "ho",
+     "ma", "mi", "mu", "me", "mo", "ya", "yu", "yo", "ra", "ri", "ru", "re", "ro", "wa", "o", "n",
+     "ga", "gi", "gu", "ge", "go", "za", "ji", "zu", "ze", "zo", "da", "ji", "zu", "de", "do",
+     "ba", "bi", "bu", "be", "bo", "pa", "pi", "pu", "pe", "po", "a", "i", "u", "e", "o",
+     "ya", "yu", "yo", "vu"]
+))
+
+# 候補とみなす最低スコア
+MIN_SCORE = 0.5
+
+# n-gramの一致数で絞り込んだ後、詳細にスコアを計算する候補数
+RESCORE_CANDIDATES = 20
+
+def normalize_name(text):
+    """デバイス名を正規化（NFKC・小文字・カタカナ→ひらがな・記号と空白の除去）"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in text)
+    return re.sub(r"[\s\-_・,、。()（）「」]", "", text)
+
+def to_romaji(text):
+    """正規化済みの文字列をローマ字に変換（ひらがな以外はそのまま）"""
+    result = []
+    i = 0
+    while i < len(text):
+        pair = text[i:i + 2]
+        if pair in _ROMAJI_YOUON:
+            result.append(_ROMAJI_YOUON[pair])
+            i += 2
+            continue
+
+        c = text[i]
+        if c == "っ" and i + 1 < len(text):
+            # 促音は次の子音を重ねる
+            nxt = _ROMAJI_YOUON.get(text[i + 1:i + 3]) or _ROMAJI.get(text[i + 1], "")
+            result.append(nxt[:1] if nxt[:1] not in "aiueo" else "")
+        elif c == "ー":
+            # 長音は前の母音を重ねる
+            result.append(result[-1][-1:] if result else "")
+        else:
+            result.append(_ROMAJI.get(c, c))
+        i += 1
+
+    return "".join(result)
+
+def _ngrams(text, n):
+    """前後に境界を付けたn-gramの集合"""
+    padded = f" {text} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+def load_aliases():
+    """エイリアスファイルを読み込み（存在しなければ空）"""
+    try:
+        if os.path.exists(DEVICE_ALIAS_FILE):
+            with open(DEVICE_ALIAS_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Exception:
+        logger.exception("エイリアス読み込みエラー", alias_file=DEVICE_ALIAS_FILE)
+    return {}
+
+class DeviceIndex:
+    """デバイス一覧から作る検索インデックス（デバイス一覧の更新ごとに1回だけ構築）"""
+
+    def __init__(self, devices, aliases=None):
+        """
+        Args:
+            devices: デバイスリスト（[{"id", "name", "type"}]）
+            aliases: エイリアス {"エイリアス": "デバイス名" または ["デバイス名", ...]}
+        """
+        self.devices = list(devices)
+        self._kana = []
+        self._romaji = []
+        self._grams = {}     # n-gram → デバイスのインデックスの集合
+        self._gram_counts = []
+        self._aliases = {}   # 正規化したエイリアス → {デバイスのインデックス: スコア}
+
+        for i, device in enumerate(self.devices):
+            kana = normalize_name(device["name"])
+            romaji = to_romaji(kana)
+            self._kana.append(kana)
+            self._romaji.append(romaji)
+            grams = self._device_grams(kana, romaji)
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._grams.setdefault(gram, set()).add(i)
+
+            # タイプの一般名称（同じタイプが多いほどスコアを下げる）
+            for alias in TYPE_ALIASES.get(device["type"], []):
+                self._aliases.setdefault(normalize_name(alias), {})[i] = 0.6
+
+        for alias, names in (aliases or {}).items():
+            names = [names] if isinstance(names, str) else names
+            for i, device in enumerate(self.devices):
+                if device["name"] in names or device["id"] in names:
+                    self._aliases.setdefault(normalize_name(alias), {})[i] = 0.95
+
+    @staticmethod
+    def _device_grams(kana, romaji):
+        return {("k", g) for g in _ngrams(kana, 2)} | {("r", g) for g in _ngrams(romaji, 3)}
+
+    def _score(self, i, kana, romaji, dice):
+        name_kana = self._kana[i]
+        name_romaji = self._romaji[i]
+
+        if kana == name_kana or romaji == name_romaji:
+            return 1.0
+
+        for a, b in ((kana, name_kana), (romaji, name_romaji)):
+            if a and b and (a in b or b in a):
+                return 0.7 + 0.3 * min(len(a), len(b)) / max(len(a), len(b))
+
+        return 0.8 * dice
+
+    def resolve(self, query, limit=5):
+        """デバイス名からデバイスを検索
+
+        Args:
+            query: 検索するデバイス名
+            limit: 返す候補の最大数
+
+        Returns:
+            [(device, スコア)] をスコアの高い順に（スコアは0〜1）
+        """
+        kana = normalize_name(query)
+        if not kana:
+            return []
+        romaji = to_romaji(kana)
+        grams = self._device_grams(kana, romaji)
+
+        # 転置インデックスでn-gramの一致数を数え、Dice係数の高い候補だけを詳細に評価する
+        shared = Counter(chain.from_iterable(self._grams.get(gram, ()) for gram in grams))
+
+        dice = {i: 2 * count / (len(grams) + self._gram_counts[i]) for i, count in shared.items()}
+        top = heapq.nsmallest(RESCORE_CANDIDATES, dice, key=lambda i: (-dice[i], i))
+        scores = {i: self._score(i, kana, romaji, dice[i]) for i in top}
+
+        # エイリアス（同じエイリアスを持つデバイスが複数ある場合はスコアを下げる）
+        alias_hits = self._aliases.get(kana, {})
+        for i, score in alias_hits.items():
+            score = score if score > 0.9 else score + 0.3 / len(alias_hits)
+            scores[i] = max(scores.get(i, 0.0), score)
+
+        # 同点の場合はデバイス一覧の順
+        ranked = sorted((-score, i) for i, score in scores.items() if score >= MIN_SCORE)
+        return [(self.devices[i], -score) for score, i in ranked[:limit]]
+
+# インデックスのキャッシュ（デバイス一覧が変わった時だけ作り直す）
+_index_cache = {"key": None, "index": None}
+
+def get_index(devices):
+    """デバイス一覧に対応する検索インデックスを取得"""
+    key = tuple((d["id"], d["name"], d["type"]) for d in devices)
+    if key != _index_cache["key"]:
+        _index_cache["index"] = DeviceIndex(devices, load_aliases())
+        _index_cache["key"] = key
+    return _index_cache["index"]
+
+def resolve_device(device_name, devices, limit=5):
+    """デバイス名から候補をスコア付きで検索
+
+    Returns:
+        [(device, スコア)] をスコアの高い順に
+    """
+    return get_index(devices).resolve(device_name, limit)
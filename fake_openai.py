@@ -0,0 +1,191 @@
+"""ローカルのフェイクOpenAI APIサーバー（テスト・ベンチマーク用）
+
+Chat Completions API（POST /v1/chat/completions）だけを実装する。
+ユーザーの入力にデバイス一覧のデバイス名が含まれていれば control_switchbot_device の
+Function callingを返し、含まれていなければ確認の文章を返す。
+
+使い方:
+    python fake_openai.py  # http://127.0.0.1:8768/v1 で起動
+
+    # 別のターミナルで
+    OPENAI_BASE_URL=http://127.0.0.1:8768/v1 python agent.py
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# デバイス一覧のプロンプトの行（「- 照明001 (Ceiling Light)」）
+DEVICE_LINE_PATTERN = re.compile(r"^- (.+) \(([^()]+)\)$", re.MULTILINE)
+
+def estimate_tokens(text):
+    """トークン数の概算（日本語を含むため2文字で1トークン）"""
+    return max(1, len(text) // 2)
+
+def default_responder(messages, tools):
+    """入力からデバイス名と操作を推測してFunction callingを返す
+
+    Returns:
+        (content, tool_calls) tool_callsは [{"name", "arguments"}]
+    """
+    device_names = []
+    for message in messages:
+        if message.get("role") == "system":
+            device_names.extend(name for name, _ in DEVICE_LINE_PATTERN.findall(message.get("content") or ""))
+    user_text = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+
+    named = sorted((name for name in device_names if name in user_text), key=len, reverse=True)
+    if not named or not tools:
+        return "どのデバイスを操作しますか？", []
+
+    if "消" in user_text or "オフ" in user_text:
+        action = "消す"
+    elif "閉" in user_text:
+        action = "閉める"
+    elif "開" in user_text:
+        action = "開ける"
+    else:
+        action = "つける"
+    return None, [{"name": "control_switchbot_device", "arguments": {"device_name": named[0], "action": action}}]
+
+class FakeOpenAI:
+    """応答を関数で組み立てるフェイクOpenAI API"""
+
+    def __init__(self, responder=default_responder, latency=0.0, error_rate=0.0, host="127.0.0.1", port=8768):
+        """
+        Args:
+            responder: 応答を作る関数 responder(messages, tools) → (content, tool_calls)
+            latency: 応答までの遅延（秒、(最小, 最大)のタプルなら一様分布）
+            error_rate: HTTP 500を返す割合（0〜1、SDKがリトライする）
+            host: 待ち受けアドレス
+            port: 待ち受けポート（0で空いているポートを自動選択）
+        """
+        self.responder = responder
+        self.latency = latency
+        self.error_rate = error_rate
+        self.call_counts = {}     # エンドポイントごとの呼び出し回数
+        self.tokens = {"prompt": 0, "cached": 0, "completion": 0}
+        self._prefixes = set()    # 送られたことのあるプロンプトの先頭（プロンプトキャッシュの再現）
+        self._lock = threading.Lock()
+        self._counter = 0
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+
+    @property
+    def url(self):
+        """OPENAI_BASE_URLに指定するURL"""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """バックグラウンドでサーバーを起動"""
+        threading.Thread(target=self.server.serve_forever, name="fake-openai", daemon=True).start()
+        return self
+
+    def stop(self):
+        """サーバーを停止"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, key):
+        with self._lock:
+            self.call_counts[key] = self.call_counts.get(key, 0) + 1
+
+    def _delay(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def _usage(self, messages, completion_text):
+        # 先頭から連続するsystemメッセージが前回と同じならキャッシュ済みとして数える
+        prefix = "".join(m.get("content") or "" for m in messages[:2] if m.get("role") == "system")
+        prompt_tokens = estimate_tokens(json.dumps(messages, ensure_ascii=False))
+        completion_tokens = estimate_tokens(completion_text)
+        key = hashlib.sha1(prefix.encode("utf-8")).hexdigest()
+        with self._lock:
+            cached_tokens = min(prompt_tokens, estimate_tokens(prefix)) if key in self._prefixes else 0
+            self._prefixes.add(key)
+            self.tokens["prompt"] += prompt_tokens
+            self.tokens["cached"] += cached_tokens
+            self.tokens["completion"] += completion_tokens
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    def chat_completions(self, request):
+        messages = request.get("messages", [])
+        content, tool_calls = self.responder(messages, request.get("tools"))
+
+        with self._lock:
+            self._counter += 1
+            response_id = f"chatcmpl-fake{self._counter}"
+
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = [{
+                "id": f"call_{response_id}_{i}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call["arguments"], ensure_ascii=False)}
+            } for i, call in enumerate(tool_calls)]
+
+        return {
+            "id": response_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+            "usage": self._usage(messages, content or json.dumps(tool_calls, ensure_ascii=False)),
+        }
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if urlparse(self.path).path.rstrip("/") != "/v1/chat/completions":
+                    return self._reply(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+                fake._count("chat.completions")
+                fake._delay()
+                if fake.error_rate and random.random() < fake.error_rate:
+                    fake._count("errors")
+                    return self._reply(500, {"error": {"message": "fake server error", "type": "server_error"}})
+
+                try:
+                    request = json.loads(body.decode("utf-8") or "{}")
+                except ValueError:
+                    return self._reply(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+                self._reply(200, fake.chat_completions(request))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+if __name__ == "__main__":
+    fake = FakeOpenAI().start()
+    print(f"フェイクOpenAI APIを起動しました: {fake.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,184 @@
+"""ローカルのフェイクSlackサーバー（テスト用）
+
+Slack Web APIのうちボットが使う以下のメソッドだけを実装する。
+auth.test / conversations.history / conversations.replies / chat.postMessage
+
+使い方:
+    python fake_slack.py  # http://127.0.0.1:8765/api/ で起動
+
+    # 別のターミナルで
+    SLACK_API_URL=http://127.0.0.1:8765/api/ SLACK_MODE=polling python slack_bot.py
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+BOT_USER_ID = "UFAKEBOT"
+DEFAULT_USER_ID = "UFAKEUSER"
+
+class FakeSlack:
+    """メモリ上のチャンネルを持つフェイクSlack"""
+
+    def __init__(self, channel="CFAKE", host="127.0.0.1", port=8765, latency=0.0, error_rate=0.0):
+        """
+        Args:
+            channel: チャンネルID
+            host: 待ち受けアドレス
+            port: 待ち受けポート（0で空いているポートを自動選択）
+            latency: 応答までの遅延（秒、(最小, 最大)のタプルなら一様分布）
+            error_rate: ok=false（internal_error）を返す割合（0〜1）
+        """
+        self.channel = channel
+        self.latency = latency
+        self.error_rate = error_rate
+        self.messages = []        # 全メッセージ（古い順）
+        self.posted = []          # ボットが投稿したメッセージ
+        self.listeners = []       # push型の受信をシミュレートするコールバック
+        self.call_counts = {}     # メソッドごとの呼び出し回数
+        self._lock = threading.Lock()
+        self._last_ts = 0.0
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+
+    @property
+    def url(self):
+        """WebClientのbase_urlに指定するURL"""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+    def start(self):
+        """バックグラウンドでサーバーを起動"""
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """サーバーを停止"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _next_ts(self):
+        """単調増加するタイムスタンプを発行"""
+        ts = max(time.time(), self._last_ts + 0.000001)
+        self._last_ts = ts
+        return f"{ts:.6f}"
+
+    def _add_message(self, text, user, thread_ts=None):
+        with self._lock:
+            ts = self._next_ts()
+            message = {"type": "message", "channel": self.channel, "user": user, "text": text, "ts": ts}
+            if thread_ts:
+                message["thread_ts"] = thread_ts
+            self.messages.append(message)
+        return message
+
+    def post_user_message(self, text, thread_ts=None, user=DEFAULT_USER_ID):
+        """ユーザーの投稿をシミュレート（登録されたリスナーにもイベントとして通知）
+
+        Args:
+            text: メッセージ本文
+            thread_ts: スレッドへの返信の場合は親メッセージのts
+            user: 投稿ユーザーID
+        """
+        message = self._add_message(text, user, thread_ts)
+        for listener in self.listeners:
+            listener(dict(message))
+        return message
+
+    # --- Web APIメソッド ---
+
+    def auth_test(self, params):
+        return {"ok": True, "user": "fake-bot", "user_id": BOT_USER_ID, "team": "fake-team"}
+
+    def conversations_history(self, params):
+        oldest = float(params.get("oldest", 0))
+        limit = int(params.get("limit", 100))
+        with self._lock:
+            top_level = [m for m in self.messages
+                         if m.get("thread_ts", m["ts"]) == m["ts"] and float(m["ts"]) > oldest]
+        return {"ok": True, "messages": list(reversed(top_level))[:limit]}
+
+    def conversations_replies(self, params):
+        thread_ts = params.get("ts")
+        oldest = float(params.get("oldest", 0))
+        with self._lock:
+            parent = [m for m in self.messages if m["ts"] == thread_ts]
+            replies = [m for m in self.messages
+                       if m.get("thread_ts") == thread_ts and m["ts"] != thread_ts and float(m["ts"]) > oldest]
+        return {"ok": True, "messages": parent + replies}
+
+    def chat_postMessage(self, params):
+        message = self._add_message(params.get("text", ""), BOT_USER_ID, params.get("thread_ts"))
+        message["bot_id"] = "BFAKE"
+        self.posted.append(message)
+        return {"ok": True, "channel": self.channel, "ts": message["ts"], "message": message}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _params(self):
+                parsed = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    body = self.rfile.read(length).decode("utf-8")
+                    if "json" in (self.headers.get("Content-Type") or ""):
+                        params.update(json.loads(body))
+                    else:
+                        params.update({k: v[0] for k, v in parse_qs(body).items()})
+                return parsed.path.rsplit("/", 1)[-1], params
+
+            def _handle(self):
+                method, params = self._params()
+                with fake._lock:
+                    fake.call_counts[method] = fake.call_counts.get(method, 0) + 1
+
+                latency = fake.latency
+                if isinstance(latency, (tuple, list)):
+                    latency = random.uniform(*latency)
+                if latency:
+                    time.sleep(latency)
+
+                func = getattr(fake, method.replace(".", "_"), None)
+                if fake.error_rate and random.random() < fake.error_rate:
+                    payload = {"ok": False, "error": "internal_error"}
+                else:
+                    payload = func(params) if func else {"ok": False, "error": "unknown_method"}
+
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+if __name__ == "__main__":
+    fake = FakeSlack()
+    print(f"フェイクSlackサーバーを起動しました: {fake.url}")
+    print(f"チャンネルID: {fake.channel}")
+    print("メッセージを入力すると投稿されます（'返信 <thread_ts> <本文>'でスレッド返信）")
+    fake.start()
+    try:
+        while True:
+            line = input("> ").strip()
+            if not line:
+                continue
+            if line.startswith("返信 "):
+                _, thread_ts, text = line.split(" ", 2)
+                fake.post_user_message(text, thread_ts=thread_ts)
+            else:
+                print(f"ts={fake.post_user_message(line)['ts']}")
+            for message in fake.posted[-5:]:
+                print(f"  Bot: {message['text']}")
+    except (KeyboardInterrupt, EOFError):
+        fake.stop()
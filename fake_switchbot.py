@@ -0,0 +1,196 @@
+"""ローカルのフェイクSwitchbot APIサーバー（テスト・ベンチマーク用）
+
+Switchbot API v1.1のうちボットが使う以下のエンドポイントだけを実装する。
+GET /v1.1/devices / GET /v1.1/devices/{id}/status / POST /v1.1/devices/{id}/commands
+
+使い方:
+    python fake_switchbot.py 20  # 20台のデバイスで http://127.0.0.1:8767/v1.1 に起動
+
+    # 別のターミナルで
+    SWITCH_BOT_API_URL=http://127.0.0.1:8767/v1.1 python agent.py
+"""
+import sys
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# デバイスタイプ → デバイス名の接頭辞と初期ステータス
+DEVICE_TEMPLATES = [
+    ("Ceiling Light", "照明", {"power": "off", "brightness": 100, "colorTemperature": 4000}),
+    ("Curtain3", "カーテン", {"slidePosition": 0, "moving": False}),
+    ("Plug Mini (JP)", "プラグ", {"power": "off", "voltage": 100.0, "weight": 0.0}),
+    ("Smart Lock Ultra", "ドア", {"lockState": "locked", "doorState": "closed"}),
+]
+
+def make_devices(count):
+    """タイプを順番に割り当てたデバイス一覧を作成（名前は「照明001」など）"""
+    devices = []
+    for i in range(count):
+        device_type, prefix, _ = DEVICE_TEMPLATES[i % len(DEVICE_TEMPLATES)]
+        devices.append({"id": f"FAKE{i:08X}", "name": f"{prefix}{i + 1:03d}", "type": device_type})
+    return devices
+
+class FakeSwitchBot:
+    """メモリ上のデバイスを持つフェイクSwitchbot API"""
+
+    def __init__(self, devices=None, latency=0.0, error_rate=0.0, host="127.0.0.1", port=8767):
+        """
+        Args:
+            devices: デバイス一覧（[{"id", "name", "type"}]、整数なら台数）
+            latency: 応答までの遅延（秒、(最小, 最大)のタプルなら一様分布）
+            error_rate: HTTP 500を返す割合（0〜1）
+            host: 待ち受けアドレス
+            port: 待ち受けポート（0で空いているポートを自動選択）
+        """
+        if devices is None or isinstance(devices, int):
+            devices = make_devices(4 if devices is None else devices)
+        self.devices = devices
+        self.latency = latency
+        self.error_rate = error_rate
+        self.status = {d["id"]: self._initial_status(d) for d in devices}
+        self.commands = []        # 受け付けたコマンド (device_id, command, parameter)
+        self.call_counts = {}     # エンドポイントごとの呼び出し回数
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+
+    @property
+    def url(self):
+        """SWITCH_BOT_API_URLに指定するURL"""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1.1"
+
+    def start(self):
+        """バックグラウンドでサーバーを起動"""
+        threading.Thread(target=self.server.serve_forever, name="fake-switchbot", daemon=True).start()
+        return self
+
+    def stop(self):
+        """サーバーを停止"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def _initial_status(device):
+        for device_type, _, status in DEVICE_TEMPLATES:
+            if device_type == device["type"]:
+                return dict(status, deviceId=device["id"], deviceType=device["type"])
+        return {"deviceId": device["id"], "deviceType": device["type"]}
+
+    def _count(self, key):
+        with self._lock:
+            self.call_counts[key] = self.call_counts.get(key, 0) + 1
+
+    def _delay(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    # --- APIエンドポイント ---
+
+    def get_devices(self):
+        device_list = [{"deviceId": d["id"], "deviceName": d["name"], "deviceType": d["type"],
+                        "enableCloudService": True, "hubDeviceId": ""} for d in self.devices]
+        return {"statusCode": 100, "message": "success", "body": {"deviceList": device_list, "infraredRemoteList": []}}
+
+    def get_status(self, device_id):
+        with self._lock:
+            status = self.status.get(device_id)
+            body = dict(status) if status else None
+        if body is None:
+            return {"statusCode": 152, "message": "device not found", "body": {}}
+        return {"statusCode": 100, "message": "success", "body": body}
+
+    def send_command(self, device_id, data):
+        command = data.get("command")
+        parameter = data.get("parameter", "default")
+        with self._lock:
+            status = self.status.get(device_id)
+            if status is None:
+                return {"statusCode": 152, "message": "device not found", "body": {}}
+            self.commands.append((device_id, command, parameter))
+            if command in ("turnOn", "turnOff"):
+                status["power"] = "on" if command == "turnOn" else "off"
+                if "slidePosition" in status:
+                    status["slidePosition"] = 0 if command == "turnOn" else 100
+            elif command in ("lock", "unlock"):
+                status["lockState"] = "locked" if command == "lock" else "unlocked"
+            elif command == "setBrightness":
+                status.update(power="on", brightness=int(parameter))
+            elif command == "setColorTemperature":
+                status.update(power="on", colorTemperature=int(parameter))
+        return {"statusCode": 100, "message": "success", "body": {}}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-Aliveで接続を再利用（クライアントのコネクションプールを計測できるように）
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                parts = urlparse(self.path).path.strip("/").split("/")
+
+                # /v1.1/devices, /v1.1/devices/{id}/status, /v1.1/devices/{id}/commands
+                if parts[:2] != ["v1.1", "devices"]:
+                    return self._reply(404, {"statusCode": 404, "message": "not found"})
+                if len(parts) == 2 and method == "GET":
+                    key = "devices"
+                elif len(parts) == 4 and parts[3] == "status" and method == "GET":
+                    key = "status"
+                elif len(parts) == 4 and parts[3] == "commands" and method == "POST":
+                    key = "commands"
+                else:
+                    return self._reply(404, {"statusCode": 404, "message": "not found"})
+
+                fake._count(key)
+                fake._delay()
+                if fake.error_rate and random.random() < fake.error_rate:
+                    fake._count("errors")
+                    return self._reply(500, {"statusCode": 500, "message": "internal error"})
+
+                if key == "devices":
+                    return self._reply(200, fake.get_devices())
+                if key == "status":
+                    return self._reply(200, fake.get_status(parts[2]))
+                try:
+                    data = json.loads(body.decode("utf-8") or "{}")
+                except ValueError:
+                    return self._reply(400, {"statusCode": 400, "message": "invalid body"})
+                return self._reply(200, fake.send_command(parts[2], data))
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    fake = FakeSwitchBot(count).start()
+    print(f"フェイクSwitchbot APIを起動しました: {fake.url}（{count}台）")
+    for device in fake.devices[:10]:
+        print(f"  {device['name']} ({device['type']}) {device['id']}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
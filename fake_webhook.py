@@ -0,0 +1,61 @@
+"""Switchbot Webhookのイベントを送るフェイク（テスト用）
+
+使い方:
+    python webhook.py serve  # 受信サーバーを起動
+
+    # 別のターミナルで
+    python fake_webhook.py http://127.0.0.1:8766/switchbot/webhook <deviceId> powerState=ON brightness=80
+"""
+import sys
+import json
+import time
+import requests
+
+# デバイスタイプごとのイベントのdeviceType
+EVENT_DEVICE_TYPES = {
+    "Ceiling Light": "WoCeiling",
+    "Curtain3": "WoCurtain3",
+    "Plug Mini (JP)": "WoPlugJP",
+    "Smart Lock Ultra": "WoLockUltra",
+}
+
+def sample_event(device_id, device_type=None, **context):
+    """状態変化（changeReport）のイベントを作成
+
+    Args:
+        device_id: デバイスID
+        device_type: デバイスタイプ (例: "Ceiling Light")
+        **context: 状態 (例: powerState="ON", lockState="LOCKED", slidePosition=50)
+    """
+    return {
+        "eventType": "changeReport",
+        "eventVersion": "1",
+        "context": dict({
+            "deviceType": EVENT_DEVICE_TYPES.get(device_type, device_type or "Unknown"),
+            "deviceMac": device_id,
+            "timeOfSample": int(time.time() * 1000)
+        }, **context)
+    }
+
+def post_event(url, event, timeout=5):
+    """イベントを受信サーバーに送信
+
+    Returns:
+        HTTPステータスコード
+    """
+    return requests.post(url, data=json.dumps(event), headers={"Content-Type": "application/json"},
+                         timeout=timeout).status_code
+
+def _parse_value(value):
+    return int(value) if value.lstrip("-").isdigit() else value
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("使い方: python fake_webhook.py <受信URL> <deviceId> <項目>=<値> ...")
+        sys.exit(1)
+
+    url, device_id = sys.argv[1], sys.argv[2]
+    context = dict(arg.split("=", 1) for arg in sys.argv[3:])
+    event = sample_event(device_id, **{k: _parse_value(v) for k, v in context.items()})
+    print(f"送信: {event}")
+    print(f"応答: {post_event(url, event)}")
@@ -0,0 +1,103 @@
+"""会話履歴の圧縮（トークン数の上限に収める）"""
+
+# 1メッセージあたりのロール等のオーバーヘッド（トークン）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 要約に含める1メッセージあたりの最大文字数
+SUMMARY_CHARS_PER_MESSAGE = 40
+
+def estimate_tokens(text):
+    """テキストのトークン数を概算
+
+    英数字はおよそ4文字で1トークン、日本語などはおよそ1文字1トークンとして数える。
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+def message_tokens(message):
+    """1メッセージのトークン数を概算"""
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+def summarize_messages(messages, max_tokens):
+    """古いメッセージを1つのsystemメッセージに要約（各メッセージの先頭のみを残す）
+
+    新しいものから順に、max_tokensに収まる分だけ含める。
+
+    Returns:
+        要約メッセージ（1件も含められない場合はNone）と要約に含めた件数
+    """
+    header = "これまでの会話の要約:"
+    lines = []
+    used = estimate_tokens(header) + MESSAGE_OVERHEAD_TOKENS
+
+    for message in reversed(messages):
+        content = (message.get("content") or "").replace("\n", " ")
+        if len(content) > SUMMARY_CHARS_PER_MESSAGE:
+            content = content[:SUMMARY_CHARS_PER_MESSAGE] + "…"
+        role = "ユーザー" if message.get("role") == "user" else "アシスタント"
+        line = f"- {role}: {content}"
+
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        lines.append(line)
+        used += cost
+
+    if not lines:
+        return None, 0
+
+    return {"role": "system", "content": "\n".join([header] + list(reversed(lines)))}, len(lines)
+
+def compact_history(history, token_budget=1500, keep_last=6):
+    """会話履歴をトークン予算内に圧縮
+
+    直近keep_last件はそのまま残し、それより古いメッセージは残りの予算の範囲で要約する。
+    直近分だけで予算を超える場合は古いものから削除する（最新の2件は必ず残す）。
+
+    Args:
+        history: 会話履歴のリスト（[{"role": ..., "content": ...}]）
+        token_budget: 履歴に使う最大トークン数
+        keep_last: そのまま残す直近のメッセージ数
+
+    Returns:
+        (圧縮後の履歴, 統計情報の辞書)
+        統計情報: original_tokens, compacted_tokens, saved_tokens, summarized, dropped
+    """
+    history = list(history or [])
+    original_tokens = sum(message_tokens(m) for m in history)
+    stats = {
+        "original_tokens": original_tokens,
+        "compacted_tokens": original_tokens,
+        "saved_tokens": 0,
+        "summarized": 0,
+        "dropped": 0
+    }
+
+    if original_tokens <= token_budget:
+        return history, stats
+
+    older = history[:-keep_last] if keep_last else history
+    recent = history[-keep_last:] if keep_last else []
+
+    # 直近分が予算を超える場合は古いものから削除
+    recent_tokens = sum(message_tokens(m) for m in recent)
+    while len(recent) > 2 and recent_tokens > token_budget:
+        removed = recent.pop(0)
+        recent_tokens -= message_tokens(removed)
+        older.append(removed)
+
+    # 残りの予算で古いメッセージを要約
+    summary, summarized = summarize_messages(older, token_budget - recent_tokens)
+    compacted = ([summary] if summary else []) + recent
+
+    compacted_tokens = sum(message_tokens(m) for m in compacted)
+    stats.update({
+        "compacted_tokens": compacted_tokens,
+        "saved_tokens": original_tokens - compacted_tokens,
+        "summarized": summarized,
+        "dropped": len(older) - summarized
+    })
+
+    return compacted, stats
@@ -0,0 +1,195 @@
+"""ローカル意図解析 - 単純なコマンドをOpenAIを使わずに解釈"""
+import re
+import unicodedata
+from utils import COLOR_TEMP_MAP
+
+# デバイスタイプごとの一般名称（デバイス名が含まれない場合に使用）
+TYPE_KEYWORDS = {
+    "Ceiling Light": ["シーリングライト", "ライト", "照明", "電気", "light", "lamp"],
+    "Curtain3": ["カーテン", "curtain", "curtains"],
+    "Plug Mini (JP)": ["プラグ", "コンセント", "plug"],
+    "Smart Lock Ultra": ["スマートロック", "ドア", "玄関", "鍵", "カギ", "door", "lock"],
+}
+
+# 操作の言い回し → 正規化したアクション（長い表現を先に判定）
+ACTION_PHRASES = [
+    ("unlock", ["ロック解除", "ロックを解除", "解錠", "開錠", "鍵を開け", "カギを開け", "unlock"]),
+    ("lock", ["施錠", "ロックして", "ロックに", "鍵を閉め", "カギを閉め", "鍵をかけ", "カギをかけ", "lock"]),
+    ("on", ["つけて", "点けて", "付けて", "つける", "オンに", "オンして", "オン", "turn on", "switch on", "on"]),
+    ("off", ["消して", "けして", "消す", "オフに", "オフして", "オフ", "turn off", "switch off", "off"]),
+    ("open", ["開けて", "あけて", "開ける", "開いて", "open"]),
+    ("close", ["閉めて", "しめて", "閉める", "閉じて", "close", "shut"]),
+]
+
+# デバイスタイプごとの正規化アクション → DEVICE_COMMANDSのキー
+TYPE_ACTIONS = {
+    "Smart Lock Ultra": {"lock": "lock", "unlock": "unlock", "open": "unlock", "close": "lock"},
+    "Curtain3": {"open": "open", "close": "close", "on": "open", "off": "close"},
+    "Plug Mini (JP)": {"on": "on", "off": "off"},
+    "Ceiling Light": {"on": "on", "off": "off"},
+}
+
+# デバイス一覧の言い回し
+LIST_PHRASES = ["デバイス一覧", "デバイスの一覧", "デバイスリスト", "device list", "list devices"]
+
+# ローカルで処理すべきでない表現（スケジュール・質問・否定・相対指定など）
+FALLBACK_PATTERNS = re.compile(
+    r"(\d{1,2}\s*[:：時]|毎|朝|夜|後で|分後|時間後|スケジュール|予約|"
+    r"[?？]|ですか|ますか|どう|状態|なってる|"
+    r"ないで|しない|don't|do not|not |"
+    r"もっと|少し|ちょっと|暗く|明るく|半分|全部|すべて|全て|"
+    r"schedule|every|at \d|when|status|\band\b|、|と(?=.*(?:を|も)))",
+    re.IGNORECASE
+)
+
+# 意図の一部とみなす助詞・定型句（確信度計算の際に除外）
+FILLER_PATTERN = re.compile(
+    r"(を|に|へ|は|の|して|する|ください|下さい|お願い|おねがい|します|"
+    r"please|the|turn|set|to|switch|%|％|パーセント|明るさ|brightness|色温度|color|temperature|"
+    r"[\s。、！!.])",
+    re.IGNORECASE
+)
+
+# ローカル処理を行う最低確信度
+DEFAULT_MIN_CONFIDENCE = 0.8
+
+def normalize(text):
+    """全角/半角・大文字小文字を正規化"""
+    return unicodedata.normalize("NFKC", text).lower().strip()
+
+def _contains(text, phrase):
+    """フレーズを含むか判定（英単語は単語境界で判定）"""
+    if phrase.isascii():
+        return re.search(rf"(?<![a-z]){re.escape(phrase)}(?![a-z])", text) is not None
+    return phrase in text
+
+def _find_device(text, devices):
+    """テキストに含まれるデバイスを特定
+
+    Returns:
+        (device, 一致した文字列, 確信度) または (None, None, 0)
+    """
+    # 1. デバイス名そのものが含まれる場合（最長一致）
+    named = [d for d in devices if normalize(d["name"]) and normalize(d["name"]) in text]
+    if named:
+        named.sort(key=lambda d: len(d["name"]), reverse=True)
+        longest = named[0]
+        # 別のデバイス名も含まれていれば複数デバイスの指示
+        others = [d for d in named[1:] if normalize(d["name"]) not in normalize(longest["name"])]
+        if others:
+            return None, None, 0
+        return longest, normalize(longest["name"]), 1.0
+
+    # 2. 一般名称からタイプを特定し、そのタイプのデバイスが1台だけなら採用
+    matched_types = {}
+    for device_type, keywords in TYPE_KEYWORDS.items():
+        for keyword in keywords:
+            if _contains(text, keyword):
+                matched_types.setdefault(device_type, keyword)
+                break
+
+    if len(matched_types) != 1:
+        return None, None, 0
+
+    device_type, keyword = next(iter(matched_types.items()))
+    candidates = [d for d in devices if d["type"] == device_type]
+    if len(candidates) != 1:
+        return None, None, 0
+
+    return candidates[0], keyword, 0.9
+
+def _find_action(text):
+    """テキストから操作を特定
+
+    Returns:
+        (正規化アクション, 一致した文字列) または (None, None)
+    """
+    found = []
+    for action, phrases in ACTION_PHRASES:
+        for phrase in phrases:
+            if _contains(text, phrase):
+                found.append((action, phrase))
+                break
+
+    if not found:
+        return None, None
+
+    # 「ロック解除」は「ロック」も含むため、長い表現を優先して重複を除く
+    found.sort(key=lambda item: len(item[1]), reverse=True)
+    action, phrase = found[0]
+    for other_action, other_phrase in found[1:]:
+        if other_action != action and other_phrase not in phrase:
+            return None, None
+
+    return action, phrase
+
+def _leftover_confidence(text, *matched):
+    """意図に使われなかった文字が多いほど確信度を下げる"""
+    rest = text
+    for part in matched:
+        if part:
+            rest = rest.replace(part, "")
+    rest = FILLER_PATTERN.sub("", rest)
+
+    if len(rest) <= 2:
+        return 1.0
+    if len(rest) <= 4:
+        return 0.8
+    return 0.5
+
+def parse_intent(text, devices):
+    """ユーザー入力を解析して意図を返す
+
+    Args:
+        text: ユーザーの入力
+        devices: デバイスリスト（[{"id", "name", "type"}]）
+
+    Returns:
+        意図の辞書 {"kind", "device", "action", "value", "confidence"}、解釈できない場合はNone
+        kind: "list_devices" / "control" / "brightness" / "color_temp"
+    """
+    text = normalize(text)
+    if not text:
+        return None
+
+    if any(phrase in text for phrase in LIST_PHRASES):
+        return {"kind": "list_devices", "device": None, "action": None, "value": None,
+                "confidence": _leftover_confidence(text, *LIST_PHRASES, "見せて", "教えて", "show")}
+
+    if FALLBACK_PATTERNS.search(text):
+        return None
+
+    device, device_text, confidence = _find_device(text, devices)
+    if not device:
+        return None
+
+    # デバイス名を除いてから操作を判定（「白いシーリングライト」の「白」などを誤検出しない）
+    rest = text.replace(device_text, " ")
+
+    # 明るさ（例: 「明るさを50%に」）
+    brightness = re.search(r"(\d{1,3})\s*(%|パーセント)", rest)
+    if brightness and device["type"] == "Ceiling Light":
+        value = int(brightness.group(1))
+        if not 1 <= value <= 100:
+            return None
+        return {"kind": "brightness", "device": device, "action": "setBrightness", "value": value,
+                "confidence": confidence * _leftover_confidence(rest, brightness.group(0), "にして", "に")}
+
+    # 色温度（例: 「暖色にして」）
+    if device["type"] == "Ceiling Light":
+        temps = [key for key in sorted(COLOR_TEMP_MAP, key=len, reverse=True) if _contains(rest, key)]
+        if temps:
+            return {"kind": "color_temp", "device": device, "action": "setColorTemperature", "value": temps[0],
+                    "confidence": confidence * _leftover_confidence(rest, temps[0], "色", "にして")}
+
+    # ON/OFF・開閉・施錠
+    action, action_text = _find_action(rest)
+    if not action:
+        return None
+
+    action_key = TYPE_ACTIONS.get(device["type"], {}).get(action)
+    if not action_key:
+        return None
+
+    return {"kind": "control", "device": device, "action": action_key, "value": None,
+            "confidence": confidence * _leftover_confidence(rest, action_text)}
@@ -0,0 +1,182 @@
+"""構造化ログ（JSON形式・レベル付き・キュー経由で出力・リクエストごとのコンテキスト）
+
+ログはキューに入れるだけで、標準出力への書き込みは専用のスレッドで行う
+（メッセージ処理のスレッドがI/Oで止まらない）。
+
+使い方:
+    from log import get_logger, bind, new_request_id
+
+    logger = get_logger("slack_bot")
+
+    with bind(request_id=new_request_id(), thread_ts=ts):
+        logger.info("受信", text=text)                     # 出力にrequest_id・thread_tsが付く
+        logger.debug("ポーリング", messages=0, sample=True)  # LOG_SAMPLE回に1回だけ出力
+"""
+import sys
+import copy
+import json
+import uuid
+import queue
+import atexit
+import logging
+import threading
+import contextlib
+import contextvars
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from config import get_env
+
+# 出力するログのレベル（DEBUG / INFO / WARNING / ERROR）
+LOG_LEVEL = get_env("LOG_LEVEL", "INFO").upper()
+
+# 出力形式（json: 1行1つのJSON、text: 人が読む形式）
+LOG_FORMAT = get_env("LOG_FORMAT", "json")
+
+# sample=Trueのログ（ポーリングごとのログなど）を何回に1回出力するか（1なら全て出力）
+LOG_SAMPLE = get_env("LOG_SAMPLE", 20, int)
+
+# 全てのロガーの親
+ROOT_LOGGER = "switchbot"
+
+# ログに付けるコンテキスト（request_id, thread_ts, device_id など）
+_context = contextvars.ContextVar("log_context", default={})
+
+@contextlib.contextmanager
+def bind(**fields):
+    """withの中で出力するログにフィールドを付ける（Noneのフィールドは付けない）"""
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def new_request_id():
+    """リクエストID（ログの追跡用）"""
+    return uuid.uuid4().hex[:12]
+
+def current_context():
+    """現在のコンテキストのフィールド"""
+    return dict(_context.get())
+
+class StructuredLogger(logging.LoggerAdapter):
+    """キーワード引数をログのフィールドとして出力するロガー
+
+    logger.info("応答", response=text, elapsed_ms=12.3)
+    sample=True（またはN）を付けるとN回に1回だけ出力する。
+    """
+
+    RESERVED = ("exc_info", "stack_info", "stacklevel", "extra")
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in self.RESERVED}
+        sample = fields.pop("sample", None)
+        extra = dict(kwargs.get("extra") or {})
+        extra["fields"] = fields
+        if sample:
+            extra["sample"] = LOG_SAMPLE if sample is True else int(sample)
+        kwargs["extra"] = extra
+        return msg, kwargs
+
+def get_logger(name):
+    """モジュールのロガーを取得 (例: get_logger("slack_bot"))"""
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"), {})
+
+class ContextFilter(logging.Filter):
+    """ログを出力したスレッドのコンテキストを記録に付ける"""
+
+    def filter(self, record):
+        record.context = _context.get()
+        return True
+
+class SampleFilter(logging.Filter):
+    """sampleが指定されたログを、ロガーとメッセージごとにN回に1回だけ通す"""
+
+    def __init__(self):
+        super().__init__()
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        every = getattr(record, "sample", None)
+        if not every or every <= 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        if count % every:
+            return False
+        record.fields = dict(getattr(record, "fields", {}), sampled=every)
+        return True
+
+class AsyncQueueHandler(QueueHandler):
+    """ログをキューに入れるハンドラー（書式化と書き込みはQueueListenerのスレッドで行う）"""
+
+    def prepare(self, record):
+        # 引数・例外は呼び出し元のスレッドで文字列にしておく（後から変更されても影響しない）
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """1行1つのJSONに書式化"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "context", {}))
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """[時刻] レベル メッセージ key=value ... の形式に書式化"""
+
+    def format(self, record):
+        fields = {**getattr(record, "context", {}), **getattr(record, "fields", {})}
+        text = f"[{datetime.fromtimestamp(record.created).strftime('%H:%M:%S')}] {record.levelname:<7} {record.getMessage()}"
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            text += "\n" + record.exc_text
+        return text
+
+class StdoutHandler(logging.StreamHandler):
+    """書き込み時点のsys.stdoutに出力（contextlib.redirect_stdoutに従う）"""
+
+    def emit(self, record):
+        self.stream = sys.stdout
+        super().emit(record)
+
+def _setup():
+    log_queue = queue.SimpleQueue()   # 上限なし（ログの出力でput側がブロックしない）
+
+    handler = AsyncQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SampleFilter())
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(handler)
+    root.propagate = False
+
+    output = StdoutHandler()
+    output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+
+    listener = QueueListener(log_queue, output)
+    listener.start()
+    # 終了時にキューに残ったログを書き出す
+    atexit.register(listener.stop)
+    return listener
+
+listener = _setup()
@@ -0,0 +1,271 @@
+"""処理時間・件数のメトリクス（Prometheus形式の/metricsで公開）
+
+使い方:
+    from metrics import span, counter
+
+    with span("llm"):
+        response = client.chat.completions.create(...)
+
+    API_ERRORS = counter("api_errors_total", "APIエラー数", ["code"])
+    API_ERRORS.inc(code=190)
+"""
+import time
+import bisect
+import threading
+from config import get_env
+
+# /metricsの待ち受けアドレス・ポート（ポート未設定なら起動しない）
+METRICS_HOST = get_env("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = get_env("METRICS_PORT", 0, int)
+
+# メトリクス名の接頭辞
+PREFIX = "switchbot_"
+
+# 処理時間のヒストグラムの区切り（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = {}          # メトリクス名 → Counter / Histogram / Gauge
+_registry_lock = threading.Lock()
+
+# デバイスID → デバイスタイプ（コマンドの処理時間をタイプごとに集計するため）
+_device_types = {}
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class Counter:
+    """増加のみのカウンター"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """カウンターを増やす"""
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+class Histogram:
+    """値の分布（処理時間など）"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}    # ラベル → [区切りごとの件数..., +Inf, 合計, 件数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """値を記録"""
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def collect(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((f"{self.name}_bucket", key, cumulative, [("le", le)]))
+            samples.append((f"{self.name}_sum", key, counts[-2]))
+            samples.append((f"{self.name}_count", key, counts[-1]))
+        return samples
+
+class Gauge:
+    """収集時に関数から値を取得するゲージ（キューの長さ・残り回数など）"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func, labelnames=()):
+        """
+        Args:
+            func: 値を返す関数（ラベルがある場合は {ラベル値のタプル: 値}）
+        """
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def collect(self):
+        try:
+            value = self.func()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [(self.name, tuple(str(v) for v in key), val) for key, val in value.items()]
+        return [(self.name, (), value)]
+
+def _register(metric):
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None and type(existing) is type(metric) and not isinstance(metric, Gauge):
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+def counter(name, help_text, labelnames=()):
+    """カウンターを作成（同じ名前なら既存のものを返す）"""
+    return _register(Counter(PREFIX + name, help_text, labelnames))
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """ヒストグラムを作成（同じ名前なら既存のものを返す）"""
+    return _register(Histogram(PREFIX + name, help_text, labelnames, buckets))
+
+def gauge(name, help_text, func, labelnames=()):
+    """収集時にfuncを呼ぶゲージを登録（同じ名前なら置き換え）"""
+    return _register(Gauge(PREFIX + name, help_text, func, labelnames))
+
+# 処理段階ごとの時間と失敗数
+STAGE_SECONDS = histogram("stage_seconds", "処理段階ごとの処理時間（秒）", ["stage"])
+STAGE_ERRORS = counter("stage_errors_total", "処理段階ごとの例外の数", ["stage"])
+
+class span:
+    """処理段階の時間を計測するコンテキストマネージャー
+
+    with span("llm"):
+        ...
+    """
+
+    __slots__ = ("stage", "histogram", "labels", "started")
+
+    def __init__(self, stage, histogram=None, **labels):
+        """
+        Args:
+            stage: 処理段階の名前 (例: "slack_fetch", "llm", "switchbot_request")
+            histogram: 記録先（省略時はstage_seconds）
+            **labels: 記録先のヒストグラムのラベル
+        """
+        self.stage = stage
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        if self.histogram is None:
+            STAGE_SECONDS.observe(elapsed, stage=self.stage)
+        else:
+            self.histogram.observe(elapsed, **self.labels)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage)
+        return False
+
+def set_device_types(devices):
+    """デバイス一覧からデバイスタイプの対応を更新"""
+    _device_types.clear()
+    _device_types.update({d["id"]: d["type"] for d in devices})
+
+def device_type(device_id):
+    """デバイスIDのデバイスタイプ（不明ならunknown）"""
+    return _device_types.get(device_id, "unknown")
+
+def render():
+    """全てのメトリクスをPrometheusのテキスト形式で出力"""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for sample in metric.collect():
+            name, key, value = sample[:3]
+            extra = sample[3] if len(sample) > 3 else None
+            lines.append(f"{name}{_format_labels(metric.labelnames, key, extra)} {value}")
+    return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """/metricsを公開するHTTPサーバー"""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        """
+        Args:
+            host: 待ち受けアドレス
+            port: 待ち受けポート（0で空いているポートを自動選択）
+        """
+        # http.serverはサーバーを起動するときだけ読み込む
+        from http.server import ThreadingHTTPServer
+
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        """バックグラウンドでサーバーを起動"""
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        return self
+
+    def stop(self):
+        """サーバーを停止"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def _make_handler():
+        from http.server import BaseHTTPRequestHandler
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                data = render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def start_metrics_server():
+    """設定されていれば/metricsのサーバーを起動（METRICS_PORT未設定ならNone）"""
+    if not METRICS_PORT:
+        return None
+    server = MetricsServer().start()
+    print(f"メトリクスを公開しました: {server.url}")
+    return server
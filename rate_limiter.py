@@ -0,0 +1,200 @@
+"""Switchbot APIのレート制限（トークンバケット）と1日のリクエスト上限の管理"""
+import os
+import json
+import time
+import atexit
+import threading
+from datetime import datetime, timezone
+from config import get_env
+import metrics
+from log import get_logger
+
+logger = get_logger("rate_limiter")
+
+# 1日のリクエスト上限（Switchbot APIは1日10,000回）
+SWITCHBOT_DAILY_LIMIT = get_env("SWITCHBOT_DAILY_LIMIT", 10000, int)
+
+# 1秒あたりのリクエスト数と、まとめて送れる最大数
+SWITCHBOT_RATE_LIMIT = get_env("SWITCHBOT_RATE_LIMIT", 5.0, float)
+SWITCHBOT_BURST = get_env("SWITCHBOT_BURST", 10, int)
+
+# 残り回数がこれ以下になったら、その優先度のリクエストを送らない
+# （バックグラウンド → 対話 の順に止め、最後までスケジュール実行の分を残す）
+SWITCHBOT_BACKGROUND_RESERVE = get_env("SWITCHBOT_BACKGROUND_RESERVE", 1000, int)
+SWITCHBOT_INTERACTIVE_RESERVE = get_env("SWITCHBOT_INTERACTIVE_RESERVE", 200, int)
+
+# 使用回数を保存するファイル
+SWITCHBOT_QUOTA_FILE = get_env("SWITCHBOT_QUOTA_FILE", "api_quota.json")
+
+# 優先度（scheduled: スケジュール実行、interactive: ユーザーの操作、background: キャッシュ更新など）
+PRIORITIES = ("scheduled", "interactive", "background")
+
+# 使用回数をファイルに書き込む間隔（秒）
+QUOTA_FLUSH_INTERVAL = 5.0
+
+class RateLimitExceeded(Exception):
+    """レート制限・1日の上限によりリクエストを送れない"""
+
+class RateLimiter:
+    """トークンバケットと1日のリクエスト上限で、優先度ごとにリクエストを制御
+
+    バックグラウンドのリクエストはバケットに余裕がある時だけ送り（足りなければ待つ）、
+    1日の残り回数が少なくなったら低い優先度から送らないようにする。
+    """
+
+    def __init__(self, rate=SWITCHBOT_RATE_LIMIT, burst=SWITCHBOT_BURST, daily_limit=SWITCHBOT_DAILY_LIMIT,
+                 reserves=None, quota_file=SWITCHBOT_QUOTA_FILE):
+        """
+        Args:
+            rate: 1秒あたりのリクエスト数
+            burst: まとめて送れる最大数（バケットの容量）
+            daily_limit: 1日のリクエスト上限
+            reserves: 優先度ごとに残す回数 {"background": 1000, "interactive": 200}
+            quota_file: 使用回数を保存するファイル（Noneなら保存しない）
+        """
+        self.rate = rate
+        self.burst = burst
+        self.daily_limit = daily_limit
+        self.reserves = reserves or {
+            "scheduled": 0,
+            "interactive": SWITCHBOT_INTERACTIVE_RESERVE,
+            "background": SWITCHBOT_BACKGROUND_RESERVE,
+        }
+        self.quota_file = quota_file
+
+        self._cond = threading.Condition()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._day = self._today()
+        self._used = 0
+        self._dirty = False
+        self._flushed_at = 0.0
+        self._shed = {p: 0 for p in PRIORITIES}
+        self._waited = {p: 0 for p in PRIORITIES}
+        self._load()
+
+    @staticmethod
+    def _today():
+        # Switchbot APIの上限はUTCの日付で数える
+        return datetime.now(timezone.utc).date().isoformat()
+
+    def _load(self):
+        if not self.quota_file or not os.path.exists(self.quota_file):
+            return
+        try:
+            with open(self.quota_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("date") == self._day:
+                self._used = int(data.get("used", 0))
+        except Exception:
+            logger.exception("API使用回数の読み込みエラー", quota_file=self.quota_file)
+
+    def flush(self):
+        """使用回数をファイルに保存"""
+        with self._cond:
+            if not self.quota_file or not self._dirty:
+                return
+            data = {"date": self._day, "used": self._used}
+            self._dirty = False
+            self._flushed_at = time.monotonic()
+        try:
+            tmp_path = f"{self.quota_file}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.quota_file)
+        except Exception:
+            logger.exception("API使用回数の保存エラー", quota_file=self.quota_file)
+
+    def _rollover(self):
+        # 日付が変わったら使用回数をリセット
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._used = 0
+            self._dirty = True
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def remaining(self):
+        """今日の残りリクエスト数"""
+        with self._cond:
+            self._rollover()
+            return max(0, self.daily_limit - self._used)
+
+    def acquire(self, priority="interactive", timeout=None):
+        """リクエストを1回送る許可を得る（必要ならバケットが貯まるまで待機）
+
+        Args:
+            priority: "scheduled" / "interactive" / "background"
+            timeout: 待機する最大秒数（Noneなら無制限）
+
+        Raises:
+            RateLimitExceeded: 1日の残り回数が優先度の予約分以下、または待機がタイムアウトした
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"優先度が不正です: {priority}")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # バックグラウンドはバケットの半分を高い優先度のために残す
+        floor = self.burst / 2 if priority == "background" else 0
+        waited = False
+
+        with self._cond:
+            while True:
+                self._rollover()
+                remaining = self.daily_limit - self._used
+                if remaining <= self.reserves.get(priority, 0):
+                    self._shed[priority] += 1
+                    raise RateLimitExceeded(
+                        f"本日のAPIリクエスト上限に近いため{priority}のリクエストを停止しています（残り{remaining}回）"
+                    )
+
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens - 1 >= floor:
+                    self._tokens -= 1
+                    self._used += 1
+                    self._dirty = True
+                    break
+
+                wait = (floor + 1 - self._tokens) / self.rate
+                if deadline is not None:
+                    if now >= deadline:
+                        self._shed[priority] += 1
+                        raise RateLimitExceeded(f"APIのレート制限により{priority}のリクエストがタイムアウトしました")
+                    wait = min(wait, deadline - now)
+                if not waited:
+                    self._waited[priority] += 1
+                    waited = True
+                self._cond.wait(wait)
+
+            flush = time.monotonic() - self._flushed_at >= QUOTA_FLUSH_INTERVAL
+
+        if flush:
+            self.flush()
+
+    def stats(self):
+        """使用状況（daily_limit, used, remaining, tokens, shed, waited）"""
+        with self._cond:
+            self._rollover()
+            self._refill(time.monotonic())
+            return {
+                "date": self._day,
+                "daily_limit": self.daily_limit,
+                "used": self._used,
+                "remaining": max(0, self.daily_limit - self._used),
+                "tokens": round(self._tokens, 2),
+                "shed": dict(self._shed),
+                "waited": dict(self._waited),
+            }
+
+# 共有のレート制限（同期・非同期のクライアントで共用）
+limiter = RateLimiter()
+atexit.register(limiter.flush)
+
+metrics.gauge("api_quota_remaining", "今日のAPIリクエストの残り回数", limiter.remaining)
+metrics.gauge("api_quota_used", "今日のAPIリクエストの使用回数", lambda: limiter.stats()["used"])
+metrics.gauge("api_requests_shed", "レート制限で送らなかったリクエスト数", lambda: {
+    (p,): n for p, n in limiter.stats()["shed"].items()}, ["priority"])
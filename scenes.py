@@ -0,0 +1,195 @@
+"""シーン（複数デバイスの操作をまとめて実行するマクロ）"""
+import re
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import get_env
+from utils import run_action
+from command_queue import NON_IDEMPOTENT_COMMANDS
+from device_resolver import normalize_name
+from scheduler import get_store
+
+# 1つのシーンで同時に実行する最大ステップ数
+SCENE_WORKERS = get_env("SCENE_WORKERS", 8, int)
+
+# APIが失敗の応答（statusCodeが100以外）を返したステップのリトライ回数と間隔（秒、回数ごとに倍）
+# 通信エラー・5xxはSwitchBotClientがリトライするため、ここではリトライしない
+SCENE_STEP_RETRIES = get_env("SCENE_STEP_RETRIES", 2, int)
+SCENE_RETRY_DELAY = get_env("SCENE_RETRY_DELAY", 0.5, float)
+
+# シーンを実行する指示の語尾（「おやすみモードにして」「おやすみモードを実行」など）
+RUN_SUFFIX_PATTERN = re.compile(r"(を)?(実行|開始|スタート)?(して|にして|に|する|お願い|ください|頼む)*[!！。.]*$")
+
+def make_step(device, action, params=None, stage=0):
+    """シーンのステップを作成
+
+    Args:
+        device: デバイス（{"id", "name", "type"}）
+        action: 実行する操作 (例: "turnOff", "lock", "setBrightness")
+        params: 追加パラメータ (brightness, color_temp, parameter)
+        stage: 実行順（小さい順に実行、同じ値のステップは並行実行）
+    """
+    return {
+        "device_id": device["id"],
+        "device_name": device["name"],
+        "action": action,
+        "params": params or {},
+        "stage": int(stage)
+    }
+
+def get_scenes():
+    """シーン一覧を取得（登録順）"""
+    return get_store().load_scenes()
+
+def get_scene(name):
+    """シーンを名前で取得（表記ゆれは正規化して比較）"""
+    key = normalize_name(name)
+    for scene in get_scenes():
+        if scene["name"] == name or normalize_name(scene["name"]) == key:
+            return scene
+    return None
+
+def save_scene(name, steps):
+    """シーンを保存（同じ名前のシーンは置き換え）
+
+    Args:
+        name: シーン名 (例: "おやすみモード")
+        steps: make_stepで作成したステップのリスト
+    """
+    if not steps:
+        raise ValueError("シーンには1つ以上のステップが必要です")
+
+    existing = get_scene(name)
+    scene = {"name": existing["name"] if existing else name, "steps": steps}
+    get_store().upsert_scene(scene)
+    return scene
+
+def delete_scene(name):
+    """シーンを削除"""
+    scene = get_scene(name)
+    if scene is None:
+        return None
+    get_store().delete_scene(scene["name"])
+    return scene
+
+def find_scene_in_text(text):
+    """入力がシーンの実行指示（「おやすみモードにして」など）であればシーンを返す"""
+    scenes = get_scenes()
+    if not scenes:
+        return None
+
+    key = normalize_name(RUN_SUFFIX_PATTERN.sub("", text.strip()))
+    for scene in scenes:
+        if key and key == normalize_name(scene["name"]):
+            return scene
+    return None
+
+def run_step(step, retries=SCENE_STEP_RETRIES, retry_delay=SCENE_RETRY_DELAY, priority="interactive"):
+    """1つのステップを実行（APIが失敗の応答を返した場合はリトライ）
+
+    例外（通信エラーなど）・クライアントが既にリトライした応答・繰り返すと結果が変わる操作
+    （press, toggleなど）はリトライしない（APIの使用回数を増やさない・二重に実行しない）。
+
+    Args:
+        step: make_stepで作成したステップ
+        retries: 失敗の応答時のリトライ回数
+        retry_delay: リトライ間隔の基準（秒）
+        priority: レート制限の優先度
+
+    Returns:
+        ステップの結果 {"ok", "attempts", "result", "error", "elapsed"}
+    """
+    started = time.monotonic()
+    result, error = None, None
+    if step["action"] in NON_IDEMPOTENT_COMMANDS:
+        retries = 0
+
+    for attempt in range(retries + 1):
+        try:
+            result = run_action(step["device_id"], step["action"], step.get("params"), priority)
+            error = None
+        except Exception as e:
+            # パラメータの誤り・APIの上限・クライアントのリトライ後の通信エラーはリトライしない
+            error = str(e)
+            break
+
+        if result.get("statusCode") == 100 or result.get("retries"):
+            break
+        if attempt < retries:
+            time.sleep(retry_delay * (2 ** attempt))
+
+    ok = error is None and result is not None and result.get("statusCode") == 100
+    return {
+        "ok": ok,
+        "attempts": attempt + 1,
+        "result": result,
+        "error": error,
+        "elapsed": time.monotonic() - started
+    }
+
+def run_scene(scene, max_workers=SCENE_WORKERS, priority="interactive"):
+    """シーンを実行
+
+    同じstageのステップは並行して実行し、stageの小さい順に進める
+    （例: 照明とカーテンを先に、施錠を最後に）。
+
+    Args:
+        scene: シーン名またはシーン
+        max_workers: 同時に実行する最大ステップ数
+        priority: レート制限の優先度（スケジュール実行は"scheduled"）
+
+    Returns:
+        {"scene", "ok", "steps": [ステップごとの結果], "elapsed"}
+    """
+    if isinstance(scene, str):
+        name = scene
+        scene = get_scene(name)
+        if scene is None:
+            raise ValueError(f"シーン'{name}'が見つかりません")
+
+    started = time.monotonic()
+    steps = scene["steps"]
+    results = [None] * len(steps)
+
+    stages = sorted({step.get("stage", 0) for step in steps})
+    with ThreadPoolExecutor(max_workers=max(1, min(len(steps), max_workers))) as executor:
+        for stage in stages:
+            indexes = [i for i, step in enumerate(steps) if step.get("stage", 0) == stage]
+            # ログのコンテキスト（request_idなど）を引き継いで実行
+            futures = {i: executor.submit(contextvars.copy_context().run, run_step, steps[i], priority=priority)
+                       for i in indexes}
+            for i, future in futures.items():
+                results[i] = dict(future.result(), step=steps[i])
+
+    return {
+        "scene": scene["name"],
+        "ok": all(r["ok"] for r in results),
+        "steps": results,
+        "elapsed": time.monotonic() - started
+    }
+
+def format_step(step):
+    """ステップの説明文"""
+    params_text = ""
+    if step.get("params"):
+        params_text = f" ({', '.join([f'{k}={v}' for k, v in step['params'].items()])})"
+    return f"{step['device_name']} - {step['action']}{params_text}"
+
+def format_scene_result(result):
+    """シーンの実行結果のメッセージ"""
+    failed = [r for r in result["steps"] if not r["ok"]]
+    if not failed:
+        return f"OK: シーン「{result['scene']}」を実行しました！（{len(result['steps'])}件、{result['elapsed']:.1f}秒）"
+
+    lines = [f"エラー: シーン「{result['scene']}」の{len(failed)}/{len(result['steps'])}件が失敗しました。"]
+    for r in failed:
+        lines.append(f"- {format_step(r['step'])}: {r['error'] or r['result']}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    # テスト用
+    print("=== シーン一覧 ===")
+    for scene in get_scenes():
+        print(f"{scene['name']}:")
+        for step in scene["steps"]:
+            print(f"  [{step.get('stage', 0)}] {format_step(step)}")
@@ -0,0 +1,253 @@
+"""スケジュール・シーンの保存先（SQLite / JSONファイル）"""
+import os
+import json
+import uuid
+import sqlite3
+import threading
+from log import get_logger
+
+logger = get_logger("schedule_store")
+
+class JsonScheduleStore:
+    """JSONファイルに保存するストア（変更のたびにファイル全体を書き直す）
+
+    書き込みは一時ファイルに書いてから置き換えるため、途中で落ちてもファイルは壊れない。
+    """
+
+    def __init__(self, path, scene_path="scenes.json"):
+        """
+        Args:
+            path: JSONファイルのパス
+            scene_path: シーンを保存するJSONファイルのパス
+        """
+        self.path = path
+        self.scene_path = scene_path
+        self._items = None
+        self._scenes = None
+        self._lock = threading.Lock()
+
+    def load_all(self):
+        """全てのスケジュールを登録順に取得"""
+        with self._lock:
+            if self._items is None:
+                self._items = {}
+                if os.path.exists(self.path):
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        for item in json.load(f):
+                            # IDのない古い形式にはIDを付与
+                            item.setdefault("id", uuid.uuid4().hex[:8])
+                            self._items[item["id"]] = item
+            return list(self._items.values())
+
+    @staticmethod
+    def _write_file(path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _write(self):
+        self._write_file(self.path, list(self._items.values()))
+
+    def upsert(self, item):
+        """スケジュールを追加・更新"""
+        self.load_all()
+        with self._lock:
+            self._items[item["id"]] = item
+            self._write()
+
+    def upsert_many(self, items):
+        """複数のスケジュールをまとめて追加・更新"""
+        self.load_all()
+        with self._lock:
+            for item in items:
+                self._items[item["id"]] = item
+            self._write()
+
+    def delete(self, schedule_id):
+        """スケジュールを削除"""
+        self.load_all()
+        with self._lock:
+            self._items.pop(schedule_id, None)
+            self._write()
+
+    def clear(self):
+        """全てのスケジュールを削除"""
+        with self._lock:
+            self._items = {}
+            self._write()
+
+    def find(self, device_id=None, time_str=None):
+        """デバイスID・時刻でスケジュールを検索"""
+        return [item for item in self.load_all()
+                if (device_id is None or item["device_id"] == device_id)
+                and (time_str is None or item["time"] == time_str)]
+
+    def load_scenes(self):
+        """全てのシーンを登録順に取得"""
+        with self._lock:
+            if self._scenes is None:
+                self._scenes = {}
+                if os.path.exists(self.scene_path):
+                    with open(self.scene_path, 'r', encoding='utf-8') as f:
+                        for scene in json.load(f):
+                            self._scenes[scene["name"]] = scene
+            return list(self._scenes.values())
+
+    def upsert_scene(self, scene):
+        """シーンを追加・更新"""
+        self.load_scenes()
+        with self._lock:
+            self._scenes[scene["name"]] = scene
+            self._write_file(self.scene_path, list(self._scenes.values()))
+
+    def delete_scene(self, name):
+        """シーンを削除"""
+        self.load_scenes()
+        with self._lock:
+            self._scenes.pop(name, None)
+            self._write_file(self.scene_path, list(self._scenes.values()))
+
+class SQLiteScheduleStore:
+    """SQLite（WALモード）に保存するストア
+
+    変更は1件ずつトランザクションで書き込むため、件数が増えても保存コストは変わらない。
+    デバイスIDと時刻にはインデックスを張る。
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: SQLiteファイルのパス
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS schedules ("
+                "id TEXT PRIMARY KEY, position INTEGER, device_id TEXT, time TEXT, "
+                "enabled INTEGER, data TEXT)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_schedules_device ON schedules (device_id)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_schedules_time ON schedules (time)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS scenes ("
+                "name TEXT PRIMARY KEY, position INTEGER, data TEXT)"
+            )
+
+    def load_all(self):
+        """全てのスケジュールを登録順に取得"""
+        with self._lock:
+            rows = self._db.execute("SELECT data FROM schedules ORDER BY position").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _upsert(self, item):
+        # 既存の行は登録順（position）を維持する
+        self._db.execute(
+            "INSERT INTO schedules (id, position, device_id, time, enabled, data) "
+            "VALUES (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM schedules), ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET device_id = excluded.device_id, time = excluded.time, "
+            "enabled = excluded.enabled, data = excluded.data",
+            (item["id"], item["device_id"], item["time"], int(item.get("enabled", True)),
+             json.dumps(item, ensure_ascii=False))
+        )
+
+    def upsert(self, item):
+        """スケジュールを追加・更新"""
+        with self._lock, self._db:
+            self._upsert(item)
+
+    def upsert_many(self, items):
+        """複数のスケジュールを1つのトランザクションで追加・更新"""
+        with self._lock, self._db:
+            for item in items:
+                self._upsert(item)
+
+    def delete(self, schedule_id):
+        """スケジュールを削除"""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+
+    def clear(self):
+        """全てのスケジュールを削除"""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM schedules")
+
+    def find(self, device_id=None, time_str=None):
+        """デバイスID・時刻でスケジュールを検索（インデックスを使用）"""
+        conditions, params = [], []
+        if device_id is not None:
+            conditions.append("device_id = ?")
+            params.append(device_id)
+        if time_str is not None:
+            conditions.append("time = ?")
+            params.append(time_str)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._lock:
+            rows = self._db.execute(f"SELECT data FROM schedules {where} ORDER BY position", params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def load_scenes(self):
+        """全てのシーンを登録順に取得"""
+        with self._lock:
+            rows = self._db.execute("SELECT data FROM scenes ORDER BY position").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def upsert_scene(self, scene):
+        """シーンを追加・更新"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO scenes (name, position, data) "
+                "VALUES (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM scenes), ?) "
+                "ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+                (scene["name"], json.dumps(scene, ensure_ascii=False))
+            )
+
+    def delete_scene(self, name):
+        """シーンを削除"""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM scenes WHERE name = ?", (name,))
+
+    def is_empty(self):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM schedules LIMIT 1").fetchone() is None
+
+def migrate_json_to_sqlite(json_path, store):
+    """既存のJSONファイルのスケジュールをSQLiteに移行（1回だけ）
+
+    移行後のJSONファイルは「.migrated」を付けた名前に変更する。
+
+    Returns:
+        移行した件数
+    """
+    if not os.path.exists(json_path) or not store.is_empty():
+        return 0
+
+    items = JsonScheduleStore(json_path).load_all()
+    store.upsert_many(items)
+    os.replace(json_path, f"{json_path}.migrated")
+    logger.info("スケジュールをSQLiteに移行しました", schedules=len(items), source=json_path,
+                backup=f"{json_path}.migrated")
+    return len(items)
+
+def create_store(backend, json_path, db_path, scene_path="scenes.json"):
+    """設定に応じたストアを作成
+
+    Args:
+        backend: "sqlite" または "json"
+        json_path: JSONファイルのパス（jsonの保存先、sqliteの移行元）
+        db_path: SQLiteファイルのパス
+        scene_path: シーンのJSONファイルのパス（jsonの場合のみ）
+    """
+    if backend == "json":
+        return JsonScheduleStore(json_path, scene_path)
+
+    store = SQLiteScheduleStore(db_path)
+    migrate_json_to_sqlite(json_path, store)
+    return store
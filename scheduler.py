@@ -1,141 +1,256 @@
 """Switchbotデバイスのスケジュール管理"""
-import os
-import time
-import schedule
-import json
-from datetime import datetime
-from dotenv import load_dotenv
-from utils import get_devices, control_device, set_ceiling_light_brightness, set_ceiling_light_color_temp
-
-# 環境変数を読み込む
-load_dotenv()
-
-# スケジュールを保存するファイル
+import uuid
+import threading
+from config import get_env
+from utils import run_action
+from scheduler_engine import SchedulerEngine, parse_trigger
+from schedule_store import create_store
+import device_registry
+from log import get_logger, bind
+
+logger = get_logger("scheduler")
+
+# スケジュールの保存先（"sqlite" または "json"）
+SCHEDULE_STORE = get_env("SCHEDULE_STORE", "sqlite")
+SCHEDULE_DB = get_env("SCHEDULE_DB", "schedules.db")
+# JSON保存時のファイル（SQLite利用時は初回のみ移行元として読み込む）
 SCHEDULE_FILE = "schedules.json"
+# JSON保存時のシーンのファイル
+SCENE_FILE = "scenes.json"
+
+# スケジュール一覧（ID → スケジュール、登録順）
+schedules = {}
+
+# スケジュール一覧の更新用ロック（スケジューラースレッドと共有）
+_lock = threading.RLock()
+
+# スケジューラーエンジン（スケジュールIDをジョブIDとして登録、同時刻のジョブは並行実行）
+engine = SchedulerEngine(max_workers=get_env("SCHEDULER_WORKERS", 8, int))
+
+# スケジュールの保存先（load_schedules時に作成）
+store = None
 
-# スケジュール一覧
-schedules = []
+def new_schedule_id():
+    """スケジュールIDを発行"""
+    return uuid.uuid4().hex[:8]
+
+def get_store():
+    """スケジュールの保存先を取得（初回のみ作成、既存のJSONはSQLiteに移行）"""
+    global store
+    with _lock:
+        if store is None:
+            store = create_store(SCHEDULE_STORE, SCHEDULE_FILE, SCHEDULE_DB, SCENE_FILE)
+        return store
 
 def load_schedules():
-    """スケジュールをファイルから読み込み"""
+    """スケジュールを保存先から読み込み"""
     global schedules
     try:
-        if os.path.exists(SCHEDULE_FILE):
-            with open(SCHEDULE_FILE, 'r', encoding='utf-8') as f:
-                schedules = json.load(f)
-            print(f"スケジュールを読み込みました: {len(schedules)}件")
-        else:
-            schedules = []
-    except Exception as e:
-        print(f"スケジュール読み込みエラー: {e}")
-        schedules = []
-
-def save_schedules():
-    """スケジュールをファイルに保存"""
-    try:
-        with open(SCHEDULE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(schedules, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"スケジュール保存エラー: {e}")
+        items = get_store().load_all()
+
+        # 有効/無効の項目がない古い形式を補完
+        missing = [item for item in items if "enabled" not in item]
+        for item in missing:
+            item["enabled"] = True
+        if missing:
+            get_store().upsert_many(missing)
 
-def add_schedule(time_str, device_id, device_name, action, **kwargs):
+        with _lock:
+            schedules = {item["id"]: item for item in items}
+        logger.info("スケジュールを読み込みました", count=len(schedules))
+    except Exception:
+        logger.exception("スケジュール読み込みエラー")
+        schedules = {}
+
+def add_schedule(time_str, device_id, device_name, action, weekdays=None, **kwargs):
     """スケジュールを追加
 
     Args:
-        time_str: 時刻 (例: "07:00", "19:30")
+        time_str: 時刻 (例: "07:00", "19:30", "cron:0 7 * * 1-5", "sunset+30")
         device_id: デバイスID
         device_name: デバイス名
-        action: 実行する操作 (例: "turnOn", "setBrightness")
-        **kwargs: 追加パラメータ (brightness, color_temp など)
+        action: 実行する操作 (例: "turnOn", "setBrightness"、シーンは"runScene")
+        weekdays: 曜日指定 (例: ["mon", "fri"]、Noneなら毎日)
+        **kwargs: 追加パラメータ (brightness, color_temp、runSceneの場合はscene)
     """
+    # 時刻指定を検証（不正な場合はValueError）
+    parse_trigger(time_str, weekdays)
+
     schedule_item = {
+        "id": new_schedule_id(),
         "time": time_str,
         "device_id": device_id,
         "device_name": device_name,
         "action": action,
-        "params": kwargs
+        "params": kwargs,
+        "enabled": True
     }
+    if weekdays:
+        schedule_item["weekdays"] = weekdays
 
-    schedules.append(schedule_item)
-    save_schedules()
+    with _lock:
+        get_store().upsert(schedule_item)
+        schedules[schedule_item["id"]] = schedule_item
 
-    # scheduleライブラリに登録
-    register_schedule(schedule_item)
+        # スケジューラーエンジンに登録
+        register_schedule(schedule_item)
 
     return schedule_item
 
 def register_schedule(schedule_item):
-    """スケジュールをscheduleライブラリに登録"""
+    """スケジュールをスケジューラーエンジンに登録（同じIDのジョブは置き換え）"""
+    schedule_id = schedule_item["id"]
     time_str = schedule_item["time"]
+    device_name = schedule_item["device_name"]
+    action = schedule_item["action"]
+
+    if not schedule_item.get("enabled", True):
+        engine.remove(schedule_id)
+        logger.info("スケジュール無効", schedule_id=schedule_id, time=time_str, device_name=device_name, action=action)
+        return
+
+    job = make_job(schedule_item)
+    trigger = parse_trigger(time_str, schedule_item.get("weekdays"))
+    next_run = engine.add(schedule_id, trigger, job)
+    next_text = next_run.strftime('%m/%d %H:%M:%S') if next_run else "なし"
+    logger.info("スケジュール登録", schedule_id=schedule_id, time=time_str, device_name=device_name, action=action,
+                next_run=next_text)
+
+def make_job(schedule_item):
+    """スケジュールを実行する関数を作成（成功でTrue、失敗でFalseを返す）"""
+    schedule_id = schedule_item["id"]
     device_id = schedule_item["device_id"]
     device_name = schedule_item["device_name"]
     action = schedule_item["action"]
     params = schedule_item.get("params", {})
 
     def job():
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] スケジュール実行: {device_name} - {action}")
-
-        if action == "setBrightness":
-            brightness = params.get("brightness", 100)
-            result = set_ceiling_light_brightness(device_id, brightness)
-        elif action == "setColorTemperature":
-            color_temp = params.get("color_temp", "neutral")
-            result = set_ceiling_light_color_temp(device_id, color_temp)
-        else:
-            parameter = params.get("parameter", "default")
-            result = control_device(device_id, action, parameter)
+        with bind(schedule_id=schedule_id, device_id=device_id):
+            return run()
+
+    def run():
+        logger.info("スケジュール実行", device_name=device_name, action=action)
+
+        if action == "runScene":
+            # シーンは全ステップを並行実行（scenesはschedulerを参照するため実行時に読み込む）
+            import scenes
+            result = scenes.run_scene(params["scene"], priority="scheduled")
+            logger.info("シーン実行", scene=result["scene"], ok=result["ok"], result=scenes.format_scene_result(result))
+            return result["ok"]
+
+        # スケジュール実行はAPIの上限に近づいても最後まで送る
+        result = run_action(device_id, action, params, priority="scheduled")
 
         if result.get("statusCode") == 100:
-            print(f"  → 成功: {device_name}を{action}しました")
-        else:
-            print(f"  → 失敗: {result}")
+            logger.info("スケジュール成功", device_name=device_name, action=action)
+            return True
 
-    schedule.every().day.at(time_str).do(job)
-    print(f"スケジュール登録: {time_str} - {device_name} - {action}")
+        logger.warning("スケジュール失敗", device_name=device_name, action=action, result=result)
+        return False
+
+    return job
 
 def get_schedules():
-    """スケジュール一覧を取得"""
-    return schedules
+    """スケジュール一覧を取得（登録順）"""
+    with _lock:
+        return list(schedules.values())
 
-def remove_schedule(index):
-    """スケジュールを削除
+def get_schedule(schedule_id):
+    """スケジュールを取得
 
     Args:
-        index: 削除するスケジュールのインデックス
+        schedule_id: スケジュールID、または一覧の番号（0始まりのint）
     """
-    if 0 <= index < len(schedules):
-        removed = schedules.pop(index)
-        save_schedules()
+    with _lock:
+        if isinstance(schedule_id, int):
+            items = list(schedules.values())
+            return items[schedule_id] if 0 <= schedule_id < len(items) else None
+        return schedules.get(schedule_id)
 
-        # scheduleライブラリからも削除（全てクリアして再登録）
-        schedule.clear()
-        for item in schedules:
-            register_schedule(item)
+def find_schedules(device_id=None, time_str=None):
+    """デバイスID・時刻でスケジュールを検索
 
-        return removed
-    return None
+    Args:
+        device_id: デバイスID（Noneなら条件にしない）
+        time_str: 時刻指定（Noneなら条件にしない）
+    """
+    return get_store().find(device_id=device_id, time_str=time_str)
+
+def remove_schedule(schedule_id):
+    """スケジュールを削除（対象のジョブだけをエンジンから外す）
+
+    Args:
+        schedule_id: スケジュールID、または一覧の番号（0始まりのint）
+    """
+    with _lock:
+        item = get_schedule(schedule_id)
+        if item is None:
+            return None
+
+        get_store().delete(item["id"])
+        removed = schedules.pop(item["id"])
+        engine.remove(item["id"])
+
+    return removed
+
+def update_schedule(schedule_id, **changes):
+    """スケジュールを更新（対象のジョブだけを再登録）
+
+    Args:
+        schedule_id: スケジュールID、または一覧の番号（0始まりのint）
+        **changes: 更新する項目 (time, action, params, weekdays, enabled など)
+    """
+    with _lock:
+        item = get_schedule(schedule_id)
+        if item is None:
+            return None
+
+        updated = dict(item, **changes)
+        updated["id"] = item["id"]
+
+        # 時刻指定を検証（不正な場合はValueError、元のスケジュールは変更しない）
+        parse_trigger(updated["time"], updated.get("weekdays"))
+
+        get_store().upsert(updated)
+        schedules[item["id"]] = updated
+        register_schedule(updated)
+
+    return updated
+
+def set_schedule_enabled(schedule_id, enabled):
+    """スケジュールの有効/無効を切り替え
+
+    Args:
+        schedule_id: スケジュールID、または一覧の番号（0始まりのint）
+        enabled: Trueで有効、Falseで無効
+    """
+    return update_schedule(schedule_id, enabled=enabled)
 
 def clear_all_schedules():
     """全てのスケジュールを削除"""
     global schedules
-    schedules = []
-    save_schedules()
-    schedule.clear()
+    with _lock:
+        get_store().clear()
+        schedules = {}
+        engine.clear()
 
 def run_scheduler():
     """スケジューラーを実行（無限ループ）"""
     load_schedules()
 
+    # デバイス一覧のキャッシュを準備
+    device_registry.warm_up()
+
     # 既存のスケジュールを登録
-    for item in schedules:
+    for item in get_schedules():
         register_schedule(item)
 
+    engine.start()
     print("スケジューラーを起動しました")
     print(f"登録済みスケジュール: {len(schedules)}件")
 
-    while True:
-        schedule.run_pending()
-        time.sleep(10)  # 10秒ごとにチェック
+    # 次の実行時刻まで待機して実行（ポーリングしない）
+    engine.join()
 
 if __name__ == "__main__":
     # テスト用
@@ -0,0 +1,403 @@
+"""ヒープ方式のスケジューラーエンジン（次の実行時刻まで待機し、ポーリングしない）"""
+import re
+import math
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from config import get_env
+import metrics
+from log import get_logger
+
+logger = get_logger("scheduler_engine")
+
+# 日の出・日の入りの計算に使う位置（デフォルト: 東京）
+LATITUDE = get_env("LATITUDE", 35.6895, float)
+LONGITUDE = get_env("LONGITUDE", 139.6917, float)
+
+# 曜日の表記 → datetime.weekday()の値（月曜=0）
+WEEKDAY_NAMES = {
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+    "月": 0, "火": 1, "水": 2, "木": 3, "金": 4, "土": 5, "日": 6,
+}
+
+# スケジュールの実行遅延（予定時刻から実行開始まで）と実行結果
+FIRE_LAG_SECONDS = metrics.histogram("schedule_fire_lag_seconds", "スケジュールの実行遅延（秒）")
+JOB_RESULTS = metrics.counter("schedule_jobs_total", "スケジュールの実行結果ごとの件数", ["result"])
+
+def parse_weekdays(weekdays):
+    """曜日指定を数値の集合に変換（Noneなら毎日）
+
+    Args:
+        weekdays: ["mon", "fri"]、["月", "金"]、[0, 4] など
+    """
+    if not weekdays:
+        return None
+    result = set()
+    for day in weekdays:
+        if isinstance(day, int):
+            result.add(day % 7)
+        else:
+            key = str(day).strip().lower()[:3]
+            if key not in WEEKDAY_NAMES:
+                key = str(day).strip()[:1]
+            if key not in WEEKDAY_NAMES:
+                raise ValueError(f"曜日の指定が不正です: {day}")
+            result.add(WEEKDAY_NAMES[key])
+    return result
+
+class DailyTrigger:
+    """毎日（または指定曜日）の決まった時刻"""
+
+    def __init__(self, time_str, weekdays=None):
+        """
+        Args:
+            time_str: 時刻 (例: "07:00", "19:30:15")
+            weekdays: 曜日指定（Noneなら毎日）
+        """
+        parts = [int(p) for p in time_str.split(":")]
+        if len(parts) not in (2, 3) or not (0 <= parts[0] < 24 and 0 <= parts[1] < 60):
+            raise ValueError(f"時刻の形式が不正です: {time_str}")
+        self.hour, self.minute = parts[0], parts[1]
+        self.second = parts[2] if len(parts) == 3 else 0
+        self.weekdays = parse_weekdays(weekdays)
+
+    def next_fire(self, after):
+        """afterより後の次の実行時刻"""
+        candidate = after.replace(hour=self.hour, minute=self.minute, second=self.second, microsecond=0)
+        if candidate <= after:
+            candidate += timedelta(days=1)
+        while self.weekdays is not None and candidate.weekday() not in self.weekdays:
+            candidate += timedelta(days=1)
+        return candidate
+
+class CronTrigger:
+    """cron形式（分 時 日 月 曜日）。曜日は0または7が日曜"""
+
+    def __init__(self, expression):
+        """
+        Args:
+            expression: cron式 (例: "0 7 * * 1-5", "*/15 * * * *")
+        """
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron式は5つのフィールドが必要です: {expression}")
+        self.minutes = self._parse(fields[0], 0, 59)
+        self.hours = self._parse(fields[1], 0, 23)
+        self.days = self._parse(fields[2], 1, 31)
+        self.months = self._parse(fields[3], 1, 12)
+        # cronの曜日（日曜=0）をdatetime.weekday()（月曜=0）に変換
+        self.weekdays = {(d - 1) % 7 for d in self._parse(fields[4], 0, 7)}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(","):
+            match = re.fullmatch(r"(\*|\d+(?:-\d+)?)(?:/(\d+))?", part)
+            if not match:
+                raise ValueError(f"cronフィールドが不正です: {field}")
+            base, step = match.group(1), int(match.group(2) or 1)
+            if base == "*":
+                start, end = low, high
+            elif "-" in base:
+                start, end = (int(v) for v in base.split("-"))
+            else:
+                start = end = int(base)
+            if not (low <= start <= high and low <= end <= high):
+                raise ValueError(f"cronフィールドの範囲外です: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        # cronの仕様: 日と曜日の両方が指定された場合はどちらかに一致すれば良い
+        day_ok = day.day in self.days
+        weekday_ok = day.weekday() in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_fire(self, after):
+        """afterより後の次の実行時刻"""
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        return None
+
+def sun_time(date, event, latitude=LATITUDE, longitude=LONGITUDE):
+    """日の出・日の入りの時刻（ローカル時刻）を計算（NOAAの簡易式）
+
+    Args:
+        date: 日付
+        event: "sunrise" または "sunset"
+
+    Returns:
+        ローカル時刻のdatetime（白夜・極夜の場合はNone）
+    """
+    day_of_year = date.timetuple().tm_yday
+    gamma = 2 * math.pi / 365 * (day_of_year - 1)
+
+    # 均時差（分）と太陽の赤緯（ラジアン）
+    eqtime = 229.18 * (0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+                       - 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma))
+    decl = (0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma)
+            - 0.006758 * math.cos(2 * gamma) + 0.000907 * math.sin(2 * gamma)
+            - 0.002697 * math.cos(3 * gamma) + 0.00148 * math.sin(3 * gamma))
+
+    lat = math.radians(latitude)
+    cos_ha = (math.cos(math.radians(90.833)) / (math.cos(lat) * math.cos(decl))
+              - math.tan(lat) * math.tan(decl))
+    if not -1 <= cos_ha <= 1:
+        return None
+
+    ha = math.degrees(math.acos(cos_ha))
+    if event == "sunset":
+        ha = -ha
+    utc_minutes = 720 - 4 * (longitude + ha) - eqtime
+
+    utc = datetime(date.year, date.month, date.day, tzinfo=timezone.utc) + timedelta(minutes=utc_minutes)
+    return utc.astimezone().replace(tzinfo=None)
+
+class SunTrigger:
+    """日の出・日の入りからのオフセット"""
+
+    def __init__(self, event, offset_minutes=0, weekdays=None):
+        """
+        Args:
+            event: "sunrise" または "sunset"
+            offset_minutes: オフセット（分、負の値で前）
+            weekdays: 曜日指定（Noneなら毎日）
+        """
+        if event not in ("sunrise", "sunset"):
+            raise ValueError(f"eventはsunriseまたはsunsetを指定してください: {event}")
+        self.event = event
+        self.offset = timedelta(minutes=offset_minutes)
+        self.weekdays = parse_weekdays(weekdays)
+
+    def next_fire(self, after):
+        """afterより後の次の実行時刻"""
+        day = after.date() - timedelta(days=1)
+        for _ in range(370):
+            if self.weekdays is None or day.weekday() in self.weekdays:
+                base = sun_time(day, self.event)
+                if base is not None:
+                    candidate = (base + self.offset).replace(microsecond=0)
+                    if candidate > after:
+                        return candidate
+            day += timedelta(days=1)
+        return None
+
+def parse_trigger(spec, weekdays=None):
+    """スケジュールの時刻指定からトリガーを作成
+
+    Args:
+        spec: "07:00"（毎日）、"cron:0 7 * * 1-5"（cron式）、
+              "sunrise+30" / "sunset-15"（日の出・日の入りからの分）
+        weekdays: 曜日指定（cron以外で有効）
+    """
+    spec = spec.strip()
+    if spec.startswith("cron:"):
+        return CronTrigger(spec[len("cron:"):])
+
+    match = re.fullmatch(r"(sunrise|sunset)\s*(?:([+-])\s*(\d+))?", spec.lower())
+    if match:
+        offset = int(match.group(3) or 0) * (-1 if match.group(2) == "-" else 1)
+        return SunTrigger(match.group(1), offset, weekdays)
+
+    return DailyTrigger(spec, weekdays)
+
+class SchedulerEngine:
+    """次の実行時刻をキーにしたヒープでジョブを管理するスケジューラー
+
+    次のジョブの時刻まで条件変数で待機するため、ジョブがない間は起床しない。
+    追加・削除はO(log n)（削除は印を付けて、ヒープの先頭に来た時に捨てる）。
+    同じ時刻に実行されるジョブはまとめて取り出し、スレッドプールで並行実行する。
+    """
+
+    def __init__(self, max_workers=8):
+        """
+        Args:
+            max_workers: ジョブを同時に実行する最大数
+        """
+        self._heap = []                    # (実行時刻のtimestamp, 連番, job_id)
+        self._jobs = {}                    # job_id → {"trigger", "func", "next_run", "seq"}
+        self._stats = {}                   # job_id → 実行結果の統計
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scheduler-job")
+        self._thread = None
+        self._running = False
+
+    def add(self, job_id, trigger, func, now=None):
+        """ジョブを追加（同じjob_idがあれば置き換え）
+
+        Args:
+            job_id: ジョブID
+            trigger: next_fire(after)を持つトリガー
+            func: 実行する関数（Falseを返すと失敗として記録）
+        """
+        with self._cond:
+            next_run = trigger.next_fire(now or datetime.now())
+            seq = next(self._counter)
+            self._jobs[job_id] = {"trigger": trigger, "func": func, "next_run": next_run, "seq": seq}
+            if next_run is not None:
+                heapq.heappush(self._heap, (next_run.timestamp(), seq, job_id))
+            self._cond.notify()
+        return next_run
+
+    def remove(self, job_id):
+        """ジョブを削除"""
+        with self._cond:
+            removed = self._jobs.pop(job_id, None) is not None
+            self._stats.pop(job_id, None)
+            self._compact()
+            self._cond.notify()
+        return removed
+
+    def clear(self):
+        """全てのジョブを削除"""
+        with self._cond:
+            self._jobs.clear()
+            self._heap.clear()
+            self._stats.clear()
+            self._cond.notify()
+
+    def next_run(self, job_id):
+        """ジョブの次の実行時刻"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return job["next_run"] if job else None
+
+    def _compact(self):
+        """削除済みのエントリが多くなったらヒープを作り直す"""
+        if len(self._heap) > 2 * len(self._jobs) + 16:
+            self._heap = [entry for entry in self._heap if self._is_current(entry)]
+            heapq.heapify(self._heap)
+
+    def _is_current(self, entry):
+        job = self._jobs.get(entry[2])
+        return job is not None and job["seq"] == entry[1]
+
+    def _pop_due(self):
+        """実行時刻になったジョブをまとめて取り出す（なければ次の時刻まで待機）"""
+        with self._cond:
+            while self._running:
+                # 削除・置き換え済みのエントリを捨てる
+                while self._heap and not self._is_current(self._heap[0]):
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                now = datetime.now()
+                now_ts = now.timestamp()
+                delay = self._heap[0][0] - now_ts
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+
+                due = []
+                while self._heap and self._heap[0][0] <= now_ts:
+                    entry = heapq.heappop(self._heap)
+                    if not self._is_current(entry):
+                        continue
+                    job_id = entry[2]
+                    job = self._jobs[job_id]
+
+                    # 次回の実行時刻を登録（スリープなどで過ぎた回は現在時刻以降の1回にまとめる）
+                    fire_time = job["next_run"]
+                    next_run = job["trigger"].next_fire(max(fire_time, now))
+                    job["next_run"] = next_run
+                    job["seq"] = next(self._counter)
+                    if next_run is not None:
+                        heapq.heappush(self._heap, (next_run.timestamp(), job["seq"], job_id))
+
+                    due.append((job_id, job["func"], fire_time))
+
+                return due
+        return None
+
+    def _execute(self, job_id, func, fire_time):
+        """ジョブを実行して遅延・所要時間・成否を記録"""
+        started = datetime.now()
+        error = None
+        try:
+            ok = func() is not False
+        except Exception as e:
+            ok = False
+            error = str(e)
+            logger.exception("スケジュール実行エラー", job_id=job_id)
+        finished = datetime.now()
+        FIRE_LAG_SECONDS.observe(max(0.0, (started - fire_time).total_seconds()))
+        JOB_RESULTS.inc(result="ok" if ok else "failed")
+        metrics.STAGE_SECONDS.observe((finished - started).total_seconds(), stage="schedule_job")
+
+        with self._cond:
+            stats = self._stats.setdefault(job_id, {"runs": 0, "failures": 0})
+            stats["runs"] += 1
+            stats["failures"] += 0 if ok else 1
+            stats.update({
+                "last_run": started,
+                "last_ok": ok,
+                "last_error": error,
+                "last_lag": (started - fire_time).total_seconds(),
+                "last_latency": (finished - started).total_seconds()
+            })
+
+    def _run(self):
+        while True:
+            due = self._pop_due()
+            if due is None:
+                return
+            # 同じ時刻のジョブを並行実行（遅いジョブが後続のジョブを止めない）
+            for job_id, func, fire_time in due:
+                self._executor.submit(self._execute, job_id, func, fire_time)
+
+    def job_stats(self, job_id):
+        """ジョブの実行結果の統計（runs, failures, last_lag, last_latency など）"""
+        with self._cond:
+            return dict(self._stats.get(job_id, {}))
+
+    def stats(self):
+        """全ジョブの実行結果の統計"""
+        with self._cond:
+            return {job_id: dict(stats) for job_id, stats in self._stats.items()}
+
+    def start(self):
+        """バックグラウンドスレッドで実行を開始"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="scheduler-engine", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """実行を停止（実行中のジョブの完了を待つ）"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def join(self):
+        """エンジンのスレッドが終了するまで待機"""
+        if self._thread:
+            self._thread.join()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._jobs)
@@ -1,41 +1,90 @@
-"""Slackポーリング方式ボット - Switchbot操作"""
-import os
+"""Slackボット - Switchbot操作（Socket Mode / Events API / ポーリング）"""
 import time
+import logging
 import threading
-from datetime import datetime
-from dotenv import load_dotenv
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
+from config import settings, get_env
+import agent
 from agent import process_user_request
-import schedule
-from scheduler import load_schedules, register_schedule, get_schedules
+import device_registry
+from thread_store import ThreadStore
+from worker_pool import KeyedWorkerPool
+from rate_limiter import limiter
+from webhook import start_webhook_server
+import metrics
+from metrics import span, start_metrics_server
+from log import get_logger, bind, new_request_id
+from scheduler import load_schedules, register_schedule, get_schedules, engine as scheduler_engine
+
+logger = get_logger("slack_bot")
+
+# Slackクライアント（最初にSlack APIを呼ぶときに作成）
+slack_client = None
+_slack_client_lock = threading.Lock()
+
+def get_slack_client():
+    """Slackクライアントを取得（SLACK_API_URLでローカルのフェイクサーバーに差し替え可能）
+
+    Raises:
+        ValueError: SLACK_BOT_TOKENが設定されていない
+    """
+    global slack_client
+    if slack_client is None:
+        with _slack_client_lock:
+            if slack_client is None:
+                # slack_sdkの読み込みは重いため、クライアントを作るときに読み込む
+                from slack_sdk import WebClient
+
+                slack_client = WebClient(
+                    token=settings.require("slack_bot_token"),
+                    base_url=settings.slack_api_url or WebClient.BASE_URL
+                )
+    return slack_client
+
+def _slack_api_error():
+    """SlackApiErrorのクラス（except節で使う、slack_sdkは例外が起きたときに読み込む）"""
+    from slack_sdk.errors import SlackApiError
+    return SlackApiError
 
-# 環境変数を読み込む
-load_dotenv()
+CHANNEL_ID = settings.slack_channel_id
 
-# Slackクライアントを初期化
-slack_client = WebClient(token=os.getenv("SLACK_BOT_TOKEN"))
-CHANNEL_ID = os.getenv("SLACK_CHANNEL_ID")
+# 受信方式: "socket"（Socket Mode）/ "events"（HTTP Events API）/ "polling"（ポーリング）
+# 未指定の場合、SLACK_APP_TOKENがあればSocket Mode、なければポーリング
+SLACK_MODE = get_env("SLACK_MODE") or ("socket" if settings.slack_app_token else "polling")
+
+# ポーリング間隔（秒）
+SLACK_POLL_INTERVAL = get_env("SLACK_POLL_INTERVAL", 3.0, float)
 
 # 最後に処理したメッセージのタイムスタンプ
 last_processed_ts = None
 bot_user_id = None
 
-# スレッドごとの会話履歴を保存
-# { "thread_ts": [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}] }
-thread_conversations = {}
-
-# スレッドごとの最後に処理したタイムスタンプ
-# { "thread_ts": "ts" }
-thread_last_ts = {}
+# スレッドごとの会話履歴・最後に処理したタイムスタンプ（上限・有効期限付き）
+# SLACK_THREAD_DBを指定するとSQLiteに保存し、再起動後も続きから処理する
+thread_store = ThreadStore(
+    max_threads=get_env("SLACK_MAX_THREADS", 200, int),
+    ttl=get_env("SLACK_THREAD_TTL", 86400, int),
+    max_messages=get_env("SLACK_THREAD_MAX_MESSAGES", 20, int),
+    db_path=get_env("SLACK_THREAD_DB") or None
+)
+
+# メッセージを並行処理するワーカープール（同じスレッド内は順番に処理）
+message_pool = KeyedWorkerPool(
+    workers=get_env("SLACK_WORKERS", 4, int),
+    max_queue=get_env("SLACK_QUEUE_SIZE", 100, int),
+    name="slack-worker"
+)
+
+metrics.gauge("slack_threads", "会話履歴を保持しているスレッド数", lambda: len(thread_store))
+metrics.gauge("slack_queue_depth", "処理待ちのメッセージ数", lambda: message_pool.stats()["queue_depth"])
+metrics.gauge("slack_in_flight", "処理中のメッセージ数", lambda: message_pool.stats()["in_flight"])
 
 def get_bot_user_id():
     """ボット自身のユーザーIDを取得"""
     try:
-        response = slack_client.auth_test()
+        response = get_slack_client().auth_test()
         return response["user_id"]
-    except SlackApiError as e:
-        print(f"エラー: ボットユーザーIDの取得に失敗 - {e}")
+    except _slack_api_error() as e:
+        logger.error("ボットユーザーIDの取得に失敗", error=str(e))
         return None
 
 def get_new_messages():
@@ -52,13 +101,13 @@ def get_new_messages():
         # 前回のタイムスタンプがある場合、それ以降のみ取得
         if last_processed_ts:
             kwargs["oldest"] = last_processed_ts
-            print(f"[DEBUG] oldest={last_processed_ts}で検索")
 
-        response = slack_client.conversations_history(**kwargs)
+        with span("slack_fetch"):
+            response = get_slack_client().conversations_history(**kwargs)
         messages = response["messages"]
 
-        # デバッグ: メッセージ数をログ出力
-        print(f"[DEBUG] conversations_history: {len(messages)}件取得")
+        # 3秒ごとに出力されるため、メッセージがなければ間引く
+        logger.debug("conversations_history", oldest=last_processed_ts, count=len(messages), sample=not messages)
 
         # 既に処理済みのメッセージを除外
         new_messages = []
@@ -69,25 +118,26 @@ def get_new_messages():
             new_messages.append(msg)
 
         if new_messages:
-            print(f"[DEBUG] 新しいメッセージ: {len(new_messages)}件")
+            logger.debug("新しいメッセージ", count=len(new_messages))
             # メッセージは新しい順なので、最初のメッセージのtsを保存
             last_processed_ts = new_messages[0]["ts"]
 
         return new_messages
 
-    except SlackApiError as e:
-        print(f"エラー: メッセージ取得に失敗 - {e}")
+    except _slack_api_error() as e:
+        logger.error("メッセージ取得に失敗", error=str(e))
         return []
 
 def get_thread_replies(thread_ts):
     """スレッド内の新しい返信を取得"""
     try:
         # スレッドの返信を取得
-        response = slack_client.conversations_replies(
-            channel=CHANNEL_ID,
-            ts=thread_ts,
-            oldest=thread_last_ts.get(thread_ts, thread_ts)  # 前回のタイムスタンプ以降
-        )
+        with span("slack_fetch"):
+            response = get_slack_client().conversations_replies(
+                channel=CHANNEL_ID,
+                ts=thread_ts,
+                oldest=thread_store.get_last_ts(thread_ts) or thread_ts  # 前回のタイムスタンプ以降
+            )
 
         messages = response["messages"]
 
@@ -97,49 +147,56 @@ def get_thread_replies(thread_ts):
 
         # 最後に処理したタイムスタンプを更新
         if new_replies:
-            thread_last_ts[thread_ts] = new_replies[-1]["ts"]
+            thread_store.set_last_ts(thread_ts, new_replies[-1]["ts"])
 
         return new_replies
 
-    except SlackApiError as e:
-        print(f"エラー: スレッド返信取得に失敗 - {e}")
+    except _slack_api_error() as e:
+        logger.error("スレッド返信取得に失敗", thread_ts=thread_ts, error=str(e))
         return []
 
 def send_message(text, thread_ts=None):
     """Slackにメッセージを送信"""
     try:
-        slack_client.chat_postMessage(
-            channel=CHANNEL_ID,
-            text=text,
-            thread_ts=thread_ts  # スレッドで返信
-        )
-    except SlackApiError as e:
-        print(f"エラー: メッセージ送信に失敗 - {e}")
+        with span("slack_post"):
+            get_slack_client().chat_postMessage(
+                channel=CHANNEL_ID,
+                text=text,
+                thread_ts=thread_ts  # スレッドで返信
+            )
+    except _slack_api_error() as e:
+        logger.error("メッセージ送信に失敗", error=str(e))
 
 def process_message(message, is_thread_reply=False):
-    """メッセージを処理
+    """メッセージを処理（ログにrequest_id・thread_tsを付ける）
 
     Args:
         message: Slackメッセージ
         is_thread_reply: スレッド内の返信かどうか
     """
-    global bot_user_id, thread_conversations
+    ts = message.get("ts")
+    with bind(request_id=new_request_id(), thread_ts=message.get("thread_ts", ts), ts=ts):
+        handle_message(message, is_thread_reply)
+
+def handle_message(message, is_thread_reply=False):
+    """メッセージを処理して応答を送信"""
+    global bot_user_id
 
     # ボットのユーザーIDを取得（初回のみ）
     if bot_user_id is None:
         bot_user_id = get_bot_user_id()
 
-    # デバッグログ
-    print(f"[DEBUG] process_message: user={message.get('user')}, bot={bot_user_id}, subtype={message.get('subtype')}, text={message.get('text', '')[:30]}")
+    logger.debug("process_message", user=message.get("user"), bot=bot_user_id, subtype=message.get("subtype"),
+                 text=message.get("text", "")[:30])
 
     # ボット自身のメッセージは無視
     if message.get("user") == bot_user_id:
-        print(f"[DEBUG] ボット自身のメッセージをスキップ")
+        logger.debug("ボット自身のメッセージをスキップ")
         return
 
     # サブタイプがあるメッセージ（編集、削除など）は無視
     if "subtype" in message:
-        print(f"[DEBUG] サブタイプメッセージをスキップ: {message.get('subtype')}")
+        logger.debug("サブタイプメッセージをスキップ", subtype=message.get("subtype"))
         return
 
     text = message.get("text", "").strip()
@@ -147,51 +204,55 @@ def process_message(message, is_thread_reply=False):
     thread_ts = message.get("thread_ts", ts)  # スレッドのタイムスタンプ
 
     if not text:
-        print(f"[DEBUG] 空のメッセージをスキップ")
+        logger.debug("空のメッセージをスキップ")
         return
 
-    # スレッド内の返信かどうかを表示
-    thread_indicator = "[スレッド返信] " if is_thread_reply else ""
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] {thread_indicator}受信: {text}")
+    logger.info("受信", text=text, user=message.get("user"), thread_reply=is_thread_reply)
+    started = time.perf_counter()
 
     try:
         # 会話履歴を取得（スレッドの場合）
         conversation_history = None
         if is_thread_reply or thread_ts != ts:
             # スレッド内の返信の場合、会話履歴を使用
-            conversation_history = thread_conversations.get(thread_ts, [])
+            conversation_history = thread_store.get_history(thread_ts)
             if conversation_history:
-                print(f"  → 会話履歴を参照: {len(conversation_history)}件")
+                logger.debug("会話履歴を参照", messages=len(conversation_history))
         else:
             # 新しいメインメッセージの場合、会話履歴をクリア
-            thread_conversations[thread_ts] = []
+            thread_store.reset(thread_ts)
 
         # ユーザーのメッセージを履歴に追加
-        thread_conversations.setdefault(thread_ts, []).append({
-            "role": "user",
-            "content": text
-        })
+        thread_store.append(thread_ts, "user", text)
 
         # AIエージェントで処理
-        response = process_user_request(text, conversation_history)
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] 応答: {response}")
+        with span("process_request"):
+            response = process_user_request(text, conversation_history)
+        logger.info("応答", response=response, elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
 
         # ボットの応答を履歴に追加
-        thread_conversations[thread_ts].append({
-            "role": "assistant",
-            "content": response
-        })
+        thread_store.append(thread_ts, "assistant", response)
 
         # スレッドで返信
         send_message(response, thread_ts=thread_ts)
 
     except Exception as e:
         error_msg = f"エラーが発生しました: {str(e)}"
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] {error_msg}")
+        logger.exception("処理エラー")
         send_message(error_msg, thread_ts=thread_ts)
 
-def run_scheduler_thread():
-    """スケジューラーをバックグラウンドで実行"""
+def submit_message(message, is_thread_reply=False):
+    """メッセージをワーカープールに投入（キューが満杯の場合は空くまで待つ）
+
+    Args:
+        message: Slackメッセージ
+        is_thread_reply: スレッド内の返信かどうか
+    """
+    thread_ts = message.get("thread_ts", message.get("ts"))
+    message_pool.submit(thread_ts, process_message, message, is_thread_reply=is_thread_reply)
+
+def start_scheduler():
+    """スケジューラーをバックグラウンドで起動"""
     # スケジュールを読み込み
     load_schedules()
     schedules_list = get_schedules()
@@ -200,92 +261,163 @@ def run_scheduler_thread():
     for item in schedules_list:
         register_schedule(item)
 
-    print(f"スケジューラー起動: {len(schedules_list)}件のスケジュールを読み込みました")
+    logger.info("スケジューラー起動", schedules=len(schedules_list))
 
-    # スケジューラーを実行
-    while True:
-        schedule.run_pending()
-        time.sleep(10)  # 10秒ごとにチェック
+    # 次の実行時刻まで待機して実行（ポーリングしない）
+    scheduler_engine.start()
 
-def main():
-    """メインループ"""
-    global last_processed_ts, bot_user_id
-
-    print("=== Switchbot Slackボット（ポーリング方式） ===")
-    print(f"チャンネルID: {CHANNEL_ID}")
+def handle_message_event(event):
+    """Slackイベント（message）を処理
 
-    # ボットユーザーIDを取得
-    bot_user_id = get_bot_user_id()
-    if not bot_user_id:
-        print("エラー: ボットの初期化に失敗しました")
+    Args:
+        event: Events API / Socket Modeで受信したmessageイベント
+    """
+    # 対象チャンネル以外は無視
+    if CHANNEL_ID and event.get("channel") != CHANNEL_ID:
         return
 
-    print(f"ボットユーザーID: {bot_user_id}")
+    ts = event.get("ts")
+    thread_ts = event.get("thread_ts")
+    is_thread_reply = bool(thread_ts) and thread_ts != ts
+
+    submit_message(event, is_thread_reply=is_thread_reply)
+
+def create_bolt_app(**kwargs):
+    """slack-boltのAppを作成してmessageイベントを登録"""
+    from slack_bolt import App
+
+    app = App(client=get_slack_client(), **kwargs)
+
+    @app.event("message")
+    def on_message(event):
+        handle_message_event(event)
+
+    return app
+
+def run_socket_mode():
+    """Socket Modeでイベントを受信（SLACK_APP_TOKENが必要）"""
+    from slack_bolt.adapter.socket_mode import SocketModeHandler
 
-    # スケジューラーを別スレッドで起動
-    scheduler_thread = threading.Thread(target=run_scheduler_thread, daemon=True)
-    scheduler_thread.start()
+    app = create_bolt_app()
+    print("Socket Modeで受信を開始します...\n")
+    SocketModeHandler(app, settings.require("slack_app_token")).start()
 
-    print("監視を開始します...\n")
+def run_events_api():
+    """HTTP Events APIでイベントを受信（SLACK_SIGNING_SECRETが必要）"""
+    port = get_env("SLACK_EVENTS_PORT", 3000, int)
+
+    app = create_bolt_app(signing_secret=get_env("SLACK_SIGNING_SECRET"))
+    print(f"Events APIで受信を開始します（ポート{port}, /slack/events）...\n")
+    app.start(port=port)
+
+def poll_once():
+    """ポーリングを1回行い、新しいメッセージ・スレッドの返信をワーカープールに投入"""
+    # 1. メインチャンネルの新しいメッセージを取得
+    messages = get_new_messages()
+
+    # 状態の集計もログを出力する時だけ行う（メッセージがなければ間引く）
+    if logger.isEnabledFor(logging.DEBUG):
+        pool_stats = message_pool.stats()
+        logger.debug("ポーリング", messages=len(messages), threads=len(thread_store),
+                     queued=pool_stats["queue_depth"], in_flight=pool_stats["in_flight"],
+                     api_remaining=limiter.remaining(), sample=not messages)
+
+    # メッセージは新しい順なので、古い順に処理するため反転
+    for message in reversed(messages):
+        ts = message.get("ts")
+        thread_ts = message.get("thread_ts")
+
+        # メインメッセージの場合
+        if not thread_ts or thread_ts == ts:
+            logger.debug("メインメッセージを処理", ts=ts)
+            submit_message(message, is_thread_reply=False)
+
+            # このメッセージがスレッドの親になる可能性があるので、アクティブなスレッドに追加
+            thread_store.track(ts)
+
+    # 2. アクティブなスレッドの返信をチェック
+    for thread_ts in thread_store.active_threads():
+        replies = get_thread_replies(thread_ts)
+
+        if replies:
+            logger.debug("スレッドの返信", thread_ts=thread_ts, count=len(replies))
+
+        for reply in replies:
+            submit_message(reply, is_thread_reply=True)
+
+def run_polling():
+    """ポーリング方式でメッセージを取得（フォールバック用）"""
+    global last_processed_ts
+
+    print("ポーリングで監視を開始します...\n")
 
     # 初回起動時は最新メッセージのタイムスタンプを取得（過去メッセージは処理しない）
     try:
-        initial_response = slack_client.conversations_history(
+        initial_response = get_slack_client().conversations_history(
             channel=CHANNEL_ID,
             limit=1
         )
         if initial_response["messages"]:
             last_processed_ts = initial_response["messages"][0]["ts"]
-            print(f"初期化: 最新メッセージts={last_processed_ts}\n")
+            logger.info("初期化: 最新メッセージ", ts=last_processed_ts)
         else:
             last_processed_ts = None
-            print("初期化: チャンネルにメッセージがありません\n")
+            logger.info("初期化: チャンネルにメッセージがありません")
     except Exception as e:
-        print(f"初期化エラー: {e}\n")
+        logger.error("初期化エラー", error=str(e))
         last_processed_ts = None
 
-    polling_interval = 3  # ポーリング間隔（秒）
-
-    # アクティブなスレッドのリスト（スレッドTSのセット）
-    active_threads = set()
-
     try:
         while True:
-            # 1. メインチャンネルの新しいメッセージを取得
-            messages = get_new_messages()
+            poll_once()
+
+            # 次のポーリングまで待機
+            time.sleep(SLACK_POLL_INTERVAL)
 
-            print(f"[DEBUG] ポーリング: {len(messages)}件のメッセージ, アクティブスレッド: {len(active_threads)}件")
+    except KeyboardInterrupt:
+        print("\n\nボットを終了します。")
+    except Exception:
+        logger.exception("予期しないエラー")
+
+def main():
+    """メイン処理"""
+    global bot_user_id
 
-            # メッセージは新しい順なので、古い順に処理するため反転
-            for message in reversed(messages):
-                ts = message.get("ts")
-                thread_ts = message.get("thread_ts")
+    print(f"=== Switchbot Slackボット（{SLACK_MODE}） ===")
+    print(f"チャンネルID: {CHANNEL_ID}")
+
+    # ボットユーザーIDを取得
+    bot_user_id = get_bot_user_id()
+    if not bot_user_id:
+        print("エラー: ボットの初期化に失敗しました")
+        return
 
-                # メインメッセージの場合
-                if not thread_ts or thread_ts == ts:
-                    print(f"[DEBUG] メインメッセージを処理: ts={ts}")
-                    process_message(message, is_thread_reply=False)
+    print(f"ボットユーザーID: {bot_user_id}")
 
-                    # このメッセージがスレッドの親になる可能性があるので、アクティブなスレッドに追加
-                    active_threads.add(ts)
+    # OpenAIクライアント（openaiパッケージの読み込み）を受信開始と並行して準備する
+    agent.preload_openai_client()
 
-            # 2. アクティブなスレッドの返信をチェック
-            for thread_ts in list(active_threads):
-                replies = get_thread_replies(thread_ts)
+    # デバイス一覧のキャッシュを準備（ディスクにあれば即座に利用可能）
+    device_registry.warm_up()
 
-                if replies:
-                    print(f"[DEBUG] スレッド {thread_ts}: {len(replies)}件の返信")
+    # スケジューラーをバックグラウンドで起動
+    start_scheduler()
 
-                for reply in replies:
-                    process_message(reply, is_thread_reply=True)
+    # Webhookの受信サーバーを起動（WEBHOOK_PORT設定時のみ）
+    start_webhook_server()
 
-            # 次のポーリングまで待機
-            time.sleep(polling_interval)
+    # メトリクスの公開サーバーを起動（METRICS_PORT設定時のみ）
+    start_metrics_server()
 
+    try:
+        if SLACK_MODE == "socket":
+            run_socket_mode()
+        elif SLACK_MODE == "events":
+            run_events_api()
+        else:
+            run_polling()
     except KeyboardInterrupt:
         print("\n\nボットを終了します。")
-    except Exception as e:
-        print(f"\n予期しないエラー: {e}")
 
 if __name__ == "__main__":
     main()
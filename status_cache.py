@@ -0,0 +1,183 @@
+"""デバイスステータスのキャッシュ（タイプごとのTTL・同時取得のまとめ・操作結果の反映）"""
+import time
+import threading
+from concurrent.futures import Future
+from config import get_env
+
+# STATUS_TTLSにないデバイスタイプのステータスの有効期間（秒、STATUS_TTLSにあるタイプには影響しない）
+STATUS_CACHE_TTL = get_env("STATUS_CACHE_TTL", 60.0, float)
+
+# Webhookで状態の変化が届くデバイスの有効期間（秒、変化があれば通知されるため長くする）
+STATUS_PUSH_TTL = get_env("STATUS_PUSH_TTL", 3600.0, float)
+
+# デバイスタイプごとの有効期間（秒、手動で操作されやすいものは短く）
+STATUS_TTLS = {
+    "Smart Lock Ultra": 30,
+    "Curtain3": 60,
+    "Plug Mini (JP)": 120,
+    "Ceiling Light": 120,
+}
+
+# 電源のON/OFFを持つデバイス（キャッシュと同じ状態へのturnOn/turnOffを省略できる）
+POWER_DEVICE_TYPES = {"Ceiling Light", "Plug Mini (JP)"}
+
+def command_effects(command, parameter="default"):
+    """コマンドが成功した後のステータスの変化"""
+    if command == "turnOn":
+        return {"power": "on"}
+    if command == "turnOff":
+        return {"power": "off"}
+    if command == "setBrightness":
+        return {"power": "on", "brightness": int(parameter)}
+    if command == "setColorTemperature":
+        return {"power": "on", "colorTemperature": int(parameter)}
+    if command == "lock":
+        return {"lockState": "locked"}
+    if command == "unlock":
+        return {"lockState": "unlocked"}
+    return {}
+
+class StatusCache:
+    """デバイスごとのステータスキャッシュ
+
+    同じデバイスへの同時の取得は1回のAPI呼び出しにまとめる。
+    コマンドが成功したらステータスを書き換え、同じ状態にするだけのコマンドは省略できる。
+    """
+
+    def __init__(self, fetch, ttls=None, default_ttl=STATUS_CACHE_TTL, push_ttl=STATUS_PUSH_TTL):
+        """
+        Args:
+            fetch: ステータスを取得する関数 fetch(device_id, priority) → APIレスポンス
+            ttls: デバイスタイプごとの有効期間（秒）
+            default_ttl: タイプごとの指定がない場合の有効期間（秒）
+            push_ttl: Webhookで更新されるデバイスの有効期間（秒）
+        """
+        self.fetch = fetch
+        self.ttls = STATUS_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.push_ttl = push_ttl
+        self._entries = {}    # device_id → {"body", "type", "updated_at", "pushed"}
+        self._inflight = {}   # device_id → 取得中のFuture
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "skipped": 0, "pushed": 0}
+
+    def _ttl(self, entry):
+        if entry.get("pushed"):
+            return self.push_ttl
+        return self.ttls.get(entry["type"], self.default_ttl)
+
+    def _fresh(self, entry, max_age=None):
+        if entry is None:
+            return False
+        ttl = self._ttl(entry) if max_age is None else max_age
+        return time.monotonic() - entry["updated_at"] < ttl
+
+    def get(self, device_id, priority="interactive", max_age=None):
+        """ステータスを取得（有効期間内ならキャッシュから）
+
+        Args:
+            device_id: デバイスID
+            priority: レート制限の優先度
+            max_age: キャッシュを使う最大経過秒数（Noneならタイプごとの有効期間、0なら必ず取得）
+
+        Returns:
+            APIと同じ形式のレスポンス {"statusCode", "body", ...}
+        """
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if self._fresh(entry, max_age):
+                self._stats["hits"] += 1
+                return {"statusCode": 100, "message": "success", "body": dict(entry["body"])}
+
+            future = self._inflight.get(device_id)
+            leader = future is None
+            if leader:
+                future = self._inflight[device_id] = Future()
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        # 他のスレッドが取得中ならその結果を待つ
+        if not leader:
+            return future.result()
+
+        try:
+            result = self.fetch(device_id, priority)
+            if result.get("statusCode") == 100:
+                body = result.get("body") or {}
+                with self._lock:
+                    self._entries[device_id] = {
+                        "body": dict(body),
+                        "type": body.get("deviceType"),
+                        "updated_at": time.monotonic(),
+                        "pushed": False
+                    }
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(device_id, None)
+
+    def update(self, device_id, changes, device_type=None, pushed=False):
+        """ステータスの一部を書き換え（操作の成功時・Webhookの受信時）
+
+        Args:
+            device_id: デバイスID
+            changes: 変更する項目 (例: {"power": "on"})
+            device_type: デバイスタイプ（分かる場合）
+            pushed: Webhookで届いた変化か（Trueならpush_ttlの間、それ以外はタイプごとの有効期間キャッシュを使う）
+        """
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                entry = self._entries[device_id] = {"body": {}, "type": device_type, "updated_at": 0.0, "pushed": False}
+            entry["body"].update(changes)
+            entry["type"] = entry["type"] or device_type
+            # 有効期間は最後に書き換えた方法で決める（Webhook以外の更新では通常の有効期間に戻す）
+            entry["pushed"] = pushed
+            if pushed:
+                self._stats["pushed"] += 1
+            # 取得したことがないステータスは有効期限切れのまま（省略の判定に使わない）
+            if entry["type"] is not None:
+                entry["updated_at"] = time.monotonic()
+
+    def record_command(self, device_id, command, parameter, result):
+        """コマンドの結果をステータスに反映（失敗した場合はキャッシュを破棄）"""
+        if result.get("statusCode") != 100:
+            self.invalidate(device_id)
+            return
+        try:
+            changes = command_effects(command, parameter)
+        except (TypeError, ValueError):
+            changes = {}
+        if changes:
+            self.update(device_id, changes)
+
+    def is_redundant(self, device_id, command, parameter="default"):
+        """キャッシュ上、既にコマンド後の状態になっているか（turnOn/turnOffのみ）"""
+        if command not in ("turnOn", "turnOff"):
+            return False
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if not self._fresh(entry) or entry["type"] not in POWER_DEVICE_TYPES:
+                return False
+            redundant = all(entry["body"].get(k) == v for k, v in command_effects(command, parameter).items())
+            if redundant:
+                self._stats["skipped"] += 1
+            return redundant
+
+    def invalidate(self, device_id=None):
+        """キャッシュを破棄（device_idを省略すると全て）"""
+        with self._lock:
+            if device_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(device_id, None)
+
+    def stats(self):
+        """利用状況（hits, misses, coalesced, skipped, pushed, entries）"""
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
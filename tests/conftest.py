@@ -0,0 +1,27 @@
+"""テストの共通設定（各モジュールは読み込み時に環境変数を参照するため、importより前に設定する）"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_workdir = tempfile.mkdtemp(prefix="switchbot-test-")
+
+os.environ.update({
+    # 実際のサービスに接続しない（.envの値も読み込まれない）
+    "SWITCH_BOT_TOKEN": "",
+    "OPENAI_API_KEY": "",
+    "SLACK_BOT_TOKEN": "",
+    "SLACK_APP_TOKEN": "",
+    "SWITCH_BOT_API_URL": "http://127.0.0.1:9/v1.1",
+    # ファイルは一時ディレクトリに
+    "DEVICE_CACHE_FILE": os.path.join(_workdir, "devices_cache.json"),
+    "DEVICE_ALIAS_FILE": os.path.join(_workdir, "device_aliases.json"),
+    "SCHEDULE_DB": os.path.join(_workdir, "schedules.db"),
+    "SLACK_THREAD_DB": "",
+    "SWITCHBOT_QUOTA_FILE": "",
+    "WEBHOOK_PORT": "",
+    "METRICS_PORT": "",
+    "LOG_LEVEL": "WARNING",
+})
@@ -0,0 +1,93 @@
+"""agent: バッチモードの入力の読み込みと処理"""
+import io
+import sys
+import json
+import threading
+
+import pytest
+
+import agent
+from agent import iter_batch_commands, run_batch
+
+def test_iter_batch_commands():
+    stream = io.StringIO("\n".join([
+        "照明をつけて",
+        "",
+        "   ",
+        "# コメント",
+        '{"text": "カーテンを開けて", "id": "a1"}',
+        '{"input": "鍵を閉めて", "id": 2, "ok": true}',
+        '{"text": "", "id": "empty"}',
+        '["json", "array"]',
+        "{壊れたJSON",
+        "  前後の空白  ",
+    ]))
+    assert list(iter_batch_commands(stream)) == [
+        ("照明をつけて", None),
+        ("カーテンを開けて", "a1"),
+        ("鍵を閉めて", 2),
+        ('["json", "array"]', None),
+        ("{壊れたJSON", None),
+        ("前後の空白", None),
+    ]
+
+def test_iter_batch_commands_is_lazy():
+    """ファイル全体を読み込まずに1行ずつ返す"""
+    def lines():
+        yield "1行目\n"
+        raise AssertionError("必要以上に読み込んだ")
+
+    assert next(iter_batch_commands(lines())) == ("1行目", None)
+
+def test_run_batch(monkeypatch):
+    devices = [{"name": "照明1"}, {"name": "照明10"}]
+    order = []
+    lock = threading.Lock()
+
+    def process(text):
+        if "失敗" in text:
+            raise RuntimeError("boom")
+        with lock:
+            order.append(text)
+        return f"OK: {text}"
+
+    monkeypatch.setattr(agent, "preload_openai_client", lambda: None)
+    monkeypatch.setattr(agent, "get_device_info", lambda: devices)
+    monkeypatch.setattr(agent, "process_user_request", process)
+
+    stream = io.StringIO("照明10をつけて\n照明10を消して\n失敗する指示\n" + '{"text": "照明1をつけて", "id": "x"}\n')
+    output = io.StringIO()
+    summary = run_batch(stream, output, parallel=4)
+
+    assert summary["count"] == 4 and summary["errors"] == 1
+    records = {r["seq"]: r for r in map(json.loads, output.getvalue().splitlines())}
+    assert set(records) == {1, 2, 3, 4}
+    assert records[3]["ok"] is False and records[3]["error"] == "boom"
+    assert records[4]["id"] == "x" and records[4]["output"] == "OK: 照明1をつけて"
+    # 同じデバイスへの指示は入力の順に処理する
+    assert order.index("照明10をつけて") < order.index("照明10を消して")
+
+def test_run_batch_mode_missing_input(tmp_path):
+    """入力ファイルがなくても標準出力を元に戻し、出力ファイルを閉じる"""
+    stdout = sys.stdout
+    output_path = tmp_path / "out.jsonl"
+    with pytest.raises(FileNotFoundError):
+        agent.run_batch_mode(str(tmp_path / "missing.txt"), str(output_path))
+    assert sys.stdout is stdout
+
+def test_run_batch_mode_restores_stdout(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(agent, "preload_openai_client", lambda: None)
+    monkeypatch.setattr(agent, "get_device_info", lambda: [])
+    monkeypatch.setattr(agent, "process_user_request", lambda text: print("処理中のprint") or "OK")
+
+    input_path = tmp_path / "input.txt"
+    input_path.write_text("照明をつけて\n", encoding="utf-8")
+    stdout = sys.stdout
+    summary = agent.run_batch_mode(str(input_path))
+
+    assert summary["count"] == 1
+    assert sys.stdout is stdout
+    captured = capsys.readouterr()
+    # 標準出力は結果のJSONLだけ
+    assert [json.loads(line)["output"] for line in captured.out.splitlines()] == ["OK"]
+    assert "処理中のprint" in captured.err
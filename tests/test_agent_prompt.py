@@ -0,0 +1,51 @@
+"""agent: デバイス一覧ブロックとプロンプトキャッシュの集計（複数のワーカーから同時に使う）"""
+import hashlib
+import threading
+from types import SimpleNamespace
+
+import agent
+from agent import build_device_block, record_prompt_usage
+
+def run_threads(target, count=8):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+def test_build_device_block_cached():
+    devices = [{"id": "1", "name": "照明", "type": "Ceiling Light"}]
+    version, text = build_device_block(devices)
+    assert "- 照明 (Ceiling Light)" in text
+    assert build_device_block(list(devices)) == (version, text)
+    assert build_device_block(devices + [{"id": "2", "name": "鍵", "type": "Smart Lock Ultra"}])[0] != version
+
+def test_build_device_block_consistent_across_threads():
+    """バージョンとテキストは同じデバイス一覧から作られたもの"""
+    device_lists = [[{"id": str(i), "name": f"デバイス{i}", "type": "Plug Mini (JP)"}] for i in range(4)]
+    mismatches = []
+
+    def worker(i):
+        for n in range(300):
+            version, text = build_device_block(device_lists[(i + n) % len(device_lists)])
+            if hashlib.sha1(text.encode("utf-8")).hexdigest()[:8] != version:
+                mismatches.append((version, text))
+
+    run_threads(worker)
+    assert mismatches == []
+
+def test_record_prompt_usage_counts_all(monkeypatch):
+    monkeypatch.setattr(agent, "prompt_cache_stats",
+                        {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "cache_hits": 0})
+    usage = SimpleNamespace(prompt_tokens=100, completion_tokens=5,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=64))
+    response = SimpleNamespace(usage=usage)
+
+    def worker(i):
+        for _ in range(200):
+            record_prompt_usage(response, "v1")
+
+    run_threads(worker)
+    assert agent.prompt_cache_stats == {"requests": 1600, "prompt_tokens": 160000,
+                                        "cached_tokens": 102400, "cache_hits": 1600}
+    assert agent.prompt_cache_hit_ratio() == 1.0
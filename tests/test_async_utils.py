@@ -0,0 +1,89 @@
+"""async_utils: 非同期クライアントのリトライと同時操作（httpx.MockTransport）"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import utils
+from async_utils import AsyncSwitchBotClient
+
+OK = {"statusCode": 100, "message": "success", "body": {}}
+
+class Handler:
+    """リクエストを記録し、responsesを順に返す（例外は送出）"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+def run(handler, func, **kwargs):
+    async def main():
+        async with AsyncSwitchBotClient({"Authorization": "test"}, base_url="http://switchbot.test/v1.1",
+                                        transport=httpx.MockTransport(handler), backoff_factor=0,
+                                        limiter=None, **kwargs) as client:
+            return await func(client)
+    return asyncio.run(main())
+
+@pytest.mark.parametrize("error", [
+    httpx.ReadTimeout("read timeout"),
+    httpx.RemoteProtocolError("Server disconnected without sending a response."),
+])
+def test_post_not_retried_after_send(error):
+    handler = Handler(error)
+    with pytest.raises(type(error)):
+        run(handler, lambda c: c.control_device("DEV", "press"))
+    assert len(handler.requests) == 1
+
+def test_post_not_retried_on_5xx():
+    handler = Handler(httpx.Response(503, text="<html>Service Unavailable</html>"))
+    result = run(handler, lambda c: c.control_device("DEV", "press"))
+    assert len(handler.requests) == 1
+    # JSONでないエラー応答
+    assert result["statusCode"] == 503 and "Service Unavailable" in result["message"]
+
+def test_post_retried_on_connect_error_and_429():
+    handler = Handler(httpx.ConnectError("refused"), httpx.Response(429, headers={"Retry-After": "0"}),
+                      httpx.Response(200, json=OK))
+    result = run(handler, lambda c: c.control_device("DEV", "turnOn"))
+    assert len(handler.requests) == 3
+    assert result["statusCode"] == 100 and result["retries"] == 2
+    assert json.loads(handler.requests[0].content) == {"command": "turnOn", "parameter": "default"}
+
+def test_get_retried_on_5xx_and_read_timeout():
+    handler = Handler(httpx.ReadTimeout("timeout"), httpx.Response(502), httpx.Response(200, json=OK))
+    assert run(handler, lambda c: c.get_devices())["statusCode"] == 100
+    assert len(handler.requests) == 3
+
+def test_retry_after_capped(monkeypatch):
+    monkeypatch.setattr("async_utils.MAX_RETRY_AFTER", 0.0)
+    handler = Handler(httpx.Response(429, headers={"Retry-After": "3600"}), httpx.Response(200, json=OK))
+    assert run(handler, lambda c: c.get_devices())["statusCode"] == 100
+
+def test_control_many(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(utils.status_cache, "record_command", lambda *args: recorded.append(args))
+
+    def handler(request):
+        device_id = request.url.path.split("/")[-2]
+        if device_id == "broken":
+            raise httpx.ReadTimeout("timeout")
+        if device_id == "offline":
+            return httpx.Response(200, json={"statusCode": 161, "message": "device offline"})
+        return httpx.Response(200, json=OK)
+
+    results = run(handler, lambda c: c.control_many(
+        [("light", "turnOff"), ("offline", "turnOff"), ("broken", "press"), ("plug", "turnOn", "default")]))
+
+    assert results["light"]["ok"] and results["plug"]["ok"]
+    assert not results["offline"]["ok"] and results["offline"]["result"]["statusCode"] == 161
+    assert not results["broken"]["ok"] and results["broken"]["error"] == "timeout"
+    # 成功・失敗ともにステータスキャッシュに反映（失敗したデバイスは破棄される）
+    assert sorted(args[0] for args in recorded) == ["light", "offline", "plug"]
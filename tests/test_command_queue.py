@@ -0,0 +1,134 @@
+"""command_queue: 重複の除去・設定値コマンドのまとめ"""
+import threading
+
+import pytest
+
+from command_queue import CommandQueue
+
+OK = {"statusCode": 100, "message": "success"}
+
+class Sender:
+    """送信したコマンドを記録するsend（gateが開くまで送信を止める）"""
+
+    def __init__(self, result=OK):
+        self.calls = []
+        self.result = result
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+
+    def __call__(self, device_id, command, parameter, priority):
+        self.calls.append((device_id, command, parameter, priority))
+        self.started.set()
+        assert self.gate.wait(5)
+        return dict(self.result)
+
+@pytest.fixture
+def sender():
+    return Sender()
+
+def hold(sender, queue, device_id="dev"):
+    """1つ目のコマンドを送信中のまま止める（後続のコマンドは待機中になる）"""
+    sender.gate.clear()
+    blocker = queue.submit(device_id, "turnOn")
+    assert sender.started.wait(2)
+    return blocker
+
+def test_duplicate_pending_command_sent_once(sender):
+    queue = CommandQueue(sender, workers=2)
+    blocker = hold(sender, queue)
+    futures = [queue.submit("dev", "turnOff") for _ in range(3)]
+    sender.gate.set()
+
+    assert blocker.result(2) == OK
+    assert [f.result(2) for f in futures] == [OK] * 3
+    assert [c[1] for c in sender.calls] == ["turnOn", "turnOff"]
+    assert queue.stats()["deduplicated"] == 2
+
+def test_recent_success_deduplicated(sender):
+    queue = CommandQueue(sender, workers=2, dedup_window=60)
+    assert queue.execute("dev", "turnOn") == OK
+    result = queue.execute("dev", "turnOn")
+
+    assert result["deduplicated"] is True
+    assert len(sender.calls) == 1
+
+    # forget後は送信する
+    queue.forget("dev")
+    queue.execute("dev", "turnOn")
+    assert len(sender.calls) == 2
+
+def test_failed_command_not_deduplicated():
+    sender = Sender(result={"statusCode": 161, "message": "device offline"})
+    queue = CommandQueue(sender, workers=2, dedup_window=60)
+    queue.execute("dev", "turnOn")
+    queue.execute("dev", "turnOn")
+    assert len(sender.calls) == 2
+
+def test_non_idempotent_not_deduplicated(sender):
+    queue = CommandQueue(sender, workers=2, dedup_window=60)
+    blocker = hold(sender, queue)
+    futures = [queue.submit("dev", "press") for _ in range(2)]
+    sender.gate.set()
+
+    blocker.result(2)
+    for f in futures:
+        f.result(2)
+    queue.execute("dev", "press")
+    assert [c[1] for c in sender.calls] == ["turnOn", "press", "press", "press"]
+
+def test_setter_coalesced_to_latest_value(sender):
+    queue = CommandQueue(sender, workers=2)
+    blocker = hold(sender, queue)
+    first = queue.submit("dev", "setBrightness", "30", priority="background")
+    second = queue.submit("dev", "setBrightness", "50", priority="scheduled")
+    latest = queue.submit("dev", "setBrightness", "80")
+    sender.gate.set()
+
+    blocker.result(2)
+    assert latest.result(2) == OK
+    # まとめられた側は実際に送信した値を受け取る
+    for future in (first, second):
+        assert future.result(2)["coalesced_into"] == {"command": "setBrightness", "parameter": "80"}
+    # 送信は1回、優先度は高い方
+    assert sender.calls[1:] == [("dev", "setBrightness", "80", "scheduled")]
+    assert queue.stats()["coalesced"] == 2
+
+def test_no_coalesce_across_other_command(sender):
+    """途中に別のコマンドがある場合は順番を保つ"""
+    queue = CommandQueue(sender, workers=2)
+    hold(sender, queue)
+    futures = [queue.submit("dev", "setBrightness", "30"),
+               queue.submit("dev", "turnOff"),
+               queue.submit("dev", "setBrightness", "80")]
+    sender.gate.set()
+
+    for f in futures:
+        assert "coalesced_into" not in f.result(2)
+    assert [c[1:3] for c in sender.calls[1:]] == [
+        ("setBrightness", "30"), ("turnOff", "default"), ("setBrightness", "80")]
+
+def test_devices_independent():
+    """止まっているデバイスがあっても別のデバイスには送信できる"""
+    gate = threading.Event()
+
+    def send(device_id, command, parameter, priority):
+        if device_id == "slow":
+            assert gate.wait(5)
+        return dict(OK)
+
+    queue = CommandQueue(send, workers=2)
+    slow = queue.submit("slow", "turnOn")
+    assert queue.submit("fast", "turnOn").result(2) == OK
+    assert not slow.done()
+    gate.set()
+    assert slow.result(2) == OK
+
+def test_send_exception_propagates_to_all():
+    def send(device_id, command, parameter, priority):
+        raise RuntimeError("boom")
+
+    queue = CommandQueue(send, workers=1)
+    future = queue.submit("dev", "turnOn")
+    with pytest.raises(RuntimeError):
+        future.result(2)
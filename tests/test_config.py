@@ -0,0 +1,22 @@
+"""config: 設定値の取得"""
+import pytest
+
+from config import get_env
+
+def test_get_env_default(monkeypatch):
+    monkeypatch.delenv("TEST_SETTING", raising=False)
+    assert get_env("TEST_SETTING") is None
+    assert get_env("TEST_SETTING", 5, int) == 5
+
+def test_get_env_cast(monkeypatch):
+    monkeypatch.setenv("TEST_SETTING", "2.5")
+    assert get_env("TEST_SETTING", 1.0, float) == 2.5
+    assert get_env("TEST_SETTING") == "2.5"
+    with pytest.raises(ValueError):
+        get_env("TEST_SETTING", 1, int)
+
+def test_get_env_empty(monkeypatch):
+    """空文字は数値の設定では未設定、文字列の設定ではそのまま（ファイルの保存を無効にするなど）"""
+    monkeypatch.setenv("TEST_SETTING", "")
+    assert get_env("TEST_SETTING", 8080, int) == 8080
+    assert get_env("TEST_SETTING", "api_quota.json") == ""
@@ -0,0 +1,60 @@
+"""history: トークン数の概算と会話履歴の圧縮"""
+from history import (estimate_tokens, message_tokens, summarize_messages, compact_history,
+                     MESSAGE_OVERHEAD_TOKENS, SUMMARY_CHARS_PER_MESSAGE)
+
+def conversation(count, text="照明をつけてください。" * 5):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i}: {text}"} for i in range(count)]
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens(None) == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    assert estimate_tokens("照明") == 2
+    assert message_tokens({"role": "user", "content": None}) == MESSAGE_OVERHEAD_TOKENS
+
+def test_within_budget_unchanged():
+    history = conversation(4)
+    compacted, stats = compact_history(history, token_budget=10000)
+    assert compacted == history
+    assert stats["saved_tokens"] == 0 and stats["summarized"] == 0 and stats["dropped"] == 0
+
+def test_older_messages_summarized():
+    history = conversation(20)
+    compacted, stats = compact_history(history, token_budget=400, keep_last=4)
+
+    # 要約 + 直近4件
+    assert compacted[0]["role"] == "system"
+    assert compacted[0]["content"].startswith("これまでの会話の要約:")
+    assert compacted[1:] == history[-4:]
+    assert stats["compacted_tokens"] == sum(message_tokens(m) for m in compacted) <= 400
+    assert stats["saved_tokens"] == stats["original_tokens"] - stats["compacted_tokens"]
+    assert stats["summarized"] + stats["dropped"] == 16
+    # 要約は新しいメッセージを優先し、古い順に並べる
+    lines = compacted[0]["content"].splitlines()[1:]
+    assert stats["summarized"] >= 2
+    assert lines[-1].startswith("- アシスタント: 15: ")
+    assert all(len(line) <= len("- アシスタント: ") + SUMMARY_CHARS_PER_MESSAGE + 1 for line in lines)
+
+def test_recent_trimmed_when_over_budget():
+    """直近分だけで予算を超える場合は古いものから削除し、最新の2件は必ず残す"""
+    history = conversation(6, text="長いメッセージ" * 100)
+    compacted, stats = compact_history(history, token_budget=50, keep_last=6)
+    assert compacted[-2:] == history[-2:]
+    assert len(compacted) <= 3
+    assert stats["summarized"] + stats["dropped"] == 4
+
+def test_keep_last_zero():
+    history = conversation(10)
+    compacted, stats = compact_history(history, token_budget=100, keep_last=0)
+    assert all(m["role"] == "system" for m in compacted)
+    assert stats["compacted_tokens"] <= 100
+
+def test_summarize_messages_no_room():
+    assert summarize_messages(conversation(3), max_tokens=5) == (None, 0)
+
+def test_input_not_modified():
+    history = conversation(20)
+    snapshot = [dict(m) for m in history]
+    compact_history(history, token_budget=200, keep_last=4)
+    assert history == snapshot
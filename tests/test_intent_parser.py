@@ -0,0 +1,76 @@
+"""intent_parser: ローカルで処理するコマンドの判定"""
+import pytest
+
+from intent_parser import parse_intent, DEFAULT_MIN_CONFIDENCE
+
+DEVICES = [
+    {"id": "light-1", "name": "リビングの照明", "type": "Ceiling Light"},
+    {"id": "curtain-1", "name": "寝室のカーテン", "type": "Curtain3"},
+    {"id": "lock-1", "name": "玄関の鍵", "type": "Smart Lock Ultra"},
+    {"id": "plug-1", "name": "扇風機", "type": "Plug Mini (JP)"},
+]
+
+@pytest.mark.parametrize("text, device_id, action", [
+    ("リビングの照明をつけて", "light-1", "on"),
+    ("リビングの照明を消して", "light-1", "off"),
+    ("ライトをオンにして", "light-1", "on"),
+    ("寝室のカーテンを開けて", "curtain-1", "open"),
+    ("カーテン閉めて", "curtain-1", "close"),
+    ("玄関の鍵をロック解除して", "lock-1", "unlock"),
+    ("ドアを施錠して", "lock-1", "lock"),
+    ("扇風機をオフ", "plug-1", "off"),
+    ("Turn ON the light", "light-1", "on"),
+])
+def test_control(text, device_id, action):
+    intent = parse_intent(text, DEVICES)
+    assert intent["kind"] == "control"
+    assert intent["device"]["id"] == device_id
+    assert intent["action"] == action
+    assert intent["confidence"] >= DEFAULT_MIN_CONFIDENCE
+
+def test_brightness():
+    intent = parse_intent("リビングの照明を５０％にして", DEVICES)
+    assert intent["kind"] == "brightness"
+    assert intent["action"] == "setBrightness"
+    assert intent["value"] == 50
+
+def test_brightness_out_of_range():
+    assert parse_intent("照明を150%にして", DEVICES) is None
+
+def test_color_temp():
+    intent = parse_intent("照明を暖色にして", DEVICES)
+    assert intent["kind"] == "color_temp"
+    assert intent["action"] == "setColorTemperature"
+    assert intent["value"] == "暖色"
+
+def test_list_devices():
+    intent = parse_intent("デバイス一覧を見せて", DEVICES)
+    assert intent["kind"] == "list_devices"
+    assert intent["device"] is None
+
+@pytest.mark.parametrize("text", [
+    "",
+    "7時に照明をつけて",              # スケジュール
+    "毎朝カーテンを開けて",
+    "照明はついてますか？",           # 質問
+    "照明の状態は?",
+    "照明をつけないで",              # 否定
+    "照明を少し暗くして",             # 相対指定
+    "照明とカーテンを開けて",          # 複数デバイス
+    "リビングの照明と寝室のカーテンをつけて",
+    "エアコンをつけて",              # 不明なデバイス
+    "照明を開錠して",               # タイプに合わない操作
+    "照明をつけて消して",             # 操作が複数
+])
+def test_fallback_to_llm(text):
+    assert parse_intent(text, DEVICES) is None
+
+def test_generic_name_ambiguous():
+    """同じタイプのデバイスが複数ある場合は一般名称で特定しない"""
+    devices = DEVICES + [{"id": "light-2", "name": "寝室の照明", "type": "Ceiling Light"}]
+    assert parse_intent("ライトをつけて", devices) is None
+    assert parse_intent("寝室の照明をつけて", devices)["device"]["id"] == "light-2"
+
+def test_extra_words_lower_confidence():
+    intent = parse_intent("リビングの照明をつけて、ついでに音楽もかけてほしいな", DEVICES)
+    assert intent is None or intent["confidence"] < DEFAULT_MIN_CONFIDENCE
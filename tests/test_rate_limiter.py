@@ -0,0 +1,84 @@
+"""rate_limiter: 優先度ごとの予約分・レート制限・使用回数の保存"""
+import json
+import time
+
+import pytest
+
+from rate_limiter import RateLimiter, RateLimitExceeded
+
+RESERVES = {"scheduled": 0, "interactive": 2, "background": 5}
+
+def make_limiter(daily_limit=10, rate=1000, burst=100, **kwargs):
+    kwargs.setdefault("quota_file", None)
+    return RateLimiter(rate=rate, burst=burst, daily_limit=daily_limit, reserves=dict(RESERVES), **kwargs)
+
+def test_lower_priorities_shed_first():
+    limiter = make_limiter()
+    # 残り10 → 5回までバックグラウンドを送れる
+    for _ in range(5):
+        limiter.acquire("background")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("background")
+
+    # 対話は残り2回を残して止まる
+    for _ in range(3):
+        limiter.acquire("interactive")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("interactive")
+
+    # スケジュール実行は上限まで送れる
+    limiter.acquire("scheduled")
+    limiter.acquire("scheduled")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("scheduled")
+
+    stats = limiter.stats()
+    assert stats["used"] == 10 and stats["remaining"] == 0
+    assert stats["shed"] == {"scheduled": 1, "interactive": 1, "background": 1}
+
+def test_invalid_priority():
+    with pytest.raises(ValueError):
+        make_limiter().acquire("urgent")
+
+def test_timeout_when_bucket_empty():
+    limiter = make_limiter(daily_limit=100, rate=0.1, burst=1)
+    limiter.acquire("interactive")
+    start = time.monotonic()
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("interactive", timeout=0.1)
+    assert time.monotonic() - start < 1
+    assert limiter.stats()["waited"]["interactive"] == 1
+
+def test_background_leaves_half_bucket():
+    """バックグラウンドはバケットの半分を高い優先度のために残す"""
+    limiter = make_limiter(daily_limit=100, rate=0.01, burst=4)
+    limiter.acquire("background")
+    limiter.acquire("background")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("background", timeout=0.05)
+    # 残りのトークンは対話で使える
+    limiter.acquire("interactive", timeout=0.05)
+    limiter.acquire("interactive", timeout=0.05)
+
+def test_waits_for_refill():
+    limiter = make_limiter(daily_limit=100, rate=50, burst=1)
+    limiter.acquire()
+    start = time.monotonic()
+    limiter.acquire(timeout=1)
+    assert time.monotonic() - start >= 0.01
+
+def test_quota_file_roundtrip(tmp_path):
+    quota_file = str(tmp_path / "api_quota.json")
+    limiter = make_limiter(daily_limit=100, quota_file=quota_file)
+    for _ in range(3):
+        limiter.acquire("scheduled")
+    limiter.flush()
+
+    with open(quota_file, encoding="utf-8") as f:
+        assert json.load(f)["used"] == 3
+    assert make_limiter(daily_limit=100, quota_file=quota_file).remaining() == 97
+
+def test_quota_file_other_day_ignored(tmp_path):
+    quota_file = tmp_path / "api_quota.json"
+    quota_file.write_text(json.dumps({"date": "2000-01-01", "used": 50}), encoding="utf-8")
+    assert make_limiter(daily_limit=100, quota_file=str(quota_file)).remaining() == 100
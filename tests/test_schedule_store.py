@@ -0,0 +1,87 @@
+"""schedule_store: SQLite / JSONのストアとJSONからの移行"""
+import json
+
+import pytest
+
+from schedule_store import JsonScheduleStore, SQLiteScheduleStore, migrate_json_to_sqlite, create_store
+
+def schedule(schedule_id, device_id="dev-1", time_str="07:00", **extra):
+    return dict({"id": schedule_id, "device_id": device_id, "time": time_str, "command": "turnOn",
+                 "parameter": "default", "enabled": True}, **extra)
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "json":
+        return JsonScheduleStore(str(tmp_path / "schedules.json"), str(tmp_path / "scenes.json"))
+    return SQLiteScheduleStore(str(tmp_path / "schedules.db"))
+
+def test_upsert_keeps_order(store):
+    store.upsert_many([schedule("a"), schedule("b", time_str="08:00"), schedule("c")])
+    store.upsert(schedule("a", enabled=False))
+    store.delete("b")
+
+    items = store.load_all()
+    assert [item["id"] for item in items] == ["a", "c"]
+    assert items[0]["enabled"] is False
+
+def test_find(store):
+    store.upsert_many([schedule("a"), schedule("b", device_id="dev-2"), schedule("c", time_str="22:00")])
+    assert [item["id"] for item in store.find(device_id="dev-1")] == ["a", "c"]
+    assert [item["id"] for item in store.find(device_id="dev-1", time_str="22:00")] == ["c"]
+    assert store.find(time_str="12:00") == []
+
+def test_scenes(store):
+    store.upsert_scene({"name": "おやすみ", "steps": [1]})
+    store.upsert_scene({"name": "おはよう", "steps": [2]})
+    store.upsert_scene({"name": "おやすみ", "steps": [3]})
+    store.delete_scene("おはよう")
+    assert store.load_scenes() == [{"name": "おやすみ", "steps": [3]}]
+
+def test_sqlite_persists(tmp_path):
+    path = str(tmp_path / "schedules.db")
+    SQLiteScheduleStore(path).upsert(schedule("a"))
+    assert [item["id"] for item in SQLiteScheduleStore(path).load_all()] == ["a"]
+
+def write_json(path, items):
+    path.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+
+def test_migrate_json_to_sqlite(tmp_path):
+    json_path = tmp_path / "schedules.json"
+    # IDのない古い形式を含む
+    legacy = schedule("x")
+    del legacy["id"]
+    write_json(json_path, [schedule("a"), legacy])
+
+    store = SQLiteScheduleStore(str(tmp_path / "schedules.db"))
+    assert migrate_json_to_sqlite(str(json_path), store) == 2
+
+    items = store.load_all()
+    assert items[0]["id"] == "a" and items[1]["id"]
+    # 移行元は.migratedに変更して残す
+    assert not json_path.exists()
+    assert json.loads((tmp_path / "schedules.json.migrated").read_text(encoding="utf-8"))[0]["id"] == "a"
+
+def test_migrate_only_into_empty_store(tmp_path):
+    json_path = tmp_path / "schedules.json"
+    write_json(json_path, [schedule("a")])
+    store = SQLiteScheduleStore(str(tmp_path / "schedules.db"))
+    store.upsert(schedule("existing"))
+
+    assert migrate_json_to_sqlite(str(json_path), store) == 0
+    assert json_path.exists()
+    assert [item["id"] for item in store.load_all()] == ["existing"]
+
+def test_migrate_without_json(tmp_path):
+    store = SQLiteScheduleStore(str(tmp_path / "schedules.db"))
+    assert migrate_json_to_sqlite(str(tmp_path / "missing.json"), store) == 0
+
+def test_create_store_migrates_once(tmp_path):
+    json_path = tmp_path / "schedules.json"
+    db_path = str(tmp_path / "schedules.db")
+    write_json(json_path, [schedule("a")])
+
+    assert [item["id"] for item in create_store("sqlite", str(json_path), db_path).load_all()] == ["a"]
+    # 同じ名前のJSONが再び作られても、移行済みのストアには取り込まない
+    write_json(json_path, [schedule("b")])
+    assert [item["id"] for item in create_store("sqlite", str(json_path), db_path).load_all()] == ["a"]
+    assert isinstance(create_store("json", str(json_path), db_path), JsonScheduleStore)
@@ -0,0 +1,100 @@
+"""scheduler_engine: トリガーの次回実行時刻とエンジンの実行"""
+import time
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from scheduler_engine import (SchedulerEngine, DailyTrigger, CronTrigger, SunTrigger,
+                              parse_trigger, parse_weekdays)
+
+def test_parse_trigger_types():
+    assert isinstance(parse_trigger("07:00"), DailyTrigger)
+    assert isinstance(parse_trigger("cron:0 7 * * 1-5"), CronTrigger)
+    sun = parse_trigger("sunset - 15")
+    assert isinstance(sun, SunTrigger)
+    assert sun.event == "sunset" and sun.offset == timedelta(minutes=-15)
+
+@pytest.mark.parametrize("spec", ["25:00", "7", "cron:* * *", "cron:61 * * * *", "cron:a * * * *"])
+def test_parse_trigger_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_trigger(spec)
+
+def test_parse_weekdays():
+    assert parse_weekdays(None) is None
+    assert parse_weekdays(["mon", "Friday", "日", 7]) == {0, 4, 6, 0}
+    with pytest.raises(ValueError):
+        parse_weekdays(["xyz"])
+
+def test_daily_next_fire():
+    trigger = DailyTrigger("07:00")
+    assert trigger.next_fire(datetime(2025, 1, 1, 6, 59)) == datetime(2025, 1, 1, 7, 0)
+    # ちょうどの時刻は翌日
+    assert trigger.next_fire(datetime(2025, 1, 1, 7, 0)) == datetime(2025, 1, 2, 7, 0)
+
+def test_daily_next_fire_weekdays():
+    # 2025-01-03は金曜日 → 次の月曜日
+    trigger = DailyTrigger("07:00", ["mon"])
+    assert trigger.next_fire(datetime(2025, 1, 3, 8, 0)) == datetime(2025, 1, 6, 7, 0)
+
+def test_cron_next_fire_step():
+    trigger = parse_trigger("cron:*/15 * * * *")
+    assert trigger.next_fire(datetime(2025, 1, 1, 10, 7, 30)) == datetime(2025, 1, 1, 10, 15)
+    assert trigger.next_fire(datetime(2025, 1, 1, 10, 45)) == datetime(2025, 1, 1, 11, 0)
+
+def test_cron_next_fire_weekdays():
+    # 平日7時（cronの曜日は日曜=0）、2025-01-04は土曜日
+    trigger = parse_trigger("cron:0 7 * * 1-5")
+    assert trigger.next_fire(datetime(2025, 1, 4, 6, 0)) == datetime(2025, 1, 6, 7, 0)
+
+def test_cron_day_or_weekday():
+    # 日と曜日の両方を指定した場合はどちらかに一致すれば良い（1日、または日曜日）
+    trigger = parse_trigger("cron:0 0 1 * 0")
+    assert trigger.next_fire(datetime(2025, 1, 2, 0, 0)) == datetime(2025, 1, 5, 0, 0)
+    assert trigger.next_fire(datetime(2025, 1, 31, 0, 0)) == datetime(2025, 2, 1, 0, 0)
+
+def test_sun_next_fire_is_after():
+    trigger = SunTrigger("sunrise", 30)
+    after = datetime(2025, 6, 1, 12, 0)
+    fire = trigger.next_fire(after)
+    assert after < fire < after + timedelta(days=1)
+
+class EveryFiveMinutes:
+    def next_fire(self, after):
+        return after + timedelta(minutes=5)
+
+def test_engine_coalesces_missed_runs():
+    """スリープなどで実行時刻を過ぎた回はまとめて1回だけ実行する"""
+    engine = SchedulerEngine(max_workers=2)
+    calls = []
+    fired = threading.Event()
+
+    def job():
+        calls.append(time.monotonic())
+        fired.set()
+
+    # 2時間前から5分ごと（24回分過ぎている）
+    engine.add("job", EveryFiveMinutes(), job, now=datetime.now() - timedelta(hours=2))
+    engine.start()
+    try:
+        assert fired.wait(2)
+        time.sleep(0.2)
+    finally:
+        engine.stop()
+
+    assert len(calls) == 1
+    assert engine.next_run("job") > datetime.now()
+
+def test_engine_runs_due_job_and_remove():
+    engine = SchedulerEngine(max_workers=2)
+    fired = threading.Event()
+    engine.add("soon", EveryFiveMinutes(), fired.set, now=datetime.now() - timedelta(minutes=5, seconds=-0.1))
+    engine.add("removed", EveryFiveMinutes(), lambda: pytest.fail("削除したジョブが実行された"),
+               now=datetime.now() - timedelta(minutes=5))
+    engine.remove("removed")
+    engine.start()
+    try:
+        assert fired.wait(2)
+    finally:
+        engine.stop()
+    assert len(engine) == 1
@@ -0,0 +1,28 @@
+"""slack_bot: slack_sdkの遅延読み込み・ワーカーのメトリクス"""
+import os
+import subprocess
+import sys
+
+from slack_sdk.errors import SlackApiError
+
+import metrics
+import slack_bot
+
+def test_import_does_not_load_slack_sdk():
+    code = "import sys, slack_bot; print(sorted(m for m in sys.modules if m.split('.')[0] in ('slack_sdk', 'slack_bolt')))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(slack_bot.__file__),
+                            env=dict(os.environ), capture_output=True, text=True, timeout=60, check=True)
+    assert result.stdout.strip() == "[]"
+
+def test_slack_api_error_is_caught(monkeypatch):
+    class FailingClient:
+        def auth_test(self):
+            raise SlackApiError("invalid_auth", {"ok": False, "error": "invalid_auth"})
+
+    monkeypatch.setattr(slack_bot, "slack_client", FailingClient())
+    assert slack_bot.get_bot_user_id() is None
+
+def test_worker_metrics_exported():
+    text = metrics.render()
+    assert "switchbot_slack_queue_depth " in text
+    assert "switchbot_slack_in_flight " in text
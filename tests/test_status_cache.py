@@ -0,0 +1,124 @@
+"""status_cache: 有効期間・同時取得のまとめ・操作結果の反映"""
+import threading
+
+import pytest
+
+from status_cache import StatusCache
+
+class Fetcher:
+    """取得回数を記録するfetch（gateが開くまで取得を止める）"""
+
+    def __init__(self, device_type="Ceiling Light", power="off"):
+        self.calls = 0
+        self.body = {"deviceType": device_type, "power": power}
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+
+    def __call__(self, device_id, priority):
+        self.calls += 1
+        self.started.set()
+        assert self.gate.wait(5)
+        return {"statusCode": 100, "message": "success", "body": dict(self.body, deviceId=device_id)}
+
+def make_cache(fetch, **kwargs):
+    kwargs.setdefault("ttls", {"Ceiling Light": 60})
+    return StatusCache(fetch, **kwargs)
+
+def test_cached_within_ttl():
+    fetch = Fetcher()
+    cache = make_cache(fetch)
+    assert cache.get("dev")["body"]["power"] == "off"
+    assert cache.get("dev")["body"]["power"] == "off"
+    assert fetch.calls == 1
+    # max_age=0なら必ず取得
+    cache.get("dev", max_age=0)
+    assert fetch.calls == 2
+    assert cache.stats()["hits"] == 1
+
+def test_default_ttl_for_unknown_type():
+    fetch = Fetcher(device_type="Hub 2")
+    cache = make_cache(fetch, default_ttl=0)
+    cache.get("dev")
+    cache.get("dev")
+    assert fetch.calls == 2
+
+def test_concurrent_gets_coalesced():
+    fetch = Fetcher()
+    fetch.gate.clear()
+    cache = make_cache(fetch)
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get("dev")))
+    leader.start()
+    assert fetch.started.wait(2)
+    followers = [threading.Thread(target=lambda: results.append(cache.get("dev"))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    fetch.gate.set()
+    for t in [leader] + followers:
+        t.join(2)
+
+    assert fetch.calls == 1
+    assert len(results) == 4
+    assert cache.stats()["misses"] == 1
+
+def test_fetch_error_propagates_and_not_cached():
+    calls = []
+
+    def fetch(device_id, priority):
+        calls.append(device_id)
+        raise RuntimeError("boom")
+
+    cache = make_cache(fetch)
+    with pytest.raises(RuntimeError):
+        cache.get("dev")
+    with pytest.raises(RuntimeError):
+        cache.get("dev")
+    assert len(calls) == 2
+
+def test_record_command_and_redundant():
+    fetch = Fetcher(power="off")
+    cache = make_cache(fetch)
+    cache.get("dev")
+    assert cache.is_redundant("dev", "turnOff")
+    assert not cache.is_redundant("dev", "turnOn")
+
+    cache.record_command("dev", "turnOn", "default", {"statusCode": 100})
+    assert cache.is_redundant("dev", "turnOn")
+    assert cache.get("dev")["body"]["power"] == "on"
+    assert fetch.calls == 1
+
+    # 失敗したらキャッシュを破棄
+    cache.record_command("dev", "turnOff", "default", {"statusCode": 161})
+    assert not cache.is_redundant("dev", "turnOff")
+
+def test_never_fetched_status_not_used():
+    cache = make_cache(Fetcher())
+    cache.record_command("dev", "turnOn", "default", {"statusCode": 100})
+    assert not cache.is_redundant("dev", "turnOn")
+
+def test_pushed_uses_push_ttl():
+    fetch = Fetcher()
+    cache = make_cache(fetch, ttls={"Ceiling Light": 0}, push_ttl=3600)
+    cache.get("dev")
+    cache.update("dev", {"power": "on"}, pushed=True)
+    assert cache.get("dev")["body"]["power"] == "on"
+    assert fetch.calls == 1
+
+def test_pushed_flag_reset_by_command():
+    """Webhook以外の更新では通常の有効期間に戻す"""
+    fetch = Fetcher()
+    cache = make_cache(fetch, ttls={"Ceiling Light": 0}, push_ttl=3600)
+    cache.get("dev")
+    cache.update("dev", {"power": "on"}, pushed=True)
+    cache.record_command("dev", "turnOff", "default", {"statusCode": 100})
+    cache.get("dev")
+    assert fetch.calls == 2
+
+def test_pushed_flag_reset_by_fetch():
+    fetch = Fetcher()
+    cache = make_cache(fetch, ttls={"Ceiling Light": 0}, push_ttl=3600)
+    cache.update("dev", {"power": "on"}, device_type="Ceiling Light", pushed=True)
+    cache.get("dev", max_age=0)
+    cache.get("dev")
+    assert fetch.calls == 2
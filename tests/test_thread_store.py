@@ -0,0 +1,96 @@
+"""thread_store: LRU・有効期限による削除とSQLiteからの再読み込み"""
+import types
+
+import pytest
+
+import thread_store
+from thread_store import ThreadStore
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(thread_store, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+def test_history_limited_and_copied(clock):
+    store = ThreadStore(max_messages=3)
+    for i in range(5):
+        store.append("t1", "user", f"m{i}")
+    history = store.get_history("t1")
+    assert [m["content"] for m in history] == ["m2", "m3", "m4"]
+
+    history.append({"role": "user", "content": "外部で追加"})
+    assert len(store.get_history("t1")) == 3
+    assert store.get_history("unknown") == []
+
+def test_reset_and_last_ts(clock):
+    store = ThreadStore()
+    store.append("t1", "user", "こんにちは")
+    store.set_last_ts("t1", "123.456")
+    store.reset("t1")
+    assert store.get_history("t1") == []
+    assert store.get_last_ts("t1") == "123.456"
+    assert store.get_last_ts("unknown") is None
+
+def test_lru_eviction(clock):
+    store = ThreadStore(max_threads=2)
+    store.track("t1")
+    store.track("t2")
+    # t1を使うとt2が最も古くなる
+    store.append("t1", "user", "hi")
+    store.track("t3")
+    assert store.active_threads() == ["t1", "t3"]
+    assert len(store) == 2
+
+def test_ttl_expiry(clock):
+    store = ThreadStore(ttl=60)
+    store.track("old")
+    clock.now += 30
+    store.track("new")
+    clock.now += 31
+    assert store.active_threads() == ["new"]
+    assert store.get_history("old") == []
+
+def test_reload_from_sqlite(clock, tmp_path):
+    db_path = str(tmp_path / "threads.db")
+    store = ThreadStore(ttl=60, db_path=db_path)
+    store.track("expired")
+    clock.now += 30
+    store.append("t1", "user", "照明をつけて")
+    store.append("t1", "assistant", "つけました")
+    store.set_last_ts("t1", "100.1")
+    clock.now += 1
+    store.track("t2")
+
+    clock.now += 44
+    reloaded = ThreadStore(ttl=60, db_path=db_path)
+    # 期限切れのスレッドは読み込まず、ファイルからも削除する
+    assert reloaded.active_threads() == ["t1", "t2"]
+    assert [m["content"] for m in reloaded.get_history("t1")] == ["照明をつけて", "つけました"]
+    assert reloaded.get_last_ts("t1") == "100.1"
+    count = reloaded._db.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+    assert count == 2
+
+def test_reload_keeps_newest_threads(clock, tmp_path):
+    db_path = str(tmp_path / "threads.db")
+    store = ThreadStore(max_threads=10, db_path=db_path)
+    for i in range(5):
+        store.track(f"t{i}")
+        clock.now += 1
+
+    reloaded = ThreadStore(max_threads=3, db_path=db_path)
+    assert reloaded.active_threads() == ["t2", "t3", "t4"]
+
+def test_evicted_threads_deleted_from_sqlite(clock, tmp_path):
+    db_path = str(tmp_path / "threads.db")
+    store = ThreadStore(max_threads=1, db_path=db_path)
+    store.track("t1")
+    store.track("t2")
+    assert ThreadStore(max_threads=10, db_path=db_path).active_threads() == ["t2"]
@@ -0,0 +1,78 @@
+"""utils: Switchbot APIクライアントのリトライ"""
+import socket
+import threading
+
+import pytest
+import requests
+
+from utils import SwitchBotClient, is_connect_error
+
+class DroppingServer:
+    """リクエストを読み込んだ後、応答せずに接続を切るサーバー"""
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.requests = 0
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                if conn.recv(65536):
+                    self.requests += 1
+
+    def close(self):
+        self.sock.close()
+
+@pytest.fixture
+def dropping_server():
+    server = DroppingServer()
+    yield server
+    server.close()
+
+def make_client(port, **kwargs):
+    return SwitchBotClient({"Authorization": "test"}, base_url=f"http://127.0.0.1:{port}/v1.1",
+                           backoff_factor=0, limiter=None, **kwargs)
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def test_post_dropped_after_send_not_retried(dropping_server):
+    """送信後に切断された場合はデバイスが実行済みの場合があるため再送しない"""
+    client = make_client(dropping_server.port)
+    with pytest.raises(requests.ConnectionError) as excinfo:
+        client.control_device("DEV", "press")
+    assert not is_connect_error(excinfo.value)
+    assert dropping_server.requests == 1
+
+def test_get_dropped_after_send_retried(dropping_server):
+    client = make_client(dropping_server.port, max_retries=2)
+    with pytest.raises(requests.ConnectionError):
+        client.get_devices()
+    assert dropping_server.requests == 3
+
+def test_post_connection_refused_retried(monkeypatch):
+    client = make_client(closed_port(), max_retries=2)
+    calls = []
+    send = client.session.request
+    monkeypatch.setattr(client.session, "request", lambda *a, **kw: calls.append(a) or send(*a, **kw))
+
+    with pytest.raises(requests.ConnectionError) as excinfo:
+        client.control_device("DEV", "press")
+    assert is_connect_error(excinfo.value)
+    assert len(calls) == 3
+
+def test_is_connect_error():
+    assert is_connect_error(requests.ConnectTimeout())
+    assert not is_connect_error(requests.ReadTimeout())
+    assert not is_connect_error(requests.ConnectionError("Connection aborted."))
+    assert not is_connect_error(ValueError())
@@ -0,0 +1,78 @@
+"""webhook: イベントの解析と受信サーバーの検証"""
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from webhook import WebhookServer, WEBHOOK_MAX_BODY, parse_event, is_loopback, token_matches, normalize_device_id
+
+EVENT = {
+    "eventType": "changeReport",
+    "eventVersion": "1",
+    "context": {"deviceType": "WoCeiling", "deviceMac": "aa:bb:cc:dd:ee:ff",
+                "powerState": "ON", "brightness": "80", "colorTemperature": "bad"},
+}
+
+def test_parse_event():
+    device_id, changes = parse_event(EVENT)
+    assert normalize_device_id(device_id) == "AABBCCDDEEFF"
+    # 変換できない値は無視
+    assert changes == {"power": "on", "brightness": 80}
+
+def test_parse_event_ignores_other_events():
+    assert parse_event({"eventType": "other", "context": {"deviceMac": "x"}}) == (None, {})
+    assert parse_event({"eventType": "changeReport"}) == (None, {})
+
+@pytest.mark.parametrize("host, expected", [
+    ("127.0.0.1", True), ("::1", True), ("localhost", True),
+    ("0.0.0.0", False), ("192.168.1.10", False), ("example.com", False),
+])
+def test_is_loopback(host, expected):
+    assert is_loopback(host) is expected
+
+def test_token_matches():
+    assert token_matches("", "")
+    assert token_matches("anything", "")
+    assert token_matches("s3cret", "s3cret")
+    assert not token_matches("", "s3cret")
+    assert not token_matches("wrong", "s3cret")
+
+def test_public_host_requires_secret():
+    with pytest.raises(ValueError):
+        WebhookServer(host="0.0.0.0", port=0, secret="")
+
+@pytest.fixture
+def server():
+    events = []
+    server = WebhookServer(host="127.0.0.1", port=0, secret="s3cret",
+                           handler=lambda event: events.append(event) or True).start()
+    server.events = events
+    yield server
+    server.stop()
+
+def post(url, body):
+    request = urllib.request.Request(url, data=body, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=5) as res:
+            return res.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def test_server_accepts_event(server):
+    assert post(server.url, json.dumps(EVENT).encode()) == 200
+    assert server.events == [EVENT]
+    assert server.stats() == {"received": 1, "applied": 1, "rejected": 0}
+
+def test_server_rejects_bad_requests(server):
+    base = server.url.split("?")[0]
+    assert post(base, b"{}") == 404
+    assert post(base + "?token=wrong", b"{}") == 404
+    assert post(server.url.replace(server.path, "/other"), b"{}") == 404
+    assert post(server.url, b"not json") == 400
+    # JSONだがオブジェクトでないイベント・context
+    for body in (b"[]", b'"x"', b"1", b"null", b'{"context": "abc"}', b'{"context": [1]}'):
+        assert post(server.url, body) == 400
+    assert post(server.url, b"x" * (WEBHOOK_MAX_BODY + 1)) == 413
+    assert server.events == []
+    assert server.stats()["rejected"] == 11
@@ -0,0 +1,164 @@
+"""Slackスレッドの状態管理（上限・有効期限付き、SQLiteへの保存に対応）"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from log import get_logger
+
+logger = get_logger("thread_store")
+
+class ThreadStore:
+    """スレッドごとの会話履歴と最終処理タイムスタンプを保持
+
+    - 最後に使われた順（LRU）で管理し、max_threadsを超えたら古いスレッドから削除
+    - ttl秒以上更新のないスレッドは期限切れとして削除
+    - 1スレッドあたりの履歴はmax_messages件まで（古いものから削除）
+    - db_pathを指定するとSQLiteに保存し、再起動後も続きから処理できる
+    """
+
+    def __init__(self, max_threads=200, ttl=86400, max_messages=20, db_path=None):
+        """
+        Args:
+            max_threads: 保持するスレッド数の上限
+            ttl: スレッドの有効期限（秒）
+            max_messages: 1スレッドあたりの履歴の上限
+            db_path: SQLiteファイルのパス（Noneならメモリのみ）
+        """
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._threads = OrderedDict()  # { thread_ts: {"messages": [...], "last_ts": str, "updated_at": float} }
+        self._lock = threading.RLock()
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS threads ("
+                "thread_ts TEXT PRIMARY KEY, last_ts TEXT, updated_at REAL, messages TEXT)"
+            )
+            self._db.commit()
+            self._load()
+
+    def _load(self):
+        """SQLiteから期限内のスレッドを読み込み"""
+        rows = self._db.execute(
+            "SELECT thread_ts, last_ts, updated_at, messages FROM threads "
+            "WHERE updated_at >= ? ORDER BY updated_at DESC LIMIT ?",
+            (time.time() - self.ttl, self.max_threads)
+        ).fetchall()
+
+        for thread_ts, last_ts, updated_at, messages in reversed(rows):
+            self._threads[thread_ts] = {
+                "messages": json.loads(messages),
+                "last_ts": last_ts,
+                "updated_at": updated_at
+            }
+
+        # 期限切れ分はファイルからも削除
+        self._db.execute("DELETE FROM threads WHERE updated_at < ?", (time.time() - self.ttl,))
+        self._db.commit()
+
+        if rows:
+            logger.info("スレッド状態を読み込みました", threads=len(rows))
+
+    def _save(self, thread_ts):
+        if not self._db:
+            return
+        state = self._threads.get(thread_ts)
+        if state is None:
+            self._db.execute("DELETE FROM threads WHERE thread_ts = ?", (thread_ts,))
+        else:
+            self._db.execute(
+                "INSERT OR REPLACE INTO threads (thread_ts, last_ts, updated_at, messages) VALUES (?, ?, ?, ?)",
+                (thread_ts, state["last_ts"], state["updated_at"], json.dumps(state["messages"], ensure_ascii=False))
+            )
+        self._db.commit()
+
+    def _touch(self, thread_ts):
+        """スレッドを取得（なければ作成）して最新に移動"""
+        state = self._threads.get(thread_ts)
+        if state is None:
+            state = {"messages": [], "last_ts": None, "updated_at": time.time()}
+            self._threads[thread_ts] = state
+        else:
+            state["updated_at"] = time.time()
+            self._threads.move_to_end(thread_ts)
+
+        self._evict()
+        return state
+
+    def _evict(self):
+        """期限切れ・上限超過のスレッドを削除"""
+        expired_before = time.time() - self.ttl
+        removed = []
+
+        while self._threads:
+            thread_ts, state = next(iter(self._threads.items()))
+            if len(self._threads) > self.max_threads or state["updated_at"] < expired_before:
+                self._threads.popitem(last=False)
+                removed.append(thread_ts)
+            else:
+                break
+
+        if self._db and removed:
+            self._db.executemany("DELETE FROM threads WHERE thread_ts = ?", [(ts,) for ts in removed])
+            self._db.commit()
+
+    def track(self, thread_ts):
+        """スレッドを監視対象に追加"""
+        with self._lock:
+            self._touch(thread_ts)
+            self._save(thread_ts)
+
+    def reset(self, thread_ts):
+        """スレッドの会話履歴をクリア"""
+        with self._lock:
+            state = self._touch(thread_ts)
+            state["messages"] = []
+            self._save(thread_ts)
+
+    def get_history(self, thread_ts):
+        """会話履歴を取得（コピーを返す）"""
+        with self._lock:
+            state = self._threads.get(thread_ts)
+            return list(state["messages"]) if state else []
+
+    def append(self, thread_ts, role, content):
+        """会話履歴にメッセージを追加
+
+        Args:
+            thread_ts: スレッドのタイムスタンプ
+            role: "user" または "assistant"
+            content: メッセージ本文
+        """
+        with self._lock:
+            state = self._touch(thread_ts)
+            state["messages"].append({"role": role, "content": content})
+            if len(state["messages"]) > self.max_messages:
+                del state["messages"][:-self.max_messages]
+            self._save(thread_ts)
+
+    def get_last_ts(self, thread_ts):
+        """スレッドで最後に処理したタイムスタンプ"""
+        with self._lock:
+            state = self._threads.get(thread_ts)
+            return state["last_ts"] if state else None
+
+    def set_last_ts(self, thread_ts, ts):
+        """スレッドで最後に処理したタイムスタンプを更新"""
+        with self._lock:
+            state = self._touch(thread_ts)
+            state["last_ts"] = ts
+            self._save(thread_ts)
+
+    def active_threads(self):
+        """期限内のスレッドの一覧（古い順）"""
+        with self._lock:
+            self._evict()
+            return list(self._threads.keys())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._threads)
@@ -1,101 +1,347 @@
-import os
-import requests
-from dotenv import load_dotenv
+import time
+import random
+import threading
+from config import settings, get_env
+from rate_limiter import limiter as default_limiter
+from status_cache import StatusCache
+from command_queue import CommandQueue
+import metrics
+from log import get_logger, bind
 
-# .envファイルから環境変数を読み込む
-load_dotenv()
+logger = get_logger("utils")
 
-# トークンとシークレットを取得
-token = os.getenv("SWITCH_BOT_TOKEN")
-client_secret = os.getenv("SWITCH_BOT_CLIENT_SECRET")
+def get_headers():
+    """APIヘッダー
 
-if not token:
-    raise ValueError("SWITCH_BOT_TOKENが.envファイルに設定されていません")
+    Raises:
+        ValueError: SWITCH_BOT_TOKENが設定されていない
+    """
+    return {
+        "Authorization": settings.require("switchbot_token"),
+        "Content-Type": "application/json"
+    }
 
-# APIヘッダーを設定
-headers = {
-    "Authorization": token,
-    "Content-Type": "application/json"
-}
+# APIのベースURL（SWITCH_BOT_API_URLでローカルのフェイクサーバーに差し替え可能）
+API_BASE_URL = settings.switchbot_api_url
+
+# リトライ対象のHTTPステータス
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# POST（デバイスへのコマンドなど）のリトライ対象のHTTPステータス
+# 5xx・読み込みのタイムアウト・送信後の切断ではデバイスが実行済みの場合があるため、実行されていないことが確実なものだけ
+POST_RETRY_STATUS_CODES = {429}
+
+# Retry-Afterで待つ最大秒数
+MAX_RETRY_AFTER = 30.0
+
+# APIの応答コード（HTTPエラーはHTTPステータス、それ以外はレスポンスのstatusCode）
+API_RESPONSES = metrics.counter("api_responses_total", "Switchbot APIの応答コードごとの件数", ["method", "code"])
+
+# デバイスタイプ・コマンドごとのコマンドの処理時間（キュー待ちを含む）
+COMMAND_SECONDS = metrics.histogram("command_seconds", "デバイスへのコマンドの処理時間（秒）", ["device_type", "command"])
+
+def is_connect_error(error):
+    """接続できなかった（リクエストを送信していない）エラーか
+
+    requestsのConnectionErrorには送信後の切断（"Connection aborted"）も含まれるため、
+    接続のタイムアウトとurllib3のNewConnectionError（接続拒否・名前解決の失敗など）だけを対象にする。
+    """
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # 接続の失敗はMaxRetryError(reason=NewConnectionError)で包まれる
+    reason = error.args[0]
+    return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+
+class SwitchBotClient:
+    """Switchbot APIクライアント（コネクションプール・タイムアウト・リトライ付き）"""
+
+    def __init__(self, headers, base_url=API_BASE_URL, timeout=(3.05, 10),
+                 max_retries=3, backoff_factor=0.5, pool_maxsize=10, adapter=None, limiter=default_limiter):
+        """
+        Args:
+            headers: APIヘッダー
+            base_url: APIのベースURL
+            timeout: タイムアウト（秒、または(接続, 読み込み)のタプル）
+            max_retries: 5xx/429時の最大リトライ回数（POSTは接続できなかった場合と429のみ）
+            backoff_factor: リトライ間隔の基準（秒）
+            pool_maxsize: コネクションプールの最大接続数
+            adapter: 差し替え用のトランスポートアダプター（省略時はHTTPAdapter）
+            limiter: レート制限（Noneなら制限しない）
+        """
+        self.base_url = base_url.rstrip("/")
+        self.limiter = limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        # requestsの読み込みは重いため、クライアントを作るときに読み込む
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # Keep-Aliveで接続を再利用するセッション
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = adapter or HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def mount(self, prefix, adapter):
+        """トランスポートアダプターを登録（テスト用のモックなどに差し替え可能）"""
+        self.session.mount(prefix, adapter)
+
+    def _backoff(self, attempt, response=None):
+        """リトライまでの待機時間（ジッター付き指数バックオフ）"""
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(float(response.headers["Retry-After"]), MAX_RETRY_AFTER)
+        return self.backoff_factor * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def request(self, method, path, priority="interactive", **kwargs):
+        """APIリクエストを送信してJSONを返す
+
+        Args:
+            method: HTTPメソッド
+            path: ベースURLからのパス (例: "/devices")
+            priority: レート制限の優先度 ("scheduled" / "interactive" / "background")
+
+        Raises:
+            RateLimitExceeded: 1日の上限に近く、この優先度のリクエストを送れない
+        """
+        import requests
+
+        url = f"{self.base_url}{path}"
+        kwargs.setdefault("timeout", self.timeout)
+
+        # POSTは送信されていないことが確実な失敗（接続できない・429）だけリトライする
+        post = method.upper() == "POST"
+        retry_statuses = POST_RETRY_STATUS_CODES if post else RETRY_STATUS_CODES
+
+        for attempt in range(self.max_retries + 1):
+            # リトライも1回のリクエストとして数える
+            if self.limiter:
+                self.limiter.acquire(priority)
+            try:
+                with metrics.span("switchbot_request"):
+                    res = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                API_RESPONSES.inc(method=method, code="connection_error")
+                if attempt >= self.max_retries or (post and not is_connect_error(e)):
+                    raise
+                logger.warning("APIリクエストをリトライ", method=method, path=path, attempt=attempt + 1, error=str(e))
+                time.sleep(self._backoff(attempt))
+                continue
+
+            if res.status_code != 200:
+                API_RESPONSES.inc(method=method, code=res.status_code)
+
+            if res.status_code in retry_statuses and attempt < self.max_retries:
+                logger.warning("APIリクエストをリトライ", method=method, path=path, attempt=attempt + 1,
+                               status=res.status_code)
+                time.sleep(self._backoff(attempt, res))
+                continue
+
+            try:
+                data = res.json()
+            except ValueError:
+                # JSONでないエラー応答（ゲートウェイの5xxなど）
+                data = {"statusCode": res.status_code, "message": res.text[:200]}
+            if res.status_code == 200:
+                API_RESPONSES.inc(method=method, code=data.get("statusCode", "unknown"))
+            if attempt:
+                # リトライした回数（呼び出し側で更にリトライしないように）
+                data["retries"] = attempt
+            return data
+
+    def get_devices(self, priority="interactive"):
+        """Switchbotデバイスの一覧を取得"""
+        return self.request("GET", "/devices", priority=priority)
+
+    def get_device_status(self, device_id, priority="interactive"):
+        """デバイスのステータスを取得
+
+        Args:
+            device_id: デバイスID
+        """
+        return self.request("GET", f"/devices/{device_id}/status", priority=priority)
+
+    def control_device(self, device_id, command, parameter="default", priority="interactive"):
+        """Switchbotデバイスを操作
+
+        Args:
+            device_id: デバイスID
+            command: コマンド (例: "turnOn", "turnOff", "press")
+            parameter: パラメータ (デフォルト: "default")
+        """
+        data = {
+            "command": command,
+            "parameter": parameter
+        }
+        return self.request("POST", f"/devices/{device_id}/commands", priority=priority, json=data)
+
+# 共有クライアント（モジュール関数から利用、最初に使うときに作成）
+client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """共有クライアントを取得（初回はSWITCH_BOT_TOKENを確認して作成）
+
+    Raises:
+        ValueError: SWITCH_BOT_TOKENが設定されていない
+    """
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                client = SwitchBotClient(get_headers())
+    return client
+
+def _fetch_status(device_id, priority):
+    """ステータスキャッシュから呼ばれるAPIからの取得"""
+    return get_client().get_device_status(device_id, priority)
+
+# デバイスステータスのキャッシュ（同じデバイスへの同時取得は1回にまとめる）
+status_cache = StatusCache(_fetch_status)
+
+# キャッシュ上で既に同じ状態のturnOn/turnOffを送らない（0で無効）
+SKIP_REDUNDANT_COMMANDS = get_env("SKIP_REDUNDANT_COMMANDS", "1") == "1"
+
+def _send_command(device_id, command, parameter, priority):
+    """コマンドキューから呼ばれる実際の送信（デバイスごとに順番に実行される）"""
+    if SKIP_REDUNDANT_COMMANDS and status_cache.is_redundant(device_id, command, parameter):
+        logger.debug("コマンドを省略", command=command, parameter=parameter)
+        return {"statusCode": 100, "message": "skipped: already in the requested state", "body": {}, "skipped": True}
+
+    result = get_client().control_device(device_id, command, parameter, priority)
+    status_cache.record_command(device_id, command, parameter, result)
+    logger.debug("コマンドを送信", command=command, parameter=parameter, priority=priority,
+                 status_code=result.get("statusCode"))
+    return result
+
+# デバイスごとのコマンドキュー（重複の除去・設定値コマンドのまとめ）
+command_queue = CommandQueue(_send_command)
+
+metrics.gauge("status_cache", "デバイスステータスのキャッシュの利用状況", lambda: {
+    (k,): v for k, v in status_cache.stats().items()}, ["kind"])
+metrics.gauge("command_queue", "コマンドキューの利用状況", lambda: {
+    (k,): v for k, v in command_queue.stats().items() if k != "pool"}, ["kind"])
+metrics.gauge("command_queue_depth", "送信待ちのコマンド数", lambda: command_queue.stats()["pool"]["queue_depth"])
 
 # デバイス一覧を取得
-def get_devices():
-    """Switchbotデバイスの一覧を取得"""
-    res = requests.get(
-        "https://api.switch-bot.com/v1.1/devices",
-        headers=headers
-    )
-    return res.json()
+def get_devices(priority="interactive"):
+    """Switchbotデバイスの一覧を取得
+
+    Args:
+        priority: レート制限の優先度（キャッシュ更新などは"background"）
+    """
+    return get_client().get_devices(priority)
 
 # デバイスステータスを取得
-def get_device_status(device_id):
-    """デバイスのステータスを取得
+def get_device_status(device_id, priority="interactive", max_age=None):
+    """デバイスのステータスを取得（デバイスタイプごとの有効期間内はキャッシュから）
 
     Args:
         device_id: デバイスID
+        priority: レート制限の優先度
+        max_age: キャッシュを使う最大経過秒数（0なら必ずAPIから取得）
     """
-    url = f"https://api.switch-bot.com/v1.1/devices/{device_id}/status"
-    res = requests.get(url, headers=headers)
-    return res.json()
+    return status_cache.get(device_id, priority, max_age)
 
 # デバイスを操作
-def control_device(device_id, command, parameter="default"):
+def control_device(device_id, command, parameter="default", priority="interactive"):
     """Switchbotデバイスを操作
 
     Args:
         device_id: デバイスID
         command: コマンド (例: "turnOn", "turnOff", "press")
         parameter: パラメータ (デフォルト: "default")
+        priority: レート制限の優先度（スケジュール実行は"scheduled"）
+
+    同じデバイスへのコマンドは順番に送信し、重複したコマンドや
+    待機中に新しい値で置き換えられた設定値コマンドは送信しない。
     """
-    url = f"https://api.switch-bot.com/v1.1/devices/{device_id}/commands"
-    data = {
-        "command": command,
-        "parameter": parameter
-    }
-    res = requests.post(url, headers=headers, json=data)
-    return res.json()
+    # キューのワーカーで出力するログにもdevice_idを付ける
+    with bind(device_id=device_id), \
+            metrics.span("switchbot_command", COMMAND_SECONDS, device_type=metrics.device_type(device_id), command=command):
+        return command_queue.execute(device_id, command, parameter, priority)
 
-# シーリングライトの明るさを設定
-def set_ceiling_light_brightness(device_id, brightness):
-    """シーリングライトの明るさを設定
+# 色温度の文字列指定 → ケルビン値
+COLOR_TEMP_MAP = {
+    "warm": 2700,      # 暖色
+    "暖色": 2700,
+    "あたたかい": 2700,
+    "neutral": 4500,   # 中性
+    "昼白色": 4500,
+    "cool": 6500,      # 寒色
+    "white": 6500,
+    "寒色": 6500,
+    "白": 6500,
+}
+
+def brightness_parameter(brightness):
+    """明るさを検証してAPIパラメータに変換
 
     Args:
-        device_id: デバイスID
         brightness: 明るさ (1-100)
     """
     if not 1 <= brightness <= 100:
         raise ValueError("明るさは1-100の範囲で指定してください")
 
-    return control_device(device_id, "setBrightness", str(brightness))
+    return str(brightness)
 
-# シーリングライトの色温度を設定
-def set_ceiling_light_color_temp(device_id, color_temp):
-    """シーリングライトの色温度を設定
+def color_temp_parameter(color_temp):
+    """色温度を検証してAPIパラメータに変換
 
     Args:
-        device_id: デバイスID
         color_temp: 色温度 (2700-6500K) または "warm"/"cool"などの文字列
     """
     # 文字列指定の場合は数値に変換
-    temp_map = {
-        "warm": 2700,      # 暖色
-        "暖色": 2700,
-        "あたたかい": 2700,
-        "neutral": 4500,   # 中性
-        "昼白色": 4500,
-        "cool": 6500,      # 寒色
-        "white": 6500,
-        "寒色": 6500,
-        "白": 6500,
-    }
-
     if isinstance(color_temp, str):
-        color_temp = temp_map.get(color_temp.lower(), 4500)
+        color_temp = COLOR_TEMP_MAP.get(color_temp.lower(), 4500)
 
     if not 2700 <= color_temp <= 6500:
         raise ValueError("色温度は2700-6500の範囲で指定してください")
 
-    return control_device(device_id, "setColorTemperature", str(color_temp))
+    return str(color_temp)
+
+# シーリングライトの明るさを設定
+def set_ceiling_light_brightness(device_id, brightness, priority="interactive"):
+    """シーリングライトの明るさを設定
+
+    Args:
+        device_id: デバイスID
+        brightness: 明るさ (1-100)
+    """
+    return control_device(device_id, "setBrightness", brightness_parameter(brightness), priority)
+
+# シーリングライトの色温度を設定
+def set_ceiling_light_color_temp(device_id, color_temp, priority="interactive"):
+    """シーリングライトの色温度を設定
+
+    Args:
+        device_id: デバイスID
+        color_temp: 色温度 (2700-6500K) または "warm"/"cool"などの文字列
+    """
+    return control_device(device_id, "setColorTemperature", color_temp_parameter(color_temp), priority)
+
+def run_action(device_id, action, params=None, priority="interactive"):
+    """スケジュール・シーンの操作（action + params）を実行
+
+    Args:
+        device_id: デバイスID
+        action: 操作 (例: "turnOn", "setBrightness", "setColorTemperature")
+        params: 追加パラメータ (brightness, color_temp, parameter)
+        priority: レート制限の優先度
+    """
+    params = params or {}
+    if action == "setBrightness":
+        return set_ceiling_light_brightness(device_id, params.get("brightness", 100), priority)
+    if action == "setColorTemperature":
+        return set_ceiling_light_color_temp(device_id, params.get("color_temp", "neutral"), priority)
+    return control_device(device_id, action, params.get("parameter", "default"), priority)
 
 if __name__ == "__main__":
     # デバイス一覧を表示
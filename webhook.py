@@ -0,0 +1,270 @@
+"""Switchbot Webhookの受信サーバー（デバイスの状態変化をステータスキャッシュに反映）
+
+使い方:
+    # 受信サーバーを起動（slack_bot.pyではWEBHOOK_PORTを設定すると自動で起動）
+    python webhook.py serve
+
+    # Switchbotに受信URLを登録・確認・削除
+    python webhook.py setup https://example.com/switchbot/webhook
+    python webhook.py query
+    python webhook.py delete https://example.com/switchbot/webhook
+"""
+import sys
+import hmac
+import json
+import ipaddress
+import threading
+from urllib.parse import urlparse, parse_qs
+from config import get_env
+import utils
+import device_registry
+from log import get_logger, bind
+
+logger = get_logger("webhook")
+
+# 受信サーバーの待ち受けアドレス・ポート（ポート未設定ならslack_bot.pyでは起動しない）
+# ローカル以外で待ち受ける場合はWEBHOOK_SECRETが必要
+WEBHOOK_HOST = get_env("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = get_env("WEBHOOK_PORT", 0, int)
+WEBHOOK_PATH = get_env("WEBHOOK_PATH", "/switchbot/webhook")
+
+# 受信URLに付ける秘密のトークン（?token=...、設定時は一致しないリクエストを拒否）
+WEBHOOK_SECRET = get_env("WEBHOOK_SECRET", "")
+
+# 受け付けるリクエストボディの最大サイズ（バイト、超えると413）
+WEBHOOK_MAX_BODY = 64 * 1024
+
+# Webhookのcontextの項目 → ステータスの項目（値の変換）
+EVENT_FIELDS = {
+    "powerState": ("power", lambda v: str(v).lower()),
+    "brightness": ("brightness", int),
+    "colorTemperature": ("colorTemperature", int),
+    "slidePosition": ("slidePosition", int),
+    "lockState": ("lockState", lambda v: str(v).lower()),
+    "doorMode": ("doorState", lambda v: str(v).lower()),
+    "battery": ("battery", int),
+}
+
+def setup_webhook(url):
+    """受信URLを登録（全デバイスの状態変化を通知）"""
+    return utils.get_client().request("POST", "/webhook/setupWebhook",
+                                      json={"action": "setupWebhook", "url": url, "deviceList": "ALL"})
+
+def query_webhook(url=None):
+    """登録済みの受信URLを確認（urlを指定すると詳細）"""
+    if url:
+        data = {"action": "queryDetails", "urls": [url]}
+    else:
+        data = {"action": "queryUrl"}
+    return utils.get_client().request("POST", "/webhook/queryWebhook", json=data)
+
+def update_webhook(url, enable=True):
+    """受信URLの有効/無効を切り替え"""
+    return utils.get_client().request("POST", "/webhook/updateWebhook",
+                                      json={"action": "updateWebhook", "config": {"url": url, "enable": enable}})
+
+def delete_webhook(url):
+    """受信URLを削除"""
+    return utils.get_client().request("POST", "/webhook/deleteWebhook",
+                                      json={"action": "deleteWebhook", "url": url})
+
+def normalize_device_id(device_id):
+    """デバイスIDとWebhookのdeviceMac（コロン区切り・小文字の場合がある）を比較できる形に"""
+    return str(device_id).replace(":", "").replace("-", "").upper()
+
+def parse_event(event):
+    """WebhookのイベントからデバイスIDとステータスの変化を取り出す
+
+    Returns:
+        (device_id, changes) 状態変化のイベントでなければ (None, {})
+    """
+    context = event.get("context") or {}
+    device_id = context.get("deviceMac")
+    if event.get("eventType") != "changeReport" or not device_id:
+        return None, {}
+
+    changes = {}
+    for key, (field, convert) in EVENT_FIELDS.items():
+        if key in context:
+            try:
+                changes[field] = convert(context[key])
+            except (TypeError, ValueError):
+                continue
+    return device_id, changes
+
+def apply_event(event):
+    """イベントをステータスキャッシュに反映
+
+    Returns:
+        反映したデバイスID（登録されていないデバイス・状態変化以外はNone）
+    """
+    device_id, changes = parse_event(event)
+    if not device_id or not changes:
+        return None
+
+    # デバイス一覧にないデバイスは無視（タイプはデバイス一覧から）
+    key = normalize_device_id(device_id)
+    device = next((d for d in device_registry.get_device_list() if normalize_device_id(d["id"]) == key), None)
+    if device is None:
+        return None
+
+    utils.status_cache.update(device["id"], changes, device_type=device["type"], pushed=True)
+    # 外部で状態が変わったため、直近のコマンドと同じ操作も重複として扱わない
+    utils.command_queue.forget(device["id"])
+    return device["id"]
+
+def is_loopback(host):
+    """ローカル（ループバック）のアドレスか"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def token_matches(token, secret):
+    """受信URLのトークンが一致するか（secretが空なら常に一致、比較時間は一定）"""
+    if not secret:
+        return True
+    return hmac.compare_digest(token.encode("utf-8"), secret.encode("utf-8"))
+
+class WebhookServer:
+    """Webhookを受け取るHTTPサーバー"""
+
+    def __init__(self, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, handler=apply_event):
+        """
+        Args:
+            host: 待ち受けアドレス
+            port: 待ち受けポート（0で空いているポートを自動選択）
+            path: 受信するパス
+            secret: 受信URLの?token=に付ける秘密のトークン（空ならチェックしない）
+            handler: イベントを処理する関数
+
+        Raises:
+            ValueError: ローカル以外のアドレスで待ち受けるのにsecretが設定されていない
+        """
+        if not secret and not is_loopback(host):
+            raise ValueError(f"WEBHOOK_HOST={host}で待ち受けるにはWEBHOOK_SECRETの設定が必要です")
+
+        self.path = path
+        self.secret = secret
+        self.handler = handler
+        self.received = 0
+        self.applied = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+        # http.serverはサーバーを起動するときだけ読み込む
+        from http.server import ThreadingHTTPServer
+
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+
+    @property
+    def url(self):
+        """受信URL（ローカル）"""
+        host, port = self.server.server_address[:2]
+        query = f"?token={self.secret}" if self.secret else ""
+        return f"http://{host}:{port}{self.path}{query}"
+
+    def start(self):
+        """バックグラウンドでサーバーを起動"""
+        threading.Thread(target=self.server.serve_forever, name="webhook", daemon=True).start()
+        return self
+
+    def stop(self):
+        """サーバーを停止"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, key):
+        with self._lock:
+            setattr(self, key, getattr(self, key) + 1)
+
+    def _make_handler(self):
+        from http.server import BaseHTTPRequestHandler
+
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                token = parse_qs(parsed.query).get("token", [""])[0]
+                if parsed.path != webhook.path or not token_matches(token, webhook.secret):
+                    webhook._count("rejected")
+                    return self._reply(404)
+
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0 or length > WEBHOOK_MAX_BODY:
+                    webhook._count("rejected")
+                    self.close_connection = True
+                    return self._reply(413 if length > 0 else 400)
+
+                try:
+                    event = json.loads(self.rfile.read(length).decode("utf-8"))
+                except (ValueError, UnicodeDecodeError):
+                    event = None
+                # イベントとcontextはオブジェクトのみ（配列・文字列などは不正なリクエスト）
+                context = (event.get("context") or {}) if isinstance(event, dict) else None
+                if not isinstance(context, dict):
+                    webhook._count("rejected")
+                    return self._reply(400)
+
+                webhook._count("received")
+                try:
+                    with bind(device_id=context.get("deviceMac")):
+                        if webhook.handler(event):
+                            webhook._count("applied")
+                        logger.debug("Webhookを受信", event_type=event.get("eventType"),
+                                     device_type=context.get("deviceType"))
+                except Exception:
+                    logger.exception("Webhook処理エラー")
+
+                # Switchbotには処理結果に関係なくすぐに応答する
+                self._reply(200)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def stats(self):
+        """受信状況（received, applied, rejected）"""
+        with self._lock:
+            return {"received": self.received, "applied": self.applied, "rejected": self.rejected}
+
+def start_webhook_server():
+    """設定されていればWebhookの受信サーバーを起動（WEBHOOK_PORT未設定ならNone）"""
+    if not WEBHOOK_PORT:
+        return None
+    try:
+        server = WebhookServer().start()
+    except ValueError as e:
+        logger.error("Webhook受信サーバーを起動できません", error=str(e))
+        return None
+    print(f"Webhook受信サーバーを起動しました: {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    return server
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "serve"
+
+    if command == "setup":
+        print(setup_webhook(sys.argv[2]))
+    elif command == "query":
+        print(query_webhook(sys.argv[2] if len(sys.argv) > 2 else None))
+    elif command == "delete":
+        print(delete_webhook(sys.argv[2]))
+    else:
+        server = WebhookServer(port=WEBHOOK_PORT or 8766).start()
+        print(f"Webhook受信サーバーを起動しました: {server.url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,111 @@
+"""キー単位で順序を保つワーカープール"""
+import queue
+import threading
+import contextvars
+from log import get_logger
+
+logger = get_logger("worker_pool")
+
+class KeyedWorkerPool:
+    """複数のタスクを並行実行するワーカープール
+
+    - 同じキー（例: スレッドのts）のタスクは投入順に1つずつ実行する
+    - 異なるキーのタスクは並行して実行する
+    - 待機中のタスクがmax_queue件に達するとsubmitをブロックする（バックプレッシャー）
+    - タスクは投入したスレッドのコンテキスト（ログのrequest_idなど）で実行する
+    """
+
+    def __init__(self, workers=4, max_queue=100, name="worker"):
+        """
+        Args:
+            workers: ワーカースレッド数
+            max_queue: 待機できるタスクの最大数
+            name: スレッド名の接頭辞
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pending = {}             # { key: [(context, func, args, kwargs), ...] } 実行中/待機中のキー
+        self._ready = queue.Queue()    # 実行可能なキー
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._queued = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, key, func, *args, timeout=None, **kwargs):
+        """タスクを投入
+
+        Args:
+            key: 順序を保つ単位のキー
+            func: 実行する関数
+            timeout: キューが空くまで待つ最大秒数（Noneなら無制限に待つ）
+
+        Returns:
+            投入できた場合True、timeout内に空かなかった場合False
+        """
+        with self._not_full:
+            if not self._not_full.wait_for(lambda: self._queued < self.max_queue, timeout):
+                self._rejected += 1
+                return False
+
+            self._queued += 1
+            task = (contextvars.copy_context(), func, args, kwargs)
+            if key in self._pending:
+                # 同じキーのタスクが実行中/待機中なので後ろに並べる
+                self._pending[key].append(task)
+            else:
+                self._pending[key] = [task]
+                self._ready.put(key)
+
+        return True
+
+    def _worker(self):
+        while True:
+            key = self._ready.get()
+
+            with self._lock:
+                context, func, args, kwargs = self._pending[key].pop(0)
+                self._queued -= 1
+                self._in_flight += 1
+                self._not_full.notify()
+
+            try:
+                context.run(func, *args, **kwargs)
+                failed = False
+            except Exception:
+                logger.exception("ワーカーでエラーが発生しました", key=key)
+                failed = True
+
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+                self._failed += failed
+                if self._pending[key]:
+                    self._ready.put(key)
+                else:
+                    del self._pending[key]
+                self._not_full.notify_all()
+
+    def stats(self):
+        """キューの状態（queue_depth: 待機中, in_flight: 実行中）"""
+        with self._lock:
+            return {
+                "queue_depth": self._queued,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "active_keys": len(self._pending),
+                "workers": self.workers,
+                "max_queue": self.max_queue
+            }
+
+    def join(self, timeout=None):
+        """投入済みのタスクが全て終わるまで待つ（テスト・終了処理用）"""
+        with self._not_full:
+            return self._not_full.wait_for(lambda: not self._pending, timeout)